@@ -0,0 +1,213 @@
+"""Таблицы стрельбы: угол возвышения прицела по дальности для каждого снаряда.
+
+Таблица снаряда - CSV-файл в ~/.wt_map_ruler_ballistics, имя файла - название
+снаряда (например, "БР-412Д.csv"). В строке дальность в метрах и возвышение;
+строки с # - комментарии. Необязательный заголовок задаёт единицы второго
+столбца: mil (тысячные, по умолчанию) или deg (градусы):
+
+    range_m, mil
+    100, 0.6
+    500, 3.2
+    1000, 7.1
+
+При загрузке таблица один раз пересчитывается в плотный массив с равным шагом
+STEP_M, поэтому поиск - одна линейная интерполяция между соседними элементами
+без поиска по таблице. Пересчитанные таблицы хранятся в
+~/.cache/wt_map_ruler/ballistics.npz и читаются заново из CSV, только когда
+файлы таблиц изменились. NumPy импортируется, только если таблицы есть.
+"""
+import json
+import os
+import sys
+import zipfile
+
+from wt_core import require_numpy
+
+TABLES_DIR = os.path.expanduser("~/.wt_map_ruler_ballistics")
+CACHE_FILE = os.path.expanduser("~/.cache/wt_map_ruler/ballistics.npz")
+
+# Шаг плотной таблицы, м
+STEP_M = 5.0
+
+# Подписи единиц возвышения
+UNITS = {'mil': 'тыс', 'deg': '°'}
+
+
+class ShellTable:
+    """Возвышение по дальности для одного снаряда"""
+
+    def __init__(self, name, start, step, elevation, unit='mil', end=None):
+        self.name = name
+        self.start = float(start)
+        self.step = float(step)
+        np = require_numpy()
+        self.elevation = np.asarray(elevation, dtype=np.float64)
+        self.unit = unit
+        # Список для одиночных запросов: индексация списка быстрее, чем массива NumPy
+        self.values = self.elevation.tolist()
+        self.last = len(self.values) - 1
+        # Последняя дальность таблицы; массив может заканчиваться на шаг дальше
+        self.max_range = self.start + self.step * self.last if end is None else float(end)
+
+    @property
+    def unit_label(self):
+        return UNITS.get(self.unit, self.unit)
+
+    def lookup(self, meters):
+        """Возвышение для дальности meters или None вне таблицы"""
+        position = (meters - self.start) / self.step
+        if position < 0 or meters > self.max_range:
+            return None
+        index = int(position)
+        if index == self.last:
+            return self.values[index]
+        low = self.values[index]
+        return low + (self.values[index + 1] - low) * (position - index)
+
+    def batch(self, meters):
+        """Возвышения для массива дальностей; вне таблицы - NaN"""
+        np = require_numpy()
+        meters = np.asarray(meters, dtype=np.float64)
+        position = (meters - self.start) / self.step
+        # Сначала ограничиваем, потом приводим к целым: так NaN и огромные значения безопасны
+        index = np.clip(np.nan_to_num(position, nan=0.0), 0, max(0, self.last - 1)).astype(np.int64)
+        upper = np.minimum(index + 1, self.last)
+        low = self.elevation[index]
+        result = low + (self.elevation[upper] - low) * (position - index)
+        result[(position < 0) | (meters > self.max_range)] = np.nan
+        return result
+
+
+def parse_table(path):
+    """Точки таблицы из CSV: (дальности, возвышения, единицы)"""
+    np = require_numpy()
+    ranges = []
+    values = []
+    unit = 'mil'
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            fields = [field.strip() for field in line.replace(';', ',').split(',')]
+            if len(fields) < 2:
+                raise ValueError(f"{path}:{number}: нужны дальность и возвышение")
+            try:
+                ranges.append(float(fields[0]))
+                values.append(float(fields[1]))
+            except ValueError:
+                if ranges:
+                    raise ValueError(f"{path}:{number}: не число: {line!r}") from None
+                # Заголовок: по второму столбцу определяем единицы
+                header = fields[1].lower()
+                unit = 'deg' if header.startswith(('deg', 'град')) else 'mil'
+    if len(ranges) < 2:
+        raise ValueError(f"{path}: в таблице меньше двух строк")
+    order = np.argsort(ranges, kind='stable')
+    ranges = np.asarray(ranges)[order]
+    values = np.asarray(values)[order]
+    if np.any(np.diff(ranges) <= 0):
+        raise ValueError(f"{path}: дальности повторяются")
+    return ranges, values, unit
+
+
+def densify(ranges, values, step=STEP_M):
+    """Плотная таблица с шагом step от первой до последней дальности: (начало, массив)
+
+    Если последняя дальность не кратна шагу, массив продлевается на один шаг
+    за неё, а последний элемент подбирается так, чтобы интерполяция на самой
+    последней дальности давала её значение из CSV. Дальше неё поиск не идёт
+    (ShellTable.max_range).
+    """
+    np = require_numpy()
+    count = int(np.ceil((ranges[-1] - ranges[0]) / step)) + 1
+    grid = ranges[0] + step * np.arange(count)
+    dense = np.interp(grid, ranges, values)
+    if grid[-1] > ranges[-1]:
+        fraction = (ranges[-1] - grid[-2]) / step
+        dense[-1] = dense[-2] + (values[-1] - dense[-2]) / fraction
+    return float(ranges[0]), dense
+
+
+def table_files(directory):
+    try:
+        names = sorted(name for name in os.listdir(directory) if name.lower().endswith('.csv'))
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in names]
+
+
+def signature(paths, step):
+    """Отпечаток набора таблиц: имена, время изменения и размер файлов, шаг"""
+    items = []
+    for path in paths:
+        stat = os.stat(path)
+        items.append([os.path.basename(path), stat.st_mtime_ns, stat.st_size])
+    return json.dumps({'step': step, 'files': items}, ensure_ascii=False)
+
+
+def read_cache(path, expected):
+    np = require_numpy()
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if str(data['signature']) != expected:
+                return None
+            names = data['names'].tolist()
+            units = data['units'].tolist()
+            starts = data['starts']
+            steps = data['steps']
+            ends = data['ends']
+            return {name: ShellTable(name, starts[i], steps[i], data[f'elevation_{i}'], units[i], ends[i])
+                    for i, name in enumerate(names)}
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        # Пустой или обрезанный кэш пересобирается из CSV
+        return None
+
+
+def write_cache(path, sig, tables):
+    """Пишет кэш во временный файл и атомарно заменяет им старый"""
+    np = require_numpy()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    items = list(tables.values())
+    arrays = {f'elevation_{i}': table.elevation for i, table in enumerate(items)}
+    tmp = path + '.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            np.savez(f, signature=np.array(sig), names=np.array([t.name for t in items], dtype=str),
+                     units=np.array([t.unit for t in items], dtype=str),
+                     starts=np.array([t.start for t in items]), steps=np.array([t.step for t in items]),
+                     ends=np.array([t.max_range for t in items]), **arrays)
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def load_tables(directory=TABLES_DIR, cache=CACHE_FILE, step=STEP_M):
+    """Таблицы всех снарядов каталога: словарь название -> ShellTable"""
+    paths = table_files(directory)
+    if not paths:
+        return {}
+    sig = signature(paths, step)
+    tables = read_cache(cache, sig)
+    if tables is not None:
+        return tables
+
+    tables = {}
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        try:
+            ranges, values, unit = parse_table(path)
+        except (OSError, ValueError) as error:
+            print(f"Таблица стрельбы пропущена: {error}", file=sys.stderr)
+            continue
+        start, elevation = densify(ranges, values, step)
+        tables[name] = ShellTable(name, start, step, elevation, unit, ranges[-1])
+    try:
+        write_cache(cache, sig, tables)
+    except OSError as error:
+        print(f"Не удалось сохранить кэш таблиц стрельбы: {error}", file=sys.stderr)
+    return tables
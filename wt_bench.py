@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Бенчмарк отрисовки оверлея на внеэкранной поверхности cairo.
+
+Рисует MapRuler.render в cairo.ImageSurface без показа окна для набора сценариев
+(линейка с временной линией и без неё, калибровка с разным размером сетки) и
+разрешений, выводит перцентили времени кадра и сравнивает их с сохранёнными
+базовыми значениями. При замедлении выше допуска завершается с кодом 1.
+
+GTK нужен X-дисплей, на сервере подойдёт Xvfb:
+
+    xvfb-run python3 wt_bench.py --save-baseline   # записать базу
+    xvfb-run python3 wt_bench.py                   # сравнить с базой
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import cairo
+
+from wt_ruler import MapRuler  # задаёт версии GTK и GDK до импорта gi.repository
+from gi.repository import Gdk
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+RESOLUTIONS = [(500, 480), (1920, 1080), (2560, 1440)]
+
+GRID_SIZES = [100, 350, 900]
+
+
+def make_point(x, y):
+    point = Gdk.EventButton()
+    point.x = x
+    point.y = y
+    return point
+
+
+def setup_ruler(ruler, width, height, points):
+    ruler.calibration_mode = False
+    ruler.start_point = make_point(width * 0.2, height * 0.7) if points else None
+    ruler.end_point = make_point(width * 0.8, height * 0.3) if points == 'fixed' else None
+    ruler.temp_point = None
+
+
+def ruler_empty(ruler, width, height, frame):
+    if frame == 0:
+        setup_ruler(ruler, width, height, None)
+
+
+def ruler_fixed(ruler, width, height, frame):
+    if frame == 0:
+        setup_ruler(ruler, width, height, 'fixed')
+
+
+def ruler_temp(ruler, width, height, frame):
+    if frame == 0:
+        setup_ruler(ruler, width, height, 'temp')
+    # Мышь движется по окну: каждый кадр новая временная линия и подпись
+    ruler.temp_point = (width * 0.3 + frame % 200 * width * 0.003,
+                        height * 0.6 - frame % 150 * height * 0.003)
+
+
+def calibration(grid_size, drag):
+    def scenario(ruler, width, height, frame):
+        if frame == 0:
+            ruler.calibration_mode = True
+            ruler.start_point = ruler.end_point = ruler.temp_point = None
+            ruler.grid_size = grid_size
+            ruler.grid_pos = (150, 20)
+        if drag:
+            # Перетаскивание сетки: статичный слой перестраивается каждый кадр
+            ruler.grid_pos = (150 + frame % 40, 20 + frame % 30)
+    return scenario
+
+
+def scenarios():
+    cases = [('ruler-empty', ruler_empty),
+             ('ruler-fixed', ruler_fixed),
+             ('ruler-temp', ruler_temp)]
+    for size in GRID_SIZES:
+        cases.append((f'calib-{size}', calibration(size, False)))
+        cases.append((f'calib-{size}-drag', calibration(size, True)))
+    return cases
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_case(ruler, scenario, width, height, frames, warmup):
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    cr = cairo.Context(surface)
+    # Новый размер - новый статичный слой, как при изменении окна
+    ruler.static_layer_key = None
+    timings = []
+    for frame in range(warmup + frames):
+        scenario(ruler, width, height, frame)
+        started = time.perf_counter_ns()
+        ruler.render(cr, width, height)
+        surface.flush()
+        elapsed = time.perf_counter_ns() - started
+        if frame >= warmup:
+            timings.append(elapsed / 1e6)
+    timings.sort()
+    return {'p50': percentile(timings, 0.50),
+            'p95': percentile(timings, 0.95),
+            'p99': percentile(timings, 0.99)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк отрисовки оверлея")
+    parser.add_argument('--frames', type=int, default=300, help="кадров на сценарий")
+    parser.add_argument('--warmup', type=int, default=20, help="прогревочных кадров")
+    parser.add_argument('--filter', default='', help="запускать только сценарии, содержащие строку")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="файл базовых значений")
+    parser.add_argument('--save-baseline', action='store_true', help="записать результаты как базу")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="допустимый рост p95 относительно базы (0.25 = 25%%)")
+    parser.add_argument('--min-delta', type=float, default=0.05,
+                        help="рост p95 в мс, который считается шумом")
+    args = parser.parse_args(argv)
+
+    # Отдельный файл настроек, чтобы не трогать калибровку пользователя
+    config_dir = tempfile.mkdtemp(prefix="wt_bench_")
+    ruler = MapRuler(config_file=os.path.join(config_dir, "calibration.ini"))
+    ruler.scale_factor = 3.5
+
+    results = {}
+    for name, scenario in scenarios():
+        if args.filter not in name:
+            continue
+        for width, height in RESOLUTIONS:
+            key = f'{name}@{width}x{height}'
+            results[key] = run_case(ruler, scenario, width, height, args.frames, args.warmup)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    regressions = []
+    print(f"{'сценарий':<32}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'база p95':>10}")
+    for key, stats in results.items():
+        base = baseline.get(key)
+        base_text = f"{base['p95']:10.3f}" if base else f"{'-':>10}"
+        mark = ''
+        if base and not args.save_baseline:
+            limit = max(base['p95'] * (1 + args.tolerance), base['p95'] + args.min_delta)
+            if stats['p95'] > limit:
+                regressions.append(key)
+                mark = '  ЗАМЕДЛЕНИЕ'
+        print(f"{key:<32}{stats['p50']:10.3f}{stats['p95']:10.3f}{stats['p99']:10.3f}{base_text}{mark}")
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"База сохранена в {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"Замедление в {len(regressions)} сценариях: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""Быстрый захват областей экрана X11 в массивы NumPy.
+
+Основной способ - расширение MIT-SHM: X-сервер записывает изображение прямо в
+сегмент общей памяти, а массив NumPy - представление этого сегмента, поэтому
+на кадр нет ни копирования, ни выделения памяти. Если MIT-SHM недоступно
+(удалённый дисплей, контейнер без общей памяти), снимок берётся XGetImage и
+копируется в заранее выделенный массив.
+
+Каждая область захвата (ключ) имеет свой буфер: массив остаётся действительным
+до следующего захвата по тому же ключу. Повторный запрос той же области чаще,
+чем max_fps раз в секунду, возвращает прошлый снимок без обращения к серверу.
+
+Проверка под Xvfb:
+
+    xvfb-run python3 wt_capture.py --selftest
+"""
+import ctypes
+import sys
+import time
+
+import numpy as np
+
+import wt_metrics
+import wt_x11 as x11
+
+# Сегменты общей памяти System V
+IPC_PRIVATE = 0
+IPC_CREAT = 0o1000
+IPC_RMID = 0
+
+libc = ctypes.CDLL(None, use_errno=True)
+libc.shmget.restype = ctypes.c_int
+libc.shmget.argtypes = (ctypes.c_int, ctypes.c_size_t, ctypes.c_int)
+libc.shmat.restype = ctypes.c_void_p
+libc.shmat.argtypes = (ctypes.c_int, ctypes.c_void_p, ctypes.c_int)
+libc.shmdt.restype = ctypes.c_int
+libc.shmdt.argtypes = (ctypes.c_void_p,)
+libc.shmctl.restype = ctypes.c_int
+libc.shmctl.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_void_p)
+
+
+def check_format(image):
+    """Поддерживается только 32 бита на пиксель в порядке BGRX (почти любой TrueColor)"""
+    if (image.bits_per_pixel != 32 or image.byte_order != x11.LSBFirst
+            or image.red_mask != 0xff0000 or image.blue_mask != 0xff):
+        raise OSError(f"неподдерживаемый формат изображения: {image.bits_per_pixel} бит, "
+                      f"маска красного {image.red_mask:#x}")
+
+
+class ShmBuffer:
+    """Изображение MIT-SHM заданного размера и массив поверх его памяти"""
+
+    def __init__(self, display, screen, width, height):
+        self.display = display
+        self.info = x11.XShmSegmentInfo(shmid=-1)
+        self.attached = False
+        self.width = width
+        self.height = height
+        self.image = x11.XShmCreateImage(display, x11.XDefaultVisual(display, screen),
+                                         x11.XDefaultDepth(display, screen), x11.ZPixmap, None,
+                                         ctypes.byref(self.info), width, height)
+        if not self.image:
+            raise OSError("XShmCreateImage не создал изображение")
+        image = self.image.contents
+        try:
+            check_format(image)
+        except OSError:
+            x11.XDestroyImage(self.image)
+            self.image = None
+            raise
+        size = image.bytes_per_line * height
+
+        self.info.shmid = libc.shmget(IPC_PRIVATE, size, IPC_CREAT | 0o600)
+        if self.info.shmid < 0:
+            self.close()
+            raise OSError(ctypes.get_errno(), "shmget не выделил общую память")
+        address = libc.shmat(self.info.shmid, None, 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            self.close()
+            raise OSError(ctypes.get_errno(), "shmat не подключил общую память")
+        self.info.shmaddr = image.data = address
+        self.info.readOnly = 0
+
+        # Подключение не удаётся, если сервер на другой машине или в другом пространстве IPC
+        with x11.ErrorTrap(display) as trap:
+            x11.XShmAttach(display, ctypes.byref(self.info))
+        # Сегмент удалится, когда от него отключатся и мы, и сервер, - даже при аварии
+        libc.shmctl(self.info.shmid, IPC_RMID, None)
+        if trap.errors:
+            self.close()
+            raise OSError("X-сервер не подключил общую память MIT-SHM")
+        self.attached = True
+
+        raw = (ctypes.c_uint8 * size).from_address(address)
+        bgrx = np.frombuffer(raw, dtype=np.uint8).reshape(height, image.bytes_per_line // 4, 4)
+        # Каналы в обратном порядке - представление RGB без копирования
+        self.rgb = bgrx[:, :width, 2::-1]
+
+    def grab(self, root, x, y):
+        """Снимок или None, если X-сервер ответил ошибкой (например, BadMatch при смене экрана)"""
+        with x11.ErrorTrap(self.display) as trap:
+            ok = x11.XShmGetImage(self.display, root, self.image, x, y, x11.AllPlanes)
+        if trap.errors or not ok:
+            return None
+        return self.rgb
+
+    def close(self):
+        if self.image is None:
+            return
+        if self.attached:
+            x11.XShmDetach(self.display, ctypes.byref(self.info))
+            x11.XSync(self.display, 0)
+        if self.info.shmaddr:
+            libc.shmdt(self.info.shmaddr)
+        elif self.info.shmid >= 0:
+            libc.shmctl(self.info.shmid, IPC_RMID, None)
+        # Изображение MIT-SHM не владеет памятью: XDestroyImage освобождает только заголовок
+        x11.XDestroyImage(self.image)
+        self.image = None
+
+
+class CopyBuffer:
+    """Массив, в который копируется результат XGetImage"""
+
+    def __init__(self, display, screen, width, height):
+        self.display = display
+        self.width = width
+        self.height = height
+        self.rgba = np.empty((height, width, 4), dtype=np.uint8)
+        self.rgb = self.rgba[..., 2::-1]
+        self.checked = False
+
+    def grab(self, root, x, y):
+        """Снимок или None, если X-сервер ответил ошибкой (например, BadMatch при смене экрана)"""
+        with x11.ErrorTrap(self.display) as trap:
+            image_p = x11.XGetImage(self.display, root, x, y, self.width, self.height,
+                                    x11.AllPlanes, x11.ZPixmap)
+        if not image_p:
+            return None
+        if trap.errors:
+            x11.XDestroyImage(image_p)
+            return None
+        try:
+            image = image_p.contents
+            if not self.checked:
+                check_format(image)
+                self.checked = True
+            raw = (ctypes.c_uint8 * (image.bytes_per_line * self.height)).from_address(image.data)
+            bgrx = np.frombuffer(raw, dtype=np.uint8).reshape(self.height, image.bytes_per_line // 4, 4)
+            np.copyto(self.rgba, bgrx[:, :self.width])
+        finally:
+            x11.XDestroyImage(image_p)
+        return self.rgb
+
+    def close(self):
+        pass
+
+
+class ScreenCapture:
+    """Захват прямоугольников корневого окна по ключам областей.
+
+    grab(key, x, y, width, height) возвращает массив (высота, ширина, 3) RGB и
+    экранные координаты его левого верхнего угла: область обрезается по краям
+    экрана, и у её края угол снимка не совпадает с запрошенным. Массив - общий
+    буфер ключа: его содержимое меняется при следующем захвате того же ключа.
+    """
+
+    def __init__(self, max_fps=30, use_shm=True, display_name=None):
+        self.display = x11.XOpenDisplay(display_name)
+        if not self.display:
+            raise OSError("нет соединения с X-сервером")
+        self.screen = x11.XDefaultScreen(self.display)
+        self.root = x11.XDefaultRootWindow(self.display)
+        self.screen_size = (x11.XDisplayWidth(self.display, self.screen),
+                            x11.XDisplayHeight(self.display, self.screen))
+        self.interval = 1 / max_fps if max_fps > 0 else 0
+        self.use_shm = use_shm and x11.xext is not None and bool(x11.XShmQueryExtension(self.display))
+        self.buffers = {}  # ключ -> буфер
+        self.last = {}  # ключ -> (область, время захвата, массив)
+        self.grab_ms = wt_metrics.RingStats(256)
+        self.grabs = 0
+        self.throttled = 0
+
+    @property
+    def method(self):
+        return "MIT-SHM" if self.use_shm else "XGetImage"
+
+    def buffer(self, key, width, height):
+        buf = self.buffers.get(key)
+        if buf is not None and (buf.width, buf.height) == (width, height):
+            return buf
+        if buf is not None:
+            buf.close()
+            del self.buffers[key]
+        if self.use_shm:
+            try:
+                buf = ShmBuffer(self.display, self.screen, width, height)
+            except OSError as error:
+                print(f"MIT-SHM недоступно, захват через XGetImage: {error}", file=sys.stderr)
+                self.use_shm = False
+        if not self.use_shm:
+            buf = CopyBuffer(self.display, self.screen, width, height)
+        self.buffers[key] = buf
+        return buf
+
+    def grab(self, key, x, y, width, height):
+        """(снимок, (x, y) его угла на экране) или None, если область за пределами экрана
+        или X-сервер не отдал снимок"""
+        x0 = max(0, int(x))
+        y0 = max(0, int(y))
+        x1 = min(self.screen_size[0], int(x + width))
+        y1 = min(self.screen_size[1], int(y + height))
+        if x1 <= x0 or y1 <= y0:
+            return None
+        rect = (x0, y0, x1 - x0, y1 - y0)
+
+        now = time.perf_counter()
+        last = self.last.get(key)
+        if last is not None and last[0] == rect and now - last[1] < self.interval:
+            self.throttled += 1
+            return last[2], rect[:2]
+
+        buf = self.buffer(key, rect[2], rect[3])
+        image = buf.grab(self.root, x0, y0)
+        if image is None:
+            # Ошибка одного снимка не повод отказываться от захвата: пробуем в следующий раз
+            self.last.pop(key, None)
+            return None
+        self.last[key] = (rect, now, image)
+        self.grabs += 1
+        self.grab_ms.add((time.perf_counter() - now) * 1000)
+        return image, rect[:2]
+
+    def close(self):
+        for buf in self.buffers.values():
+            buf.close()
+        self.buffers.clear()
+        self.last.clear()
+        if self.display:
+            x11.XCloseDisplay(self.display)
+            self.display = None
+
+
+def selftest(rounds=200, size=(640, 480)):
+    """Сравнивает MIT-SHM и XGetImage на одной области и измеряет время захвата"""
+    results = {}
+    for use_shm in (True, False):
+        capture = ScreenCapture(max_fps=0, use_shm=use_shm)
+        try:
+            first = capture.grab('test', 0, 0, *size)
+            if first is None:
+                print("Область теста за пределами экрана или снимок не получен", file=sys.stderr)
+                return 1
+            address = first[0].__array_interface__['data'][0]
+            reused = True
+            for _ in range(rounds):
+                image, _ = capture.grab('test', 0, 0, *size)
+                reused &= image.__array_interface__['data'][0] == address
+            stats = capture.grab_ms.summary()
+            print(f"{capture.method}: {image.shape[1]}x{image.shape[0]}, снимков {stats['count']}, "
+                  f"мс p50 {stats['p50']:.3f}, p95 {stats['p95']:.3f}, max {stats['max']:.3f}, "
+                  f"буфер {'один' if reused else 'НОВЫЙ на кадр'}")
+            results[capture.method] = (image.copy(), reused)
+        finally:
+            capture.close()
+
+    failed = any(not reused for _, reused in results.values())
+    if len(results) == 2:
+        shm, plain = (image for image, _ in results.values())
+        if not np.array_equal(shm, plain):
+            print("Снимки MIT-SHM и XGetImage различаются", file=sys.stderr)
+            failed = True
+    else:
+        print("MIT-SHM недоступно, проверен только XGetImage", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--selftest']:
+        sys.exit(selftest())
+    print(__doc__)
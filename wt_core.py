@@ -0,0 +1,688 @@
+#!/usr/bin/env python3
+"""Расчёт расстояний дальномера без GTK.
+
+Читает тот же файл калибровки, что и оверлей (~/.wt_map_ruler_calibration.ini),
+и переводит пиксели в метры как для одной пары точек, так и пакетно через NumPy.
+
+Пакетный режим из командной строки: пары координат в формате JSONL на stdin,
+расстояния на stdout:
+
+    echo '[10, 20, 110, 20]' | python3 wt_core.py --scale 225
+    echo '{"id": 1, "a": [10, 20], "b": [110, 20]}' | python3 wt_core.py --all-scales
+    echo '[10, 20, 410, 20]' | python3 wt_core.py --shell "БР-412Д"   # и возвышение прицела
+"""
+from array import array
+from collections import namedtuple
+import itertools
+import math
+import os
+import sys
+import threading
+import time
+
+# NumPy, json, configparser и argparse импортируются по требованию: оверлею они не нужны
+# до первого кадра, а NumPy - только для пакетного расчёта
+np = None
+
+# Список масштабов карт
+MAP_SCALES = [150, 170, 180, 190, 200, 225, 250, 275, 300, 325, 350, 400, 450, 500, 550]
+
+# Количество квадратов сетки калибровки по каждой стороне
+GRID_CELLS = 7
+
+CONFIG_FILE = os.path.expanduser("~/.wt_map_ruler_calibration.ini")
+
+# Последняя исправная копия файла настроек
+BACKUP_SUFFIX = ".bak"
+
+# Масштаб интерфейса игры по умолчанию (рекомендуемый масштаб мини-карты, %)
+DEFAULT_GAME_UI_SCALE = 133
+
+# Рабочее место, для которого хранится отдельная калибровка: разъём монитора,
+# разрешение в логических пикселях, масштаб HiDPI и масштаб интерфейса игры
+DisplayKey = namedtuple('DisplayKey', 'connector width height scale ui_scale')
+
+
+def require_numpy():
+    """Импортирует NumPy при первом пакетном расчёте"""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise RuntimeError("Для пакетного расчёта нужен NumPy: pip3 install numpy")
+        np = numpy
+    return np
+
+
+class Calibration:
+    """Калибровка: метры на пиксель для базового масштаба карты и положение сетки"""
+
+    def __init__(self, calibrated_scale=None, use_calibrated_scale=False,
+                 calibration_base_scale=None, grid_size=200, grid_pos=(100, 100)):
+        self.calibrated_scale = calibrated_scale
+        self.use_calibrated_scale = use_calibrated_scale
+        self.calibration_base_scale = calibration_base_scale  # Масштаб, использованный при калибровке
+        self.grid_size = grid_size
+        self.grid_pos = grid_pos
+
+    def scale_factor(self, map_scale):
+        """Метры на пиксель для масштаба карты map_scale"""
+        if not self.use_calibrated_scale or self.calibrated_scale is None:
+            return 1.0
+        if self.calibration_base_scale:
+            return self.calibrated_scale * map_scale / self.calibration_base_scale
+        return self.calibrated_scale
+
+
+def calibrate(grid_size, map_scale):
+    """Метры на пиксель по размеру сетки GRID_CELLS x GRID_CELLS и масштабу карты"""
+    # Размер одного квадрата в пикселях; сторона квадрата равна масштабу карты в метрах
+    square_size_px = grid_size / GRID_CELLS
+    return map_scale / square_size_px
+
+
+def read_calibration(config, section='CALIBRATION', grid_section='GRID'):
+    """Калибровка из разобранного ConfigParser; при ошибках - некалиброванное состояние"""
+    import configparser
+    calibration = Calibration()
+    try:
+        # Калиброванные значения
+        calibrated_scale = float(config.get(section, 'calibrated_scale', fallback="0"))
+        calibration.calibrated_scale = calibrated_scale if calibrated_scale > 0 else None
+        calibration.use_calibrated_scale = config.getboolean(section, 'use_calibrated_scale', fallback=False)
+        calibration.calibration_base_scale = config.getint(section, 'calibration_base_scale', fallback=None) or None
+
+        # Параметры сетки
+        calibration.grid_size = config.getfloat(grid_section, 'grid_size', fallback=200)
+        calibration.grid_pos = (
+            config.getfloat(grid_section, 'grid_x', fallback=100),
+            config.getfloat(grid_section, 'grid_y', fallback=100)
+        )
+    except (ValueError, configparser.NoOptionError):
+        calibration.calibrated_scale = None
+        calibration.use_calibrated_scale = False
+        calibration.calibration_base_scale = None
+    return calibration
+
+
+def write_calibration(config, calibration, section='CALIBRATION', grid_section='GRID'):
+    """Записывает калибровку и параметры сетки в ConfigParser"""
+    values = {
+        'calibrated_scale': str(calibration.calibrated_scale) if calibration.calibrated_scale is not None else "0",
+        'use_calibrated_scale': str(calibration.use_calibrated_scale),
+        'calibration_base_scale': str(calibration.calibration_base_scale) if calibration.calibration_base_scale is not None else "0"
+    }
+    grid = {
+        'grid_size': str(calibration.grid_size),
+        'grid_x': str(calibration.grid_pos[0]),
+        'grid_y': str(calibration.grid_pos[1])
+    }
+    if grid_section == section:
+        values.update(grid)
+    config[section] = values
+    if grid_section != section:
+        config[grid_section] = grid
+
+
+class ProfileStore:
+    """Калибровки рабочих мест, доступные по DisplayKey за постоянное время.
+
+    В файле настроек каждый профиль - отдельная секция [PROFILE ...] с полями
+    ключа и калибровки.
+    """
+
+    SECTION_PREFIX = 'PROFILE '
+
+    def __init__(self):
+        self.profiles = {}
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def get(self, key):
+        return self.profiles.get(key)
+
+    def set(self, key, calibration):
+        self.profiles[key] = calibration
+
+    @classmethod
+    def section_name(cls, key):
+        return f"{cls.SECTION_PREFIX}{key.connector} {key.width}x{key.height}@{key.scale} ui{key.ui_scale}"
+
+    def read(self, config):
+        """Загружает профили из ConfigParser, пропуская повреждённые секции"""
+        import configparser
+        self.profiles = {}
+        for section in config.sections():
+            if not section.startswith(self.SECTION_PREFIX):
+                continue
+            try:
+                key = DisplayKey(config.get(section, 'connector'),
+                                 config.getint(section, 'width'),
+                                 config.getint(section, 'height'),
+                                 config.getint(section, 'scale'),
+                                 config.getint(section, 'ui_scale'))
+            except (ValueError, configparser.NoOptionError):
+                continue
+            self.profiles[key] = read_calibration(config, section, section)
+
+    def write(self, config):
+        for key, calibration in self.profiles.items():
+            section = self.section_name(key)
+            write_calibration(config, calibration, section, section)
+            config[section].update({
+                'connector': key.connector,
+                'width': str(key.width),
+                'height': str(key.height),
+                'scale': str(key.scale),
+                'ui_scale': str(key.ui_scale)
+            })
+
+
+def parse_config(path):
+    """ConfigParser из файла или None, если файла нет или он повреждён"""
+    import configparser
+    config = configparser.ConfigParser()
+    try:
+        with open(path, encoding='utf-8') as f:
+            config.read_file(f)
+    except (OSError, UnicodeDecodeError, configparser.Error):
+        return None
+    if not config.has_section('CALIBRATION'):
+        return None
+    return config
+
+
+def read_config(path=CONFIG_FILE):
+    """Настройки из файла, а если он повреждён - из последней исправной копии"""
+    import configparser
+    for candidate in (path, path + BACKUP_SUFFIX):
+        config = parse_config(candidate)
+        if config is not None:
+            return config
+    return configparser.ConfigParser()
+
+
+def load_calibration(path=CONFIG_FILE):
+    """Калибровка из файла настроек оверлея"""
+    return read_calibration(read_config(path))
+
+
+def config_to_text(config):
+    import io
+    buffer = io.StringIO()
+    config.write(buffer)
+    return buffer.getvalue()
+
+
+def atomic_write(path, text, backup_config=True, sync=True):
+    """Записывает файл целиком или не записывает вовсе.
+
+    Текст пишется во временный файл рядом, сбрасывается на диск и подменяет
+    основной файл одним переименованием, так что основной файл существует в
+    любой момент. Прежний файл настроек, если он исправен, до этого становится
+    последней исправной копией с суффиксом BACKUP_SUFFIX (backup_config=False -
+    без копии, для файлов не с настройками). sync=False не ждёт сброса на
+    диск: читатели всё равно видят файл целиком, но после сбоя питания он
+    может оказаться старым.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        if backup_config and parse_config(path) is not None:
+            backup(path)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    if not sync:
+        return
+    # Фиксируем переименования в каталоге
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def backup(path):
+    """Копия файла с суффиксом BACKUP_SUFFIX; сам файл не трогается"""
+    backup_path = path + BACKUP_SUFFIX
+    tmp_path = f"{backup_path}.tmp.{os.getpid()}"
+    try:
+        try:
+            os.link(path, tmp_path)
+        except OSError:
+            # Файловая система без жёстких ссылок
+            import shutil
+            shutil.copy2(path, tmp_path)
+        os.replace(tmp_path, backup_path)
+    except OSError as e:
+        # Без копии настройки всё равно сохраняются
+        print(f"Не удалось обновить копию настроек {backup_path}: {e}", file=sys.stderr)
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+class ConfigWriter:
+    """Запись настроек в фоновом потоке.
+
+    Изменения, пришедшие чаще чем раз в delay секунд, объединяются: на диск
+    попадает только последнее состояние. Вызывающий поток не блокируется.
+    """
+
+    def __init__(self, path, delay=0.5):
+        self.path = path
+        self.delay = delay
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.pending = None
+        self.version = 0  # Номер последнего запланированного состояния
+        self.written = 0  # Номер состояния, записанного на диск
+        self.finished = 0  # Номер последнего состояния, запись которого завершена (или не удалась)
+        self.deadline = 0
+        self.thread = None
+
+    def schedule(self, text):
+        """Планирует запись текста настроек"""
+        with self.condition:
+            self.version += 1
+            self.pending = (self.version, text)
+            self.deadline = time.monotonic() + self.delay
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="config-writer", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def take(self):
+        with self.condition:
+            pending = self.pending
+            self.pending = None
+            return pending
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                # Ждём, пока поток изменений не утихнет
+                remaining = self.deadline - time.monotonic()
+                while remaining > 0 and self.pending is not None:
+                    self.condition.wait(remaining)
+                    remaining = self.deadline - time.monotonic()
+            pending = self.take()
+            if pending is not None:
+                self.write(*pending)
+
+    def write(self, version, text):
+        with self.write_lock:
+            try:
+                # Более новое состояние уже могло быть записано через flush()
+                if version <= self.written:
+                    return
+                try:
+                    atomic_write(self.path, text)
+                except OSError as e:
+                    print(f"Не удалось сохранить настройки в {self.path}: {e}", file=sys.stderr)
+                    return
+                self.written = version
+            finally:
+                with self.condition:
+                    self.finished = max(self.finished, version)
+                    self.condition.notify_all()
+
+    def flush(self, timeout=5.0):
+        """Немедленно записывает отложенное состояние, например при выходе"""
+        with self.condition:
+            target = self.version
+        pending = self.take()
+        if pending is not None:
+            self.write(*pending)
+        # Последнее состояние мог уже забрать фоновый поток: он служебный и при выходе
+        # будет остановлен, поэтому дожидаемся конца его записи
+        with self.condition:
+            self.condition.wait_for(lambda: self.finished >= target, timeout)
+
+
+def distance_px(x1, y1, x2, y2):
+    """Расстояние между точками в пикселях"""
+    return math.hypot(x2 - x1, y2 - y1)
+
+
+def distance_m(x1, y1, x2, y2, scale_factor):
+    """Расстояние между точками в метрах при scale_factor метров на пиксель"""
+    return math.hypot(x2 - x1, y2 - y1) * scale_factor
+
+
+class PathMeasure:
+    """Маршрут из нескольких точек и длины его участков в пикселях.
+
+    Длины участков лежат в array('d'), их частичные суммы - в дереве Фенвика.
+    Перемещение точки меняет не больше двух участков: общая длина обновляется
+    за O(1), длина маршрута до любой точки считается за O(log n).
+    """
+
+    def __init__(self):
+        self.xs = array('d')
+        self.ys = array('d')
+        self.lengths = array('d')  # Участок i - от точки i до точки i + 1
+        self.tree = array('d')  # Дерево Фенвика над lengths, элемент k отвечает за индекс k + 1
+        self.total = 0.0
+
+    def __len__(self):
+        return len(self.xs)
+
+    def point(self, index):
+        return self.xs[index], self.ys[index]
+
+    def segment(self, index):
+        """Концы участка index: (x1, y1, x2, y2)"""
+        return self.xs[index], self.ys[index], self.xs[index + 1], self.ys[index + 1]
+
+    def leg_length(self, index):
+        xs = self.xs
+        ys = self.ys
+        return math.hypot(xs[index + 1] - xs[index], ys[index + 1] - ys[index])
+
+    def distance_to(self, index):
+        """Длина маршрута от первой точки до точки index"""
+        total = 0.0
+        tree = self.tree
+        while index > 0:
+            total += tree[index - 1]
+            index &= index - 1
+        return total
+
+    def append(self, x, y):
+        self.xs.append(x)
+        self.ys.append(y)
+        if len(self.xs) < 2:
+            return
+        length = self.leg_length(len(self.lengths))
+        self.lengths.append(length)
+        # Новый узел дерева покрывает участки (k - lowbit(k), k]
+        k = len(self.lengths)
+        self.tree.append(length + self.distance_to(k - 1) - self.distance_to(k & (k - 1)))
+        self.total += length
+
+    def pop(self):
+        """Удаляет последнюю точку маршрута"""
+        if not self.xs:
+            return
+        self.xs.pop()
+        self.ys.pop()
+        if self.lengths:
+            self.total -= self.lengths.pop()
+            self.tree.pop()
+        if not self.lengths:
+            self.total = 0.0
+
+    def clear(self):
+        self.__init__()
+
+    def move(self, index, x, y):
+        """Переносит точку index и пересчитывает два прилегающих участка"""
+        self.xs[index] = x
+        self.ys[index] = y
+        for leg in (index - 1, index):
+            if 0 <= leg < len(self.lengths):
+                length = self.leg_length(leg)
+                delta = length - self.lengths[leg]
+                self.lengths[leg] = length
+                self.total += delta
+                k = leg + 1
+                while k <= len(self.tree):
+                    self.tree[k - 1] += delta
+                    k += k & -k
+
+
+class SpatialHash:
+    """Равномерная сетка ячеек для поиска интерактивных элементов под мышью.
+
+    Элемент - круг радиусом radius вокруг (x, y) с ключом-кортежем (вид, имя).
+    Он записывается во все ячейки, которые задевает, поэтому поиск смотрит
+    одну ячейку и не зависит от общего числа элементов. Перемещение элемента
+    в пределах тех же ячеек меняет только его координаты.
+    """
+
+    def __init__(self, cell_size=32):
+        self.cell_size = cell_size
+        self.cells = {}  # (cx, cy) -> {ключ: (x, y, квадрат радиуса)}
+        self.items = {}  # ключ -> (x, y, radius, ячейки)
+
+    def __len__(self):
+        return len(self.items)
+
+    def cells_for(self, x, y, radius):
+        size = self.cell_size
+        x1 = int((x - radius) // size)
+        x2 = int((x + radius) // size)
+        y1 = int((y - radius) // size)
+        y2 = int((y + radius) // size)
+        return tuple((cx, cy) for cx in range(x1, x2 + 1) for cy in range(y1, y2 + 1))
+
+    def update(self, key, x, y, radius):
+        """Добавляет элемент или переносит уже известный"""
+        old = self.items.get(key)
+        cells = self.cells_for(x, y, radius)
+        if old is not None and old[3] != cells:
+            self.unlink(key, old[3])
+        # Координаты хранятся и в ячейках: поиску не нужен второй словарь
+        entry = (x, y, radius * radius)
+        for cell in cells:
+            bucket = self.cells.get(cell)
+            if bucket is None:
+                self.cells[cell] = bucket = {}
+            bucket[key] = entry
+        self.items[key] = (x, y, radius, cells)
+
+    def remove(self, key):
+        old = self.items.pop(key, None)
+        if old is not None:
+            self.unlink(key, old[3])
+
+    def unlink(self, key, cells):
+        for cell in cells:
+            bucket = self.cells[cell]
+            del bucket[key]
+            if not bucket:
+                del self.cells[cell]
+
+    def query(self, x, y, kinds=None):
+        """Ключ ближайшего элемента, в круг которого попадает (x, y), или None.
+
+        kinds - виды элементов, которые нужно учитывать; None - все.
+        """
+        size = self.cell_size
+        bucket = self.cells.get((int(x // size), int(y // size)))
+        if not bucket:
+            return None
+        best = None
+        best_sq = 0.0
+        for key, (ix, iy, radius_sq) in bucket.items():
+            if kinds is not None and key[0] not in kinds:
+                continue
+            dx = ix - x
+            dy = iy - y
+            dist_sq = dx * dx + dy * dy
+            if dist_sq <= radius_sq and (best is None or dist_sq < best_sq):
+                best = key
+                best_sq = dist_sq
+        return best
+
+
+def batch_distances(pairs, calibration, scales=None):
+    """Расстояния в метрах для N пар точек одним вызовом.
+
+    pairs - массив (N, 4) со строками [x1, y1, x2, y2]. scales - масштаб карты
+    или последовательность масштабов (по умолчанию все MAP_SCALES). Для одного
+    масштаба возвращается массив (N,), для последовательности - (N, len(scales)).
+    """
+    np = require_numpy()
+    pairs = np.asarray(pairs, dtype=np.float64).reshape(-1, 4)
+    pixels = np.hypot(pairs[:, 2] - pairs[:, 0], pairs[:, 3] - pairs[:, 1])
+    if scales is None:
+        scales = MAP_SCALES
+    if np.ndim(scales) == 0:
+        return pixels * calibration.scale_factor(scales)
+    factors = np.array([calibration.scale_factor(scale) for scale in scales])
+    return pixels[:, None] * factors[None, :]
+
+
+def parse_pair(line):
+    """Пара точек из строки JSONL: [x1, y1, x2, y2] или {"id": ..., "a": [x, y], "b": [x, y]}
+
+    Возвращает (id, x1, y1, x2, y2); для записи-массива id равен None.
+    """
+    line = line.strip()
+    if line[0] == '[':
+        # Быстрый путь для самого частого формата без полного разбора JSON
+        x1, y1, x2, y2 = line[1:-1].split(',')
+        return None, float(x1), float(y1), float(x2), float(y2)
+    import json
+    item = json.loads(line)
+    return (item.get('id'), float(item['a'][0]), float(item['a'][1]),
+            float(item['b'][0]), float(item['b'][1]))
+
+
+# Ошибки разбора одной строки входных данных
+PARSE_ERRORS = (ValueError, KeyError, IndexError, TypeError, AttributeError)
+
+
+def error_record(number, error):
+    """Запись JSONL об ошибке в строке number вместо её расстояния"""
+    import json
+    message = f"нет поля {error}" if isinstance(error, KeyError) else str(error) or type(error).__name__
+    return json.dumps({'error': message, 'line': number}, ensure_ascii=False)
+
+
+def stream_distances(lines, out, calibration, scales, chunk_size=65536, shell=None):
+    """Читает пары точек из lines и пишет расстояния в out, обрабатывая их блоками.
+
+    shell - таблица стрельбы (wt_ballistics.ShellTable): к каждому расстоянию
+    добавляется возвышение прицела, вне таблицы - null. Вместо расстояния для
+    строки с ошибкой пишется {"error": ..., "line": номер строки}. Возвращает
+    число таких строк.
+    """
+    import json
+    np = require_numpy()
+    single = np.ndim(scales) == 0
+    if single:
+        template = '"px": %.3f, "m": %.2f'
+        elevation_template = ', "elev": %s}'
+    else:
+        fields = ', '.join(f'"{scale}": %.2f' for scale in scales)
+        template = '"px": %.3f, "m": {' + fields + '}'
+        elevation_template = ', "elev": {' + ', '.join(f'"{scale}": %s' for scale in scales) + '}}'
+    if shell is None:
+        template += '}'
+    else:
+        template += elevation_template
+    numbered = ((number, line) for number, line in enumerate(lines, 1) if line.strip())
+    errors = 0
+    while True:
+        block = list(itertools.islice(numbered, chunk_size))
+        if not block:
+            break
+        # Строка с ошибкой не прерывает обработку: на её месте будет запись об ошибке
+        parsed = []
+        for number, line in block:
+            try:
+                parsed.append((number, parse_pair(line)))
+            except PARSE_ERRORS as error:
+                parsed.append((number, error_record(number, error)))
+        chunk = [item for _, item in parsed if not isinstance(item, str)]
+        values = []
+        finite = []
+        if chunk:
+            pairs = np.array([item[1:] for item in chunk], dtype=np.float64)
+            pixels = np.hypot(pairs[:, 2] - pairs[:, 0], pairs[:, 3] - pairs[:, 1])
+            meters = batch_distances(pairs, calibration, scales)
+            values = np.column_stack((pixels, meters)).tolist()
+            # nan и inf (например, из координат "NaN" или 1e400) - не JSON: такая строка - ошибка
+            finite = [all(map(math.isfinite, row)) for row in values]
+            if shell is not None:
+                # Возвышение всех строк блока - одна векторная интерполяция
+                elevation = shell.batch(meters).reshape(len(chunk), -1)
+                text = np.where(np.isnan(elevation), 'null', np.char.mod('%.2f', elevation))
+                values = [row + elev for row, elev in zip(values, text.tolist())]
+        rows = iter(zip(values, finite))
+        records = []
+        for number, item in parsed:
+            if isinstance(item, str):
+                errors += 1
+                records.append(item)
+                continue
+            row, row_finite = next(rows)
+            if not row_finite:
+                errors += 1
+                records.append(error_record(number, ValueError("расстояние не является конечным числом")))
+                continue
+            prefix = '{' if item[0] is None else '{"id": %s, ' % json.dumps(item[0], ensure_ascii=False)
+            records.append(prefix + template % tuple(row))
+        out.write('\n'.join(records) + '\n')
+    return errors
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Пакетный перевод пар координат (JSONL на stdin) в метры")
+    parser.add_argument('--config', default=CONFIG_FILE, help="файл калибровки")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--scale', type=int, help="масштаб карты (по умолчанию - базовый масштаб калибровки)")
+    group.add_argument('--all-scales', action='store_true', help="расстояния для всех масштабов MAP_SCALES")
+    parser.add_argument('--chunk', type=int, default=65536, help="размер обрабатываемого блока")
+    parser.add_argument('--shell', help="снаряд из ~/.wt_map_ruler_ballistics: добавить возвышение прицела")
+    args = parser.parse_args(argv)
+
+    try:
+        require_numpy()
+    except RuntimeError as e:
+        parser.error(str(e))
+    calibration = load_calibration(args.config)
+    if not calibration.use_calibrated_scale or calibration.calibrated_scale is None:
+        print("Внимание: калибровка не найдена, используется 1 м/пикс", file=sys.stderr)
+    if args.all_scales:
+        scales = MAP_SCALES
+    else:
+        scales = args.scale or calibration.calibration_base_scale or 225
+
+    shell = None
+    if args.shell:
+        import wt_ballistics
+        tables = wt_ballistics.load_tables()
+        if args.shell not in tables:
+            known = ', '.join(tables) or "нет таблиц"
+            parser.error(f"нет таблицы снаряда {args.shell!r} ({known})")
+        shell = tables[args.shell]
+
+    try:
+        errors = stream_distances(sys.stdin, sys.stdout, calibration, scales, max(1, args.chunk), shell)
+    except BrokenPipeError:
+        return 0
+    if errors:
+        print(f"Строк с ошибками во входных данных: {errors} (записи с полем error)", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
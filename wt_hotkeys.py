@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""Глобальные горячие клавиши X11 для оверлея.
+
+Клавиши перехватываются XGrabKey на корневом окне через отдельное соединение с
+X-сервером, поэтому работают, пока фокус у игры, и не забирают его. События
+читает поток-слушатель, действия передаются в цикл GTK функцией dispatch
+(обычно GLib.idle_add). Для каждого действия измеряется задержка от получения
+события потоком до выполнения действия.
+
+Проверка под Xvfb (нужна libXtst для имитации нажатий):
+
+    xvfb-run python3 wt_hotkeys.py --selftest
+"""
+import os
+import select
+import sys
+import threading
+import time
+
+import wt_metrics
+import wt_x11 as x11
+
+# Действия оверлея и клавиши по умолчанию
+DEFAULT_BINDINGS = {
+    'reset': 'Ctrl+Alt+R',
+    'top': 'Ctrl+Alt+T',
+    'mode': 'Ctrl+Alt+C',
+    'path': 'Ctrl+Alt+P',
+    'rings': 'Ctrl+Alt+G',
+    'detect': 'Ctrl+Alt+D',
+    'minimal': 'Ctrl+Alt+M',
+    'hud': 'Ctrl+Alt+H',
+    'snap': 'Ctrl+Alt+S',
+    'track': 'Ctrl+Alt+K',
+    'point-a': 'Ctrl+Alt+A',
+    'point-b': 'Ctrl+Alt+B',
+}
+
+MODIFIERS = {
+    'shift': x11.ShiftMask,
+    'ctrl': x11.ControlMask,
+    'control': x11.ControlMask,
+    'alt': x11.Mod1Mask,
+    'super': x11.Mod4Mask,
+}
+
+# CapsLock и NumLock не должны мешать сочетаниям: перехватываем все их варианты
+IGNORED_MASKS = (0, x11.LockMask, x11.Mod2Mask, x11.LockMask | x11.Mod2Mask)
+
+
+def parse_binding(text):
+    """'Ctrl+Alt+R' -> (маска модификаторов, имя keysym)"""
+    *mods, key = [part.strip() for part in text.split('+')]
+    mask = 0
+    for mod in mods:
+        try:
+            mask |= MODIFIERS[mod.lower()]
+        except KeyError:
+            raise ValueError(f"неизвестный модификатор {mod!r} в {text!r}") from None
+    if len(key) == 1:
+        key = key.lower()
+    return mask, key
+
+
+class HotkeyListener:
+    """Перехват сочетаний клавиш и передача действий в основной цикл.
+
+    bindings - словарь действие -> сочетание ('Ctrl+Alt+R'), callback(action)
+    вызывается через dispatch(func, *args) в потоке интерфейса. actions -
+    допустимые действия (по умолчанию - действия DEFAULT_BINDINGS).
+    """
+
+    def __init__(self, bindings, callback, dispatch, actions=None):
+        self.bindings = bindings
+        self.callback = callback
+        self.dispatch = dispatch
+        self.actions = frozenset(DEFAULT_BINDINGS if actions is None else actions)
+        self.display = None
+        self.root = None
+        self.grabs = {}  # (keycode, маска) -> действие
+        self.failed = []  # Сочетания, занятые другими программами
+        self.invalid = []  # Ошибки настроек: неизвестные действия и клавиши
+        self.latency = wt_metrics.RingStats(256)
+        self.thread = None
+        self.wake_r = self.wake_w = None
+
+    def parse_bindings(self):
+        """Разбирает все сочетания до перехвата: список (действие, сочетание, маска, keysym)"""
+        parsed = []
+        for action, text in self.bindings.items():
+            if action not in self.actions:
+                self.invalid.append(f"{action} = {text}: неизвестное действие")
+                continue
+            try:
+                mask, key = parse_binding(text)
+            except ValueError as error:
+                self.invalid.append(f"{action} = {text}: {error}")
+                continue
+            keysym = x11.XStringToKeysym(key.encode()) if key.isascii() else 0
+            if not keysym:
+                self.invalid.append(f"{action} = {text}: неизвестная клавиша")
+                continue
+            parsed.append((action, text, mask, keysym))
+        return parsed
+
+    def start(self):
+        """Открывает соединение, перехватывает клавиши и запускает поток-слушатель"""
+        parsed = self.parse_bindings()
+        self.display = x11.XOpenDisplay(None)
+        if not self.display:
+            raise OSError("нет соединения с X-сервером")
+        self.root = x11.XDefaultRootWindow(self.display)
+        try:
+            for action, text, mask, keysym in parsed:
+                keycode = x11.XKeysymToKeycode(self.display, keysym)
+                if not keycode:
+                    self.failed.append(text)
+                    continue
+                # BadAccess приходит, если сочетание уже занято другой программой
+                with x11.ErrorTrap(self.display) as trap:
+                    for extra in IGNORED_MASKS:
+                        x11.XGrabKey(self.display, keycode, mask | extra, self.root, 0,
+                                     x11.GrabModeAsync, x11.GrabModeAsync)
+                if trap.errors:
+                    self.ungrab(keycode, mask)
+                    self.failed.append(text)
+                else:
+                    self.grabs[(keycode, mask)] = action
+
+            self.wake_r, self.wake_w = os.pipe()
+            self.thread = threading.Thread(target=self.run, name="wt-hotkeys", daemon=True)
+            self.thread.start()
+        except BaseException:
+            # Без потока-слушателя перехваченные сочетания глотались бы до выхода из программы
+            self.thread = None
+            self.release()
+            raise
+
+    def ungrab(self, keycode, mask):
+        with x11.ErrorTrap(self.display):
+            for extra in IGNORED_MASKS:
+                x11.XUngrabKey(self.display, keycode, mask | extra, self.root)
+
+    def run(self):
+        """Цикл потока: ждёт события X или сигнала остановки"""
+        fd = x11.XConnectionNumber(self.display)
+        event = x11.XEvent()
+        modifiers = ~(x11.LockMask | x11.Mod2Mask) & 0xff
+        while True:
+            # Xlib мог уже прочитать события в свою очередь: разбираем их до select
+            while x11.XPending(self.display):
+                x11.XNextEvent(self.display, event)
+                if event.type != x11.KeyPress:
+                    continue
+                received = time.perf_counter()
+                key = event.xkey
+                action = self.grabs.get((key.keycode, key.state & modifiers))
+                if action is not None:
+                    self.dispatch(self.deliver, action, received)
+            ready, _, _ = select.select([fd, self.wake_r], [], [])
+            if self.wake_r in ready:
+                return
+
+    def deliver(self, action, received):
+        """Выполняет действие в потоке интерфейса"""
+        self.callback(action)
+        self.latency.add((time.perf_counter() - received) * 1000)
+        return False
+
+    def stop(self):
+        """Останавливает поток, снимает перехват и закрывает соединение"""
+        if self.thread is None:
+            return
+        os.write(self.wake_w, b'x')
+        self.thread.join()
+        self.thread = None
+        self.release()
+
+    def release(self):
+        """Снимает перехват, закрывает соединение и канал пробуждения"""
+        for keycode, mask in self.grabs:
+            self.ungrab(keycode, mask)
+        self.grabs.clear()
+        if self.display:
+            x11.XCloseDisplay(self.display)
+            self.display = None
+        for fd in (self.wake_r, self.wake_w):
+            if fd is not None:
+                os.close(fd)
+        self.wake_r = self.wake_w = None
+
+
+def selftest(rounds=50):
+    """Имитирует нажатия через XTest и проверяет, что каждое дошло до обработчика"""
+    import ctypes
+    import queue
+    xtst = x11.load_library('Xtst')
+    xtst.XTestFakeKeyEvent.argtypes = (x11.Display_p, ctypes.c_uint, ctypes.c_int, ctypes.c_ulong)
+
+    received = queue.Queue()
+    # Без GTK действие выполняется сразу в потоке-слушателе
+    listener = HotkeyListener(DEFAULT_BINDINGS, received.put, lambda func, *args: func(*args))
+    listener.start()
+    if listener.invalid:
+        print(f"Ошибки в сочетаниях: {'; '.join(listener.invalid)}", file=sys.stderr)
+    if listener.failed:
+        print(f"Не удалось перехватить: {', '.join(listener.failed)}", file=sys.stderr)
+
+    display = x11.XOpenDisplay(None)
+    keysym = x11.XStringToKeysym
+    control = x11.XKeysymToKeycode(display, keysym(b'Control_L'))
+    alt = x11.XKeysymToKeycode(display, keysym(b'Alt_L'))
+    missed = 0
+    end_to_end = wt_metrics.RingStats(256)
+    try:
+        for index in range(rounds):
+            action, text = list(DEFAULT_BINDINGS.items())[index % len(DEFAULT_BINDINGS)]
+            key = x11.XKeysymToKeycode(display, keysym(parse_binding(text)[1].encode()))
+            sent = time.perf_counter()
+            for code, pressed in ((control, 1), (alt, 1), (key, 1), (key, 0), (alt, 0), (control, 0)):
+                xtst.XTestFakeKeyEvent(display, code, pressed, 0)
+            x11.XFlush(display)
+            try:
+                got = received.get(timeout=1)
+            except queue.Empty:
+                got = None
+            if got != action:
+                missed += 1
+            else:
+                end_to_end.add((time.perf_counter() - sent) * 1000)
+    finally:
+        x11.XCloseDisplay(display)
+        listener.stop()
+
+    print(f"Нажатий: {rounds}, пропущено: {missed}")
+    for title, stats in (("от нажатия до действия", end_to_end.summary()),
+                         ("от потока до действия", listener.latency.summary())):
+        if stats:
+            print(f"Задержка {title}, мс: p50 {stats['p50']:.3f}, "
+                  f"p95 {stats['p95']:.3f}, max {stats['max']:.3f}")
+    return 1 if missed or listener.failed or listener.invalid else 0
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--selftest']:
+        sys.exit(selftest())
+    print(__doc__)
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""Локальный API дальномера для сторонних программ (оверлей стрима, озвучка, журнал).
+
+Сервер слушает Unix-сокет ($XDG_RUNTIME_DIR/wt_map_ruler.sock) в цикле GLib:
+сокеты неблокирующие, исходящие данные копятся в буфере соединения и
+дописываются, когда сокет готов к записи, поэтому медленный клиент не
+задерживает интерфейс (при переполнении буфера он отключается).
+
+Сообщение - 4 байта длины (big-endian) и JSON в UTF-8. Запросы:
+
+    {"id": 1, "method": "get", "keys": ["distance_m", "scale_factor"]}
+    {"id": 2, "method": "subscribe", "keys": ["distance_m"]}
+    {"id": 3, "method": "unsubscribe"}
+    {"id": 4, "method": "ping"}
+
+Ответ - {"id": ..., "result": ...} или {"id": ..., "error": "..."}; список
+запросов в одном сообщении - пакет, на него приходит список ответов. Подписчики
+получают {"event": "state", "time": ..., "state": {изменившиеся ключи}}.
+
+    python3 wt_ipc.py --serve                 # сервер с имитацией измерений
+    python3 wt_ipc.py --bench --clients 100   # задержка и пропускная способность
+"""
+import json
+import os
+import socket
+import struct
+import sys
+import time
+
+LENGTH = struct.Struct('>I')
+MAX_MESSAGE = 1 << 20  # Больше - ошибка протокола, соединение закрывается
+MAX_OUTPUT = 4 << 20  # Столько может скопиться для клиента, который не читает
+READS_PER_WAKEUP = 16  # Сколько раз читать сокет за один вызов, чтобы не занимать цикл
+
+
+def default_socket_path():
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        return os.path.join(runtime, 'wt_map_ruler.sock')
+    return f"/tmp/wt_map_ruler-{os.getuid()}.sock"
+
+
+def encode(message):
+    data = json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return LENGTH.pack(len(data)) + data
+
+
+def decode_frames(buffer):
+    """Извлекает из начала buffer все полные сообщения; buffer укорачивается на месте"""
+    messages = []
+    offset = 0
+    while len(buffer) - offset >= LENGTH.size:
+        (size,) = LENGTH.unpack_from(buffer, offset)
+        if size > MAX_MESSAGE:
+            raise ValueError(f"сообщение {size} байт больше допустимого")
+        end = offset + LENGTH.size + size
+        if end > len(buffer):
+            break
+        messages.append(json.loads(bytes(buffer[offset + LENGTH.size:end])))
+        offset = end
+    del buffer[:offset]
+    return messages
+
+
+class Connection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.input = bytearray()
+        self.output = bytearray()
+        self.read_watch = None
+        self.write_watch = None
+        self.keys = None  # Ключи подписки; None - не подписан
+
+
+class IpcServer:
+    """Сервер запросов к состоянию дальномера в цикле GLib.
+
+    state() возвращает словарь текущих значений; publish(state) рассылает
+    подписчикам изменившиеся с прошлой рассылки значения.
+    """
+
+    def __init__(self, path, state):
+        self.path = path
+        self.state = state
+        self.sock = None
+        self.watch = None
+        self.connections = set()
+        self.subscribers = set()
+        self.published = {}
+        self.requests = 0
+        self.dropped = 0
+
+    def start(self):
+        from gi.repository import GLib
+        if os.path.exists(self.path):
+            # Сокет от завершившегося процесса удаляем, от работающего - не трогаем
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.unlink(self.path)
+            else:
+                raise OSError(f"{self.path} уже обслуживает другой экземпляр")
+            finally:
+                probe.close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)  # Сокет доступен только владельцу
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        sock.listen(64)
+        sock.setblocking(False)
+        self.sock = sock
+        self.watch = GLib.io_add_watch(sock.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, self.on_accept)
+
+    def on_accept(self, fd, condition):
+        from gi.repository import GLib
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except BlockingIOError:
+                return True
+            except OSError:
+                return True
+            client.setblocking(False)
+            conn = Connection(client)
+            conn.read_watch = GLib.io_add_watch(client.fileno(), GLib.PRIORITY_DEFAULT,
+                                                GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR,
+                                                self.on_readable, conn)
+            self.connections.add(conn)
+
+    def on_readable(self, fd, condition, conn):
+        for _ in range(READS_PER_WAKEUP):
+            try:
+                data = conn.sock.recv(65536)
+            except BlockingIOError:
+                break
+            except OSError:
+                data = b''
+            if not data:
+                self.drop(conn, from_watch=True)
+                return False
+            conn.input += data
+            if len(data) < 65536:
+                break
+        try:
+            messages = decode_frames(conn.input)
+        except ValueError:
+            self.drop(conn, from_watch=True)
+            return False
+        for message in messages:
+            if conn not in self.connections:
+                break
+            if isinstance(message, list):
+                reply = [self.safe_handle(conn, request) for request in message]
+            else:
+                reply = self.safe_handle(conn, message)
+            self.send(conn, encode(reply))
+        return conn in self.connections
+
+    def safe_handle(self, conn, request):
+        """handle, в котором ошибка одного запроса не снимает наблюдение за соединением"""
+        try:
+            return self.handle(conn, request)
+        except Exception as error:
+            request_id = request.get('id') if isinstance(request, dict) else None
+            return {'id': request_id, 'error': f"ошибка обработки запроса: {error}"}
+
+    def handle(self, conn, request):
+        """Ответ на один запрос"""
+        self.requests += 1
+        if not isinstance(request, dict):
+            return {'error': "запрос должен быть объектом JSON"}
+        request_id = request.get('id')
+        method = request.get('method')
+        keys = request.get('keys')
+        if keys is not None and not (isinstance(keys, list)
+                                     and all(isinstance(key, str) for key in keys)):
+            return {'id': request_id, 'error': "keys должен быть списком строк"}
+        if method == 'get':
+            return {'id': request_id, 'result': self.select(self.state(), keys)}
+        if method == 'subscribe':
+            conn.keys = frozenset(keys) if keys else frozenset()
+            self.subscribers.add(conn)
+            return {'id': request_id, 'result': self.select(self.state(), keys)}
+        if method == 'unsubscribe':
+            conn.keys = None
+            self.subscribers.discard(conn)
+            return {'id': request_id, 'result': True}
+        if method == 'ping':
+            return {'id': request_id, 'result': 'pong'}
+        return {'id': request_id, 'error': f"неизвестный метод {method!r}"}
+
+    @staticmethod
+    def select(state, keys):
+        if not keys:
+            return state
+        return {key: state[key] for key in keys if key in state}
+
+    def publish(self, state):
+        """Рассылает подписчикам значения state, изменившиеся с прошлой рассылки"""
+        if not self.subscribers:
+            self.published = state
+            return
+        changed = {key: value for key, value in state.items() if self.published.get(key) != value}
+        self.published = state
+        if not changed:
+            return
+        now = time.time()
+        # Одно сообщение на каждый набор ключей подписки
+        frames = {}
+        for conn in list(self.subscribers):
+            frame = frames.get(conn.keys)
+            if frame is None:
+                values = self.select(changed, conn.keys)
+                frame = encode({'event': 'state', 'time': now, 'state': values}) if values else b''
+                frames[conn.keys] = frame
+            if frame:
+                self.send(conn, frame)
+
+    def send(self, conn, data):
+        """Пишет сразу, сколько примет сокет; остаток - когда он освободится"""
+        from gi.repository import GLib
+        if not conn.output:
+            try:
+                sent = conn.sock.send(data)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                self.drop(conn)
+                return
+            data = data[sent:]
+            if not data:
+                return
+        conn.output += data
+        if len(conn.output) > MAX_OUTPUT:
+            self.dropped += 1
+            self.drop(conn)
+            return
+        if conn.write_watch is None:
+            conn.write_watch = GLib.io_add_watch(conn.sock.fileno(), GLib.PRIORITY_DEFAULT,
+                                                 GLib.IO_OUT, self.on_writable, conn)
+
+    def on_writable(self, fd, condition, conn):
+        try:
+            sent = conn.sock.send(conn.output)
+        except BlockingIOError:
+            return True
+        except OSError:
+            conn.write_watch = None
+            self.drop(conn)
+            return False
+        del conn.output[:sent]
+        if conn.output:
+            return True
+        conn.write_watch = None
+        return False
+
+    def drop(self, conn, from_watch=False):
+        """Закрывает соединение; from_watch - вызвано из обработчика чтения, который сам вернёт False"""
+        from gi.repository import GLib
+        if conn not in self.connections:
+            return
+        self.connections.discard(conn)
+        self.subscribers.discard(conn)
+        if conn.read_watch is not None and not from_watch:
+            GLib.source_remove(conn.read_watch)
+        if conn.write_watch is not None:
+            GLib.source_remove(conn.write_watch)
+        conn.read_watch = conn.write_watch = None
+        conn.sock.close()
+
+    def close(self):
+        from gi.repository import GLib
+        for conn in list(self.connections):
+            self.drop(conn)
+        if self.watch is not None:
+            GLib.source_remove(self.watch)
+            self.watch = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+
+def serve(path, rate=30):
+    """Сервер с имитацией измерений: расстояние меняется rate раз в секунду"""
+    import math
+    from gi.repository import GLib
+    t0 = time.monotonic()
+
+    def state():
+        t = time.monotonic() - t0
+        return {'distance_m': round(1500 + 500 * math.sin(t), 1), 'scale_factor': 2.5,
+                'selected_scale': 250, 'mode': 'ruler'}
+
+    server = IpcServer(path, state)
+    server.start()
+    GLib.timeout_add(max(1, 1000 // rate), lambda: server.publish(state()) or True)
+    print(f"Сервер с имитацией измерений: {path}", file=sys.stderr)
+    try:
+        GLib.MainLoop().run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+def percentiles(values):
+    values = sorted(values)
+    n = len(values)
+    return {p: values[min(n - 1, int(n * q))] for p, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))}
+
+
+def read_message(sock, buffer, pending):
+    """Блокирующее чтение одного сообщения; прочитанные сверх него ждут в pending"""
+    while not pending:
+        data = sock.recv(65536)
+        if not data:
+            raise ConnectionError("сервер закрыл соединение")
+        buffer += data
+        pending.extend(decode_frames(buffer))
+    return pending.popleft()
+
+
+def bench(path, clients=50, requests=2000, batch=16, duration=3.0):
+    """Задержка запросов, пропускная способность и доставка рассылок подписчикам"""
+    from collections import deque
+    import selectors
+
+    def connect():
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        return sock
+
+    # Задержка: последовательные запросы одного клиента
+    sock = connect()
+    buffer = bytearray()
+    pending = deque()
+    latencies = []
+    started = time.perf_counter()
+    for index in range(requests):
+        sent = time.perf_counter()
+        sock.sendall(encode({'id': index, 'method': 'get'}))
+        read_message(sock, buffer, pending)
+        latencies.append((time.perf_counter() - sent) * 1000)
+    elapsed = time.perf_counter() - started
+    stats = percentiles(latencies)
+    print(f"Запрос-ответ: {requests / elapsed:.0f} запросов/с, мс p50 {stats['p50']:.3f}, "
+          f"p95 {stats['p95']:.3f}, p99 {stats['p99']:.3f}")
+
+    # Пакеты: batch запросов в одном сообщении
+    rounds = max(1, requests // batch)
+    message = encode([{'id': i, 'method': 'get', 'keys': ['distance_m']} for i in range(batch)])
+    started = time.perf_counter()
+    for _ in range(rounds):
+        sock.sendall(message)
+        read_message(sock, buffer, pending)
+    elapsed = time.perf_counter() - started
+    print(f"Пакеты по {batch}: {rounds * batch / elapsed:.0f} запросов/с")
+    sock.close()
+
+    # Подписчики: одновременно clients соединений получают рассылки
+    selector = selectors.DefaultSelector()
+    subscribers = []
+    for index in range(clients):
+        sub = connect()
+        sub.sendall(encode({'id': index, 'method': 'subscribe'}))
+        sub.setblocking(False)
+        entry = {'sock': sub, 'buffer': bytearray(), 'events': 0}
+        selector.register(sub, selectors.EVENT_READ, entry)
+        subscribers.append(entry)
+    delays = []
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        for key, _ in selector.select(timeout=0.1):
+            entry = key.data
+            try:
+                data = entry['sock'].recv(65536)
+            except BlockingIOError:
+                continue
+            if not data:
+                selector.unregister(entry['sock'])
+                continue
+            entry['buffer'] += data
+            now = time.time()
+            for msg in decode_frames(entry['buffer']):
+                if isinstance(msg, dict) and msg.get('event') == 'state':
+                    entry['events'] += 1
+                    delays.append((now - msg['time']) * 1000)
+    total = sum(entry['events'] for entry in subscribers)
+    for entry in subscribers:
+        entry['sock'].close()
+    print(f"Подписчиков: {clients}, рассылок получено: {total} за {duration:.1f} с "
+          f"({total / duration:.0f}/с)")
+    if delays:
+        stats = percentiles(delays)
+        print(f"Задержка рассылки, мс p50 {stats['p50']:.3f}, p95 {stats['p95']:.3f}, "
+              f"p99 {stats['p99']:.3f}")
+    else:
+        print("Рассылок не было: значения не менялись (подвигайте точку или запустите --serve)")
+    return 0
+
+
+def option(argv, name, default, kind=str):
+    if name in argv:
+        return kind(argv[argv.index(name) + 1])
+    return default
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    path = option(argv, '--socket', default_socket_path())
+    if '--serve' in argv:
+        serve(path, option(argv, '--rate', 30, int))
+        return 0
+    if '--bench' in argv:
+        return bench(path, clients=option(argv, '--clients', 50, int),
+                     requests=option(argv, '--requests', 2000, int),
+                     duration=option(argv, '--duration', 3.0, float))
+    print(__doc__)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
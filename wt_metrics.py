@@ -0,0 +1,183 @@
+"""Метрики отзывчивости оверлея: время отрисовки, задержка ввода, пропущенные кадры.
+
+Значения хранятся в кольцевых буферах фиксированного размера, перцентили
+считаются по последним значениям только при показе или выгрузке. Модуль не
+зависит от GTK: время кадров передаётся в микросекундах монотонных часов GLib.
+"""
+from array import array
+import time
+
+# Перцентили, которые показываются и выгружаются
+PERCENTILES = (0.50, 0.95, 0.99)
+
+# Сколько кадров ждать, пока у кадра появится время показа на экране
+MAX_PENDING_FRAMES = 16
+
+
+class RingStats:
+    """Последние size значений в кольцевом буфере"""
+
+    def __init__(self, size=512):
+        self.values = array('d', bytes(8 * size))
+        self.size = size
+        self.index = 0
+        self.count = 0
+
+    def add(self, value):
+        self.values[self.index] = value
+        self.index = (self.index + 1) % self.size
+        self.count += 1
+
+    def summary(self):
+        """Перцентили и максимум по последним значениям или None, если их нет"""
+        n = min(self.count, self.size)
+        if not n:
+            return None
+        values = sorted(self.values[:n])
+        result = {f"p{int(p * 100)}": values[min(n - 1, int(p * n))] for p in PERCENTILES}
+        result['max'] = values[-1]
+        result['count'] = self.count
+        return result
+
+
+class FrameMetrics:
+    """Метрики кадров и ввода окна"""
+
+    def __init__(self, size=512):
+        self.draw_ms = RingStats(size)
+        self.latency_ms = RingStats(size)
+        self.events_per_frame = RingStats(size)
+        self.frames = 0
+        self.dropped_frames = 0
+        self.refresh_interval = 0  # мкс, по данным последнего кадра
+        self.pending = {}  # номер кадра -> время самого раннего события этого кадра, мкс
+        self.last_tick = None
+
+    def tick(self, frame_time, refresh_interval):
+        """Кадр с обработкой ввода: считает пропуски по интервалу между кадрами"""
+        self.frames += 1
+        if refresh_interval > 0:
+            self.refresh_interval = refresh_interval
+        if self.last_tick is not None and self.refresh_interval:
+            missed = round((frame_time - self.last_tick) / self.refresh_interval) - 1
+            if missed > 0:
+                self.dropped_frames += missed
+        self.last_tick = frame_time
+
+    def idle(self):
+        """Кадры перестали идти подряд: следующая пауза - не пропуск"""
+        self.last_tick = None
+
+    def frame_input(self, frame_counter, event_time, events):
+        """Кадр frame_counter применил events событий, первое пришло в event_time"""
+        self.events_per_frame.add(events)
+        if event_time:
+            self.pending[frame_counter] = event_time
+
+    def collect(self, frame_clock):
+        """Забирает время показа завершённых кадров и считает задержку ввода"""
+        if not self.pending:
+            return
+        newest = frame_clock.get_frame_counter()
+        for counter in list(self.pending):
+            timings = frame_clock.get_timings(counter)
+            if timings is not None and timings.get_complete():
+                shown = timings.get_presentation_time() or timings.get_predicted_presentation_time()
+                if shown:
+                    self.latency_ms.add((shown - self.pending[counter]) / 1000)
+                del self.pending[counter]
+            elif timings is None or newest - counter > MAX_PENDING_FRAMES:
+                # Кадр уже вытеснен из истории часов кадров
+                del self.pending[counter]
+
+    def hud_text(self):
+        """Строки для HUD"""
+        def line(title, stats, unit, digits):
+            if stats is None:
+                return f"{title}: -"
+            return (f"{title}: p50 {stats['p50']:.{digits}f}  p95 {stats['p95']:.{digits}f}  "
+                    f"p99 {stats['p99']:.{digits}f}{unit}")
+        return "\n".join((
+            line("отрисовка", self.draw_ms.summary(), " мс", 2),
+            line("ввод → экран", self.latency_ms.summary(), " мс", 1),
+            line("событий/кадр", self.events_per_frame.summary(), "", 0),
+            f"пропущено кадров: {self.dropped_frames} из {self.frames}",
+        ))
+
+    def to_dict(self):
+        return {
+            'timestamp': time.time(),
+            'draw_ms': self.draw_ms.summary(),
+            'latency_ms': self.latency_ms.summary(),
+            'events_per_frame': self.events_per_frame.summary(),
+            'frames': self.frames,
+            'dropped_frames': self.dropped_frames,
+            'refresh_interval_ms': self.refresh_interval / 1000,
+        }
+
+
+class Tracer:
+    """Трассировка вызовов в формате Chrome trace_event (JSON-массив событий B/E).
+
+    События копятся в памяти и дописываются в файл пачками, поэтому файл можно
+    открыть в Perfetto или chrome://tracing даже после аварийного завершения.
+    Когда трассировка выключена, обработчики не оборачиваются вовсе.
+    """
+
+    def __init__(self, path, flush_events=4096):
+        import os
+        import threading
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write('[\n')
+        self.pid = os.getpid()
+        self.main_tid = threading.get_ident()
+        self.flush_events = flush_events
+        self.events = []
+        self.t0 = time.perf_counter_ns()
+
+    def begin(self, name):
+        self.events.append((name, 'B', time.perf_counter_ns()))
+
+    def end(self, name):
+        self.events.append((name, 'E', time.perf_counter_ns()))
+        if len(self.events) >= self.flush_events:
+            self.flush()
+
+    def wrap(self, func, name=None):
+        """Функция, отмечающая начало и конец каждого вызова func"""
+        name = name or func.__name__
+        events = self.events
+        clock = time.perf_counter_ns
+
+        def traced(*args, **kwargs):
+            events.append((name, 'B', clock()))
+            try:
+                return func(*args, **kwargs)
+            finally:
+                events.append((name, 'E', clock()))
+                if len(events) >= self.flush_events:
+                    self.flush()
+        traced.__name__ = name
+        return traced
+
+    def flush(self):
+        import json
+        if self.file.closed:
+            # После закрытия (например, вызовы при уничтожении окна) события не пишутся
+            self.events.clear()
+            return
+        t0 = self.t0
+        pid = self.pid
+        tid = self.main_tid
+        lines = [f'{{"name": {json.dumps(name)}, "ph": "{phase}", "ts": {(ts - t0) / 1000:.3f}, '
+                 f'"pid": {pid}, "tid": {tid}}},\n' for name, phase, ts in self.events]
+        # Список очищается на месте: обёртки держат ссылку на него
+        self.events.clear()
+        self.file.writelines(lines)
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.write(f'{{"name": "process_name", "ph": "M", "pid": {self.pid}, '
+                        f'"args": {{"name": "wt_ruler"}}}}\n]\n')
+        self.file.close()
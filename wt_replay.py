@@ -0,0 +1,179 @@
+"""Запись событий ввода оверлея и их воспроизведение.
+
+Журнал - двоичный файл, который только дописывается: заголовок с размером окна
+и текстом настроек на момент записи, затем записи фиксированного размера
+(вид события, время от начала записи по монотонным часам, координаты, кнопка
+или клавиша, модификаторы). Обрезанный при аварии хвост при чтении отбрасывается.
+
+Кроме событий окна пишутся действия панели (нажатия кнопок, переключатели и
+выбор в списках - по номеру виджета и новому значению) и глобальные сочетания
+клавиш (по номеру действия с положением мыши). Инструкция и ссылка на YouTube
+при воспроизведении не открываются.
+
+    python3 wt_ruler.py --record session.wtrl           # записать сессию
+    python3 wt_ruler.py --replay session.wtrl           # воспроизвести в реальном темпе
+    python3 wt_ruler.py --replay session.wtrl --fast    # как можно быстрее
+"""
+from collections import namedtuple
+import struct
+import time
+
+MAGIC = b'WTRL'
+VERSION = 2
+VERSIONS = (1, 2)  # Журнал версии 1 - без действий панели и сочетаний
+
+# Сигнатура, версия, ширина и высота окна, длина текста настроек
+HEADER = struct.Struct('<4sHHHI')
+# Вид события, время в секундах, x, y, кнопка или клавиша, модификаторы
+RECORD = struct.Struct('<BdffII')
+
+PRESS = 1
+RELEASE = 2
+MOTION = 3
+KEY = 4
+WIDGET = 5  # Код - номер виджета панели, модификаторы - новое значение
+ACTION = 6  # Код - номер действия глобального сочетания, координаты - положение мыши
+
+# Сколько байт копить перед записью на диск
+FLUSH_BYTES = 64 * 1024
+
+# Событие, передаваемое обработчикам вместо Gdk.Event
+ReplayEvent = namedtuple('ReplayEvent', 'x y button keyval state')
+
+
+class Recorder:
+    """Пишет события окна в журнал"""
+
+    def __init__(self, path, width, height, config_text):
+        config = config_text.encode('utf-8')
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, width, height, len(config)))
+        self.file.write(config)
+        self.buffer = bytearray()
+        self.count = 0
+        self.t0 = time.monotonic()
+
+    def record(self, kind, x, y, code=0, state=0):
+        self.buffer += RECORD.pack(kind, time.monotonic() - self.t0, x, y, code, int(state))
+        self.count += 1
+        if len(self.buffer) >= FLUSH_BYTES:
+            self.flush()
+
+    def press(self, event):
+        self.record(PRESS, event.x, event.y, event.button, event.state)
+
+    def release(self, event):
+        self.record(RELEASE, event.x, event.y, event.button, event.state)
+
+    def motion(self, event):
+        self.record(MOTION, event.x, event.y, 0, event.state)
+
+    def key(self, event):
+        self.record(KEY, 0, 0, event.keyval, event.state)
+
+    def widget(self, index, value):
+        self.record(WIDGET, 0, 0, index, value)
+
+    def action(self, index, x=0, y=0):
+        self.record(ACTION, x, y, index)
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.file.flush()
+        self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def read_log(path):
+    """Журнал: (ширина, высота, текст настроек, список записей)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, width, height, config_len = HEADER.unpack_from(data)
+    if magic != MAGIC or version not in VERSIONS:
+        raise ValueError(f"{path}: не журнал сессии дальномера или неизвестная версия")
+    start = HEADER.size + config_len
+    config_text = data[HEADER.size:start].decode('utf-8')
+    body = memoryview(data)[start:]
+    body = body[:len(body) - len(body) % RECORD.size]
+    return width, height, config_text, list(RECORD.iter_unpack(body))
+
+
+class Player:
+    """Передаёт записанные события обработчикам окна.
+
+    В реальном темпе события идут с записанными интервалами; в быстром режиме -
+    по одному за итерацию цикла GTK, чтобы между ними успевали кадры.
+    """
+
+    def __init__(self, ruler, records, fast=False, on_done=None):
+        self.ruler = ruler
+        self.records = records
+        self.fast = fast
+        self.on_done = on_done
+        self.index = 0
+        self.started = None
+        self.finished = None
+
+    def start(self):
+        from gi.repository import GLib
+        self.started = time.monotonic()
+        if self.fast:
+            GLib.idle_add(self.step)
+        else:
+            self.schedule()
+
+    def schedule(self):
+        from gi.repository import GLib
+        if self.index >= len(self.records):
+            self.finish()
+            return
+        delay = self.records[self.index][1] - (time.monotonic() - self.started)
+        GLib.timeout_add(max(0, int(delay * 1000)), self.step)
+
+    def step(self):
+        if self.fast:
+            if self.index < len(self.records):
+                self.feed(self.records[self.index])
+                self.index += 1
+                return True
+            self.finish()
+            return False
+
+        # Все события, время которых уже наступило
+        now = time.monotonic() - self.started
+        while self.index < len(self.records) and self.records[self.index][1] <= now:
+            self.feed(self.records[self.index])
+            self.index += 1
+        self.schedule()
+        return False
+
+    def feed(self, record):
+        kind, _, x, y, code, state = record
+        ruler = self.ruler
+        event = ReplayEvent(x, y, code, code, state)
+        if kind == PRESS:
+            ruler.on_button_press(ruler, event)
+        elif kind == RELEASE:
+            ruler.on_button_release(ruler, event)
+        elif kind == MOTION:
+            ruler.on_mouse_move(ruler, event)
+        elif kind == KEY:
+            ruler.on_key_press(ruler, event)
+        elif kind == WIDGET:
+            ruler.replay_widget(code, state)
+        elif kind == ACTION:
+            ruler.replay_action(code, x, y)
+
+    def finish(self):
+        self.finished = time.monotonic()
+        if self.on_done:
+            self.on_done(self)
+
+    def summary(self):
+        elapsed = self.finished - self.started
+        recorded = self.records[-1][1] if self.records else 0.0
+        return (f"Воспроизведено событий: {len(self.records)} за {elapsed:.3f} с "
+                f"(в записи {recorded:.3f} с)")
@@ -1,22 +1,490 @@
 #!/usr/bin/env python3
+import time
+
+# Отметки времени запуска для --startup-profile
+STARTUP_T0 = time.perf_counter()
+startup_marks = []
+
+
+def startup_mark(name):
+    startup_marks.append((name, time.perf_counter()))
+
+
 import gi
 gi.require_version('Gtk', '3.0')
 gi.require_version('Gdk', '3.0')
 gi.require_version('GdkX11', '3.0')
+gi.require_version('Pango', '1.0')
+gi.require_version('PangoCairo', '1.0')
 from gi.repository import Gtk, Gdk, GdkX11, GObject, GLib
+startup_mark("импорт GTK")
+from collections import OrderedDict
 import math
 import cairo
 import os
-import configparser
-import subprocess
-import webbrowser
+import sys
+startup_mark("импорт cairo")
+
+import wt_core
+import wt_metrics
+from wt_core import MAP_SCALES
+startup_mark("импорт wt_core")
+
+# Бюджет времени до первого кадра, мс
+STARTUP_BUDGET_MS = 300
+
+YOUTUBE_URL = "https://www.youtube.com/@EXTRUD/shorts"
+
+# Стили, влияющие на размеры панели: нужны к первому кадру
+PANEL_CSS = b"""
+* {
+    font-family: 'Sans';
+    font-size: 10pt;
+}
+.distance-value {
+    font-weight: bold;
+    color: #27AE60;
+    min-width: 80px;
+}
+.scale-value {
+    font-weight: bold;
+    color: #3498DB;
+    min-width: 150px;
+}
+"""
+
+# Оформление кнопок: загружается после первого кадра
+BUTTONS_CSS = b"""
+.close-btn {
+    font-weight: bold;
+    font-size: 14px;
+    min-width: 20px;
+    min-height: 20px;
+    border-radius: 10px;
+    background-color: #FF6B6B;
+    color: white;
+    border: none;
+}
+.reset-btn {
+    font-weight: bold;
+    font-size: 14px;
+    min-width: 20px;
+    min-height: 20px;
+    border-radius: 10px;
+    background-color: #3498DB;
+    color: white;
+    border: none;
+}
+.youtube-btn {
+    font-weight: bold;
+    font-size: 14px;
+    min-width: 20px;
+    min-height: 20px;
+    border-radius: 10px;
+    background-color: #FF0000;
+    color: white;
+    border: none;
+}
+.help-btn {
+    font-weight: bold;
+    font-size: 14px;
+    min-width: 20px;
+    min-height: 20px;
+    border-radius: 10px;
+    background-color: #9B59B6;
+    color: white;
+    border: none;
+}
+.calibration-active {
+    background-color: #FF9800;
+    color: white;
+}
+"""
+
+# Запас вокруг линий, маркеров и текста при расчёте перерисовываемых областей
+DAMAGE_PAD = 4
+
+# Маршрут: радиус маркера точки и расстояние, с которого точку можно захватить мышью
+PATH_MARKER_RADIUS = 4
+PATH_GRAB_RADIUS = 10
+PATH_PAD = DAMAGE_PAD + PATH_MARKER_RADIUS
+
+# Кольца дальности вокруг точки А: шаги в метрах, стили линий и запас кэша
+RING_SPACINGS = (100, 250, 500, 1000)
+RING_STYLES = {
+    'solid': (1.5, None),  # толщина линии, пунктир
+    'dashed': (1.5, (6, 4)),
+}
+RING_MAX_RANGE = 3000  # Дальше этого расстояния, м, кольца не рисуются
+RING_CACHE_SIZE = 6
+RING_LABEL_MARGIN = 16  # Подпись кольца выступает над ним на столько пикселей
+
+# Символы подписей расстояний, заранее отрисовываемые в полосу
+LABEL_CHARS = "0123456789.,- мmтыс°·"
+LABEL_CACHE_SIZE = 64
+
+# HUD метрик: размер, период обновления и период выгрузки в JSON
+HUD_SIZE = (380, 76)
+HUD_INTERVAL_MS = 250
+METRICS_EXPORT_INTERVAL_MS = 5000
+
+# Трассировка: путь к файлу в переменной окружения или параметр --trace
+TRACE_ENV = "WT_RULER_TRACE"
+
+# Обработчики и долгие операции, которые попадают в трассировку
+TRACED_METHODS = (
+    'on_draw', 'on_mouse_move', 'on_frame_tick', 'process_pointer', 'refresh',
+    'on_button_press', 'on_button_release', 'on_key_press', 'on_configure',
+    'on_scale_changed', 'apply_calibration', 'auto_calibrate', 'finish_auto_calibration',
+    'detect_scale', 'save_config', 'load_config', 'select_profile', 'deferred_init',
+    'toggle_mode', 'show_help', 'show_error', 'update_hud', 'export_metrics', 'snap_position',
+    'track_marker',
+)
+
+
+def rect_from_points(x1, y1, x2, y2, pad=DAMAGE_PAD):
+    """Целочисленный прямоугольник (x, y, w, h), охватывающий две точки с запасом"""
+    left = math.floor(min(x1, x2) - pad)
+    top = math.floor(min(y1, y2) - pad)
+    right = math.ceil(max(x1, x2) + pad)
+    bottom = math.ceil(max(y1, y2) + pad)
+    return (left, top, right - left, bottom - top)
+
+
+def rects_intersect(rect, extents):
+    """Пересекается ли прямоугольник (x, y, w, h) с областью (x1, y1, x2, y2)"""
+    x, y, w, h = rect
+    x1, y1, x2, y2 = extents
+    return x < x2 and x + w > x1 and y < y2 and y + h > y1
+
+
+def clip_rect(rect, width, height):
+    """Часть прямоугольника (x, y, w, h) внутри окна width x height или None"""
+    x, y, w, h = rect
+    left, top = max(0, x), max(0, y)
+    right, bottom = min(width, x + w), min(height, y + h)
+    if right <= left or bottom <= top:
+        return None
+    return (left, top, right - left, bottom - top)
 
-# Список масштабов карт
-MAP_SCALES = [150, 170, 180, 190, 200, 225, 250, 275, 300, 325, 350, 400, 450, 500, 550]
 
-class MapRuler(Gtk.Window):
+class ShapeRegion:
+    """Объединение прямоугольников элементов, которое обновляется по одному элементу"""
+
     def __init__(self):
+        self.rects = {}  # ключ -> прямоугольник
+        self.region = cairo.Region()
+        self.changed = False
+
+    def set(self, key, rect):
+        """Задаёт прямоугольник элемента; None убирает элемент"""
+        old = self.rects.get(key)
+        if old == rect:
+            return
+        # Форма меняется только там, где был и стал элемент: старую область вычитаем
+        # и возвращаем в неё соседей, которые с ней пересекаются
+        if old is not None:
+            del self.rects[key]
+            self.region.subtract(cairo.RectangleInt(*old))
+            x, y, w, h = old
+            extents = (x, y, x + w, y + h)
+            for item_rect in self.rects.values():
+                if rects_intersect(item_rect, extents):
+                    self.region.union(cairo.RectangleInt(*item_rect))
+        if rect is not None:
+            self.rects[key] = rect
+            self.region.union(cairo.RectangleInt(*rect))
+        self.changed = True
+
+
+class DamageTracker:
+    """Помнит области динамических элементов окна и инвалидирует только изменившиеся"""
+
+    def __init__(self, widget):
+        self.widget = widget
+        self.items = {}  # ключ -> (прямоугольник, содержимое)
+        self.pending = cairo.Region()
+        # Объединение областей всех элементов - видимая часть окна в минимальном режиме
+        self.shape = ShapeRegion()
+
+    def update(self, key, rect, content=None):
+        """Задаёт новую область элемента; старая и новая области становятся грязными"""
+        old = self.items.get(key)
+        new = (rect, content) if rect is not None else None
+        if old == new:
+            return
+        if old is not None:
+            self.pending.union(cairo.RectangleInt(*old[0]))
+        if new is None:
+            del self.items[key]
+        else:
+            self.items[key] = new
+            self.pending.union(cairo.RectangleInt(*rect))
+        self.shape.set(key, rect)
+
+    def flush(self, full=False):
+        """Отправляет накопленные области в GTK одним запросом"""
+        if full:
+            self.widget.queue_draw()
+        elif not self.pending.is_empty():
+            self.widget.queue_draw_region(self.pending)
+        self.pending = cairo.Region()
+
+
+# Действия клавиш окна; те же действия доступны глобальным горячим клавишам
+KEY_ACTIONS = {
+    Gdk.KEY_Escape: 'quit',
+    Gdk.KEY_r: 'reset',
+    Gdk.KEY_t: 'top',
+    Gdk.KEY_c: 'mode',
+    Gdk.KEY_a: 'auto',
+    Gdk.KEY_g: 'rings',
+    Gdk.KEY_G: 'ring-spacing',
+    Gdk.KEY_p: 'path',
+    Gdk.KEY_d: 'detect',
+    Gdk.KEY_m: 'minimal',
+    Gdk.KEY_h: 'hud',
+    Gdk.KEY_s: 'snap',
+    Gdk.KEY_k: 'track',
+    Gdk.KEY_y: 'youtube',
+    Gdk.KEY_F1: 'help',
+    Gdk.KEY_question: 'help',
+}
+
+# Действия клавиш окна и глобальных сочетаний; номер - код действия в журнале сессии
+ACTIONS = ('quit', 'reset', 'top', 'mode', 'auto', 'rings', 'ring-spacing', 'path', 'detect',
+           'minimal', 'hud', 'snap', 'track', 'youtube', 'help', 'point-a', 'point-b')
+# При воспроизведении не выполняются: модальное окно или браузер остановили бы его
+REPLAY_SKIPPED_ACTIONS = ('help', 'youtube')
+# Виджеты панели, действия с которыми пишутся в журнал сессии; номер - код виджета
+RECORDED_WIDGETS = ('mode_btn', 'apply_btn', 'auto_btn', 'reset_btn', 'scale_combo', 'shell_combo',
+                    'path_btn', 'detect_btn', 'minimal_btn', 'track_btn', 'snap_btn', 'rings_btn',
+                    'top_btn')
+
+
+# Определение масштаба карты по надписи под игровой картой
+GLYPHS_DIR = os.path.expanduser("~/.wt_map_ruler_glyphs")  # свои образцы цифр: 5.png, 5_bold.png...
+GLYPH_FONT_SIZES = (12, 16, 20, 26)  # Размеры шрифта, которыми отрисовываются образцы
+SCALE_DETECT_REGION = (0.0, 1.02, 0.4, 0.1)  # x, y, ширина, высота в размерах сетки от её угла
+SCALE_DETECT_INTERVAL_MS = 1000
+
+# Захват экрана для анализа карты
+CAPTURE_METHODS = ('auto', 'xgetimage', 'gdk')  # auto - MIT-SHM, если сервер его поддерживает
+CAPTURE_MAX_FPS = 30  # Чаще одна и та же область не захватывается
+CAPTURE_ROI = (-0.05, -0.05, 1.1, 1.2)  # x, y, ширина, высота в размерах сетки от её угла; с надписью масштаба
+
+# Притягивание точек к маркерам карты
+SNAP_RADIUS = 20  # На каком расстоянии от курсора искать маркер, пикс
+SNAP_HUES = ((345, 15), (40, 70), (195, 250))  # Тона маркеров: красный, жёлтый, синий
+SNAP_MARKER_RADIUS = 9  # Радиус кружка, которым показывается найденный маркер
+
+# Слежение точки А за своим маркером
+TRACK_INTERVAL_MS = 33  # До 30 шагов в секунду
+TRACK_HALF = 10  # Шаблон маркера - квадрат 2 * TRACK_HALF + 1 пикселей
+TRACK_SEARCH = 24  # Насколько маркер может сместиться за шаг, пикс
+TRACK_STATUS_EVERY = 15  # Подсказка кнопки обновляется раз в столько шагов
+
+
+def render_glyph_samples(font="Sans"):
+    """Образцы цифр, отрисованные шрифтом в нескольких размерах: пары (цифра, массив)"""
+    import wt_vision
+    samples = []
+    for size in GLYPH_FONT_SIZES:
+        for char in "0123456789":
+            surface = cairo.ImageSurface(cairo.FORMAT_RGB24, size + 8, size + 12)
+            cr = cairo.Context(surface)
+            cr.set_source_rgb(1, 1, 1)
+            cr.select_font_face(font)
+            cr.set_font_size(size)
+            cr.move_to(4, size + 2)
+            cr.show_text(char)
+            surface.flush()
+            image = wt_vision.array_from_pixels(surface.get_data(), surface.get_width(),
+                                                surface.get_height(), surface.get_stride(), 4)
+            samples.append((char, wt_vision.glyph_from_image(image)))
+    return samples
+
+
+def load_glyph_samples(directory=GLYPHS_DIR):
+    """Образцы цифр из PNG-файлов пользователя: первый символ имени - цифра"""
+    import wt_vision
+    from gi.repository import GdkPixbuf
+    samples = []
+    if not os.path.isdir(directory):
+        return samples
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(".png") or not name[0].isdigit():
+            continue
+        try:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file(os.path.join(directory, name))
+        except GLib.Error:
+            continue
+        image = wt_vision.array_from_pixels(pixbuf.get_pixels(), pixbuf.get_width(),
+                                            pixbuf.get_height(), pixbuf.get_rowstride(),
+                                            pixbuf.get_n_channels())
+        samples.append((name[0], wt_vision.glyph_from_image(image)))
+    return samples
+
+
+class SurfaceCache:
+    """Готовые поверхности cairo с вытеснением давно не использованных (LRU)"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        """Поверхность для key; при отсутствии строится вызовом build()"""
+        surface = self.entries.get(key)
+        if surface is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return surface
+        self.misses += 1
+        surface = build()
+        self.entries[key] = surface
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return surface
+
+
+class LabelRenderer:
+    """Подписи расстояний из заранее отрисованной полосы символов.
+
+    Символы один раз раскладываются Pango и растеризуются в маску-полосу.
+    Поверхность подписи собирается из кусков полосы только при смене текста
+    и хранится в кэше, вывод подписи в кадре - одна операция маски. Текст с
+    символами не из LABEL_CHARS раскладывается Pango целиком.
+    """
+
+    def __init__(self, pixel_size, font="Sans"):
+        self.pixel_size = pixel_size
+        self.font = font
+        self.layout = None
+        self.advances = {}  # символ -> (смещение в полосе, ширина)
+        self.strip = None
+        self.strip_width = 0
+        self.ascent = 0
+        self.height = 0
+        self.cache = SurfaceCache(LABEL_CACHE_SIZE)
+
+    def get_layout(self):
+        """Раскладка Pango и метрики символов полосы; строятся при первой подписи"""
+        if self.layout is None:
+            from gi.repository import Pango, PangoCairo
+            context = PangoCairo.FontMap.get_default().create_context()
+            layout = Pango.Layout.new(context)
+            description = Pango.FontDescription.from_string(self.font)
+            description.set_absolute_size(self.pixel_size * Pango.SCALE)
+            layout.set_font_description(description)
+
+            offset = 0
+            for char in LABEL_CHARS:
+                layout.set_text(char, -1)
+                _, logical = layout.get_pixel_extents()
+                self.advances[char] = (offset, logical.width)
+                # Промежуток, чтобы сглаживание соседних символов не попадало в вырезку
+                offset += logical.width + 2
+                self.height = max(self.height, logical.height)
+            self.strip_width = offset
+            self.ascent = layout.get_baseline() // Pango.SCALE
+            self.layout = layout
+        return self.layout
+
+    def measure(self, text):
+        """Ширина подписи в пикселях"""
+        layout = self.get_layout()
+        advances = self.advances
+        if all(char in advances for char in text):
+            return sum(advances[char][1] for char in text)
+        layout.set_text(text, -1)
+        return layout.get_pixel_extents()[1].width
+
+    def extents(self, text, x, baseline_y, pad=DAMAGE_PAD):
+        """Область подписи с базовой линией в (x, baseline_y)"""
+        self.get_layout()
+        top = baseline_y - self.ascent
+        return rect_from_points(x, top, x + self.measure(text), top + self.height, pad)
+
+    def get_strip(self, target):
+        if self.strip is None:
+            from gi.repository import PangoCairo
+            layout = self.get_layout()
+            self.strip = target.create_similar(cairo.CONTENT_ALPHA, self.strip_width, self.height)
+            cr = cairo.Context(self.strip)
+            cr.set_source_rgba(0, 0, 0, 1)
+            for char, (offset, _) in self.advances.items():
+                layout.set_text(char, -1)
+                cr.move_to(offset, 0)
+                PangoCairo.show_layout(cr, layout)
+        return self.strip
+
+    def build(self, target, text):
+        """Маска подписи: куски полосы или, для прочих символов, раскладка Pango"""
+        width = max(1, self.measure(text))
+        surface = target.create_similar(cairo.CONTENT_ALPHA, width, self.height)
+        cr = cairo.Context(surface)
+        advances = self.advances
+        if all(char in advances for char in text):
+            strip = self.get_strip(target)
+            x = 0
+            for char in text:
+                offset, advance = advances[char]
+                cr.set_source_surface(strip, x - offset, 0)
+                cr.rectangle(x, 0, advance, self.height)
+                cr.fill()
+                x += advance
+        else:
+            from gi.repository import PangoCairo
+            self.layout.set_text(text, -1)
+            cr.set_source_rgba(0, 0, 0, 1)
+            PangoCairo.show_layout(cr, self.layout)
+        return surface
+
+    def draw(self, cr, text, x, baseline_y):
+        """Выводит подпись текущим источником cr"""
+        surface = self.cache.get(text, lambda: self.build(cr.get_target(), text))
+        cr.mask_surface(surface, round(x), round(baseline_y) - self.ascent)
+
+
+class GridHitMap:
+    """Зоны сетки: уголки изменения размера в пространственном индексе и область перемещения"""
+
+    def __init__(self, grid_pos, grid_size, index, threshold=15):
+        x, y = grid_pos
+        self.key = (grid_pos, grid_size)
+        self.index = index
+        corners = (
+            ('tl', x, y),  # top-left
+            ('tr', x + grid_size, y),  # top-right
+            ('bl', x, y + grid_size),  # bottom-left
+            ('br', x + grid_size, y + grid_size)  # bottom-right
+        )
+        for corner, cx, cy in corners:
+            index.update(('corner', corner), cx, cy, threshold)
+        self.inner = (x, y, x + grid_size, y + grid_size)
+
+    def classify(self, x, y):
+        """Возвращает угол ('tl', 'tr', 'bl', 'br'), 'move' внутри сетки или None"""
+        hit = self.index.query(x, y, ('corner',))
+        if hit is not None:
+            return hit[1]
+        x1, y1, x2, y2 = self.inner
+        if x1 <= x <= x2 and y1 <= y <= y2:
+            return 'move'
+        return None
+
+
+class MapRuler(Gtk.Window):
+    def __init__(self, config_file=wt_core.CONFIG_FILE, startup_profile=False, tracer=None):
         super().__init__(title="Дальномер для War Thunder")
+        # Обёртки ставятся до подключения сигналов; без трассировки методы не меняются
+        self.tracer = tracer
+        if tracer is not None:
+            for name in TRACED_METHODS:
+                setattr(self, name, tracer.wrap(getattr(self, name), name))
         self.set_default_size(500, 480)
         self.set_app_paintable(True)
         self.set_skip_taskbar_hint(True)
@@ -30,7 +498,7 @@ class MapRuler(Gtk.Window):
         self.scale_factor = 1.0  # Будет установлено после калибровки
         self.start_point = None
         self.end_point = None
-        self.temp_point = None
+        self.temp_point = None  # (x, y) текущего положения мыши
         self.last_focus = None
         self.horizontal_only = False
         self.calibration_mode = False
@@ -38,6 +506,38 @@ class MapRuler(Gtk.Window):
         self.drag_corner = None
         self.drag_start = None
 
+        # Режим маршрута: точки добавляются кликами, любую можно перетащить
+        self.path_mode = False
+        self.path = wt_core.PathMeasure()
+        self.path_drag = None  # Номер перетаскиваемой точки
+        self.point_drag = None  # Перетаскиваемая точка линейки: 'A' или 'B'
+        self.path_legs_shown = 0  # Сколько участков сейчас учтено в damage
+
+        # Кольца дальности вокруг точки А, заранее отрисованные для каждого масштаба
+        self.rings_enabled = False
+        self.ring_spacing = 250
+        self.ring_style = 'solid'
+        self.ring_max_range = RING_MAX_RANGE
+        self.ring_cache = SurfaceCache(RING_CACHE_SIZE)
+
+        # Подписи расстояния на линии и длин участков маршрута
+        self.label_renderer = LabelRenderer(24)
+        self.leg_renderer = LabelRenderer(14)
+        self.distance_text = None  # Текст, показанный в панели
+
+        # Минимальный режим: окно видно и принимает клики только на панели,
+        # линиях и маркерах, остальные клики проходят в игру
+        self.minimal_mode = False
+
+        # Запись событий ввода в журнал и их воспроизведение (wt_replay)
+        self.recorder = None
+        self.player = None
+
+        # Глобальные горячие клавиши: работают, пока фокус у игры
+        self.hotkeys = None
+        self.hotkeys_enabled = True
+        self.hotkey_bindings = {}  # действие -> сочетание, поверх wt_hotkeys.DEFAULT_BINDINGS
+
         # Калибровочные значения
         self.calibrated_scale = None
         self.use_calibrated_scale = False
@@ -45,13 +545,90 @@ class MapRuler(Gtk.Window):
         self.grid_size = 200  # Начальный размер сетки
         self.grid_pos = (100, 100)  # Начальная позиция сетки
 
-        # Загрузка сохраненных настроек
-        self.config_file = os.path.expanduser("~/.wt_map_ruler_calibration.ini")
-        self.load_config()
-
-        # Если есть сохранённая калибровка, используем её
-        if self.use_calibrated_scale and self.calibrated_scale:
-            self.scale_factor = self.calibrated_scale
+        # Калибровки для разных мониторов и разрешений
+        self.profiles = wt_core.ProfileStore()
+        self.display_key = None  # Рабочее место, калибровка которого сейчас активна
+        self.profile_pending = False  # У рабочего места ещё нет своей калибровки
+        self.game_ui_scale = wt_core.DEFAULT_GAME_UI_SCALE
+
+        # Автоопределение масштаба карты: детектор создаётся при первом включении
+        self.scale_detector = None
+        self.scale_detect_enabled = False
+        self.scale_detect_region = SCALE_DETECT_REGION
+        self.scale_detect_interval = SCALE_DETECT_INTERVAL_MS
+        self.scale_detect_id = None
+
+        # Захват экрана через X11: создаётся при первом снимке
+        self.capture = None
+        self.capture_method = 'auto'
+        self.capture_max_fps = CAPTURE_MAX_FPS
+        self.capture_roi_region = CAPTURE_ROI
+
+        # Притягивание точек к маркерам: поиск создаётся при первом включении
+        self.snap_enabled = False
+        self.snap_radius = SNAP_RADIUS
+        self.snap_hues = SNAP_HUES
+        self.snapper = None
+        self.snap_ms = wt_metrics.RingStats(256)
+
+        # Таблицы стрельбы: название снаряда -> wt_ballistics.ShellTable
+        self.ballistics = {}
+        self.shell = None
+        self.shell_name = ''
+
+        # Локальный API для сторонних программ
+        self.ipc = None
+        self.ipc_enabled = True
+        self.ipc_socket = ''  # Пусто - путь по умолчанию из wt_ipc
+
+        # Слежение за своим маркером: шаблон строится заново при каждой новой точке А
+        self.tracker = None
+        self.track_id = None
+        self.track_ms = wt_metrics.RingStats(256)
+        self.track_steps = 0
+
+        # Области окна, которые нужно перерисовать при изменении линии и сетки
+        self.damage = DamageTracker(self)
+
+        # События мыши копятся до следующего кадра: хранится только последнее положение
+        self.max_fps = 0  # Ограничение частоты перерисовки, 0 - частота монитора
+        self.pointer = None
+        self.pending_events = 0
+        self.coalesced_events = 0  # Сколько событий объединил последний кадр
+        self.last_frame_time = 0
+        self.tick_id = None
+        self.first_event_time = 0  # Время первого события, ждущего кадра, мкс
+
+        # Метрики отрисовки и ввода, HUD с ними и выгрузка в JSON
+        self.metrics = wt_metrics.FrameMetrics()
+        self.hud_enabled = False
+        self.hud_timer = None
+        self.hud_layout = None
+        self.hud_text = None
+        self.metrics_path = None  # Файл выгрузки метрик (--metrics-json)
+        self.metrics_info = {}
+
+        # Статичный слой (фон и сетка калибровки) и параметры, с которыми он построен
+        self.static_layer = None
+        self.static_layer_key = None
+
+        # Курсоры создаются один раз для каждого дисплея
+        self.cursors = {}
+        self.hover_cursor = None  # Тип курсора, установленный сейчас
+        self.hit_map = None
+
+        # Все элементы, которые можно схватить мышью: уголки сетки ('corner', угол),
+        # точки линейки ('point', 'A'/'B') и точки маршрута ('vertex', номер)
+        self.hit_index = wt_core.SpatialHash()
+        self.input_shape = ShapeRegion()  # Принимающая клики часть окна в минимальном режиме
+
+        # Сохранённые настройки читаются после первого кадра
+        self.config_file = config_file
+        self.config_loaded = False
+        self.config_writer = wt_core.ConfigWriter(config_file)
+        self.first_frame_done = False
+        self.startup_profile = startup_profile
+        startup_mark("состояние окна")
 
         # Создаем основной контейнер
         self.box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=5)
@@ -59,6 +636,8 @@ class MapRuler(Gtk.Window):
 
         # Создаем панель управления
         self.create_control_panel()
+        self.connect_recording()
+        startup_mark("панель управления")
 
         # Обработчики событий
         self.connect("draw", self.on_draw)
@@ -69,6 +648,8 @@ class MapRuler(Gtk.Window):
         self.connect("key-release-event", self.on_key_release)
         self.connect("destroy", self.on_destroy)
         self.connect("realize", self.on_realize)
+        self.connect("configure-event", self.on_configure)
+        self.get_screen().connect("monitors-changed", self.select_profile)
         self.set_events(Gdk.EventMask.POINTER_MOTION_MASK |
                        Gdk.EventMask.BUTTON_PRESS_MASK |
                        Gdk.EventMask.BUTTON_RELEASE_MASK |
@@ -76,6 +657,180 @@ class MapRuler(Gtk.Window):
                        Gdk.EventMask.KEY_RELEASE_MASK)
         self.set_opacity(0.85)
 
+    def deferred_init(self):
+        """Всё, что не нужно для первого кадра: настройки, оформление кнопок"""
+        self.load_config()
+        # Если есть сохранённая калибровка, используем её
+        if self.use_calibrated_scale and self.calibrated_scale:
+            self.scale_factor = self.calibration().scale_factor(self.selected_scale)
+        self.scale_combo.set_active(MAP_SCALES.index(self.selected_scale))
+        self.recalculate_scale()
+        self.refresh(full=True)
+        self.select_profile()
+        if self.scale_detect_enabled:
+            self.detect_btn.set_active(True)
+        self.rings_btn.set_active(self.rings_enabled)
+        if self.snap_enabled:
+            self.snap_btn.set_active(True)
+        startup_mark("чтение настроек")
+
+        self.start_hotkeys()
+        startup_mark("глобальные клавиши")
+
+        self.start_ipc()
+        startup_mark("локальный API")
+
+        self.load_ballistics()
+        startup_mark("таблицы стрельбы")
+
+        self.add_css(BUTTONS_CSS)
+        startup_mark("оформление кнопок")
+
+        if self.startup_profile:
+            self.print_startup_profile()
+        if self.player is not None:
+            self.player.start()
+        return False
+
+    def print_startup_profile(self):
+        """Выводит в stderr разбивку времени запуска по этапам"""
+        previous = STARTUP_T0
+        first_frame = None
+        print("Профиль запуска, мс (от импорта wt_ruler):", file=sys.stderr)
+        for name, mark in startup_marks:
+            print(f"  {name:<24}{(mark - previous) * 1000:8.1f}{(mark - STARTUP_T0) * 1000:9.1f}",
+                  file=sys.stderr)
+            if name == "первый кадр":
+                first_frame = (mark - STARTUP_T0) * 1000
+            previous = mark
+        if first_frame is not None:
+            status = "в бюджете" if first_frame <= STARTUP_BUDGET_MS else "ПРЕВЫШЕН бюджет"
+            print(f"До первого кадра: {first_frame:.1f} мс ({status} {STARTUP_BUDGET_MS} мс)",
+                  file=sys.stderr)
+
+    def start_hotkeys(self):
+        """Перехватывает глобальные сочетания клавиш, если дисплей - X11"""
+        # При воспроизведении журнала клавиши не перехватываются: сочетания уже в журнале
+        if (not self.hotkeys_enabled or self.player is not None
+                or not isinstance(self.get_display(), GdkX11.X11Display)):
+            return
+        try:
+            import wt_hotkeys
+            bindings = dict(wt_hotkeys.DEFAULT_BINDINGS)
+            bindings.update(self.hotkey_bindings)
+            listener = wt_hotkeys.HotkeyListener(
+                bindings, self.on_hotkey,
+                lambda func, *args: GLib.idle_add(func, *args, priority=GLib.PRIORITY_HIGH),
+                actions=ACTIONS)
+            listener.start()
+        except OSError as error:
+            print(f"Глобальные горячие клавиши недоступны: {error}", file=sys.stderr)
+            return
+        for message in listener.invalid:
+            print(f"Ошибка в секции [HOTKEYS]: {message}", file=sys.stderr)
+        if listener.failed:
+            print(f"Сочетания заняты другими программами: {', '.join(listener.failed)}",
+                  file=sys.stderr)
+        self.hotkeys = listener
+        # Сохраняем, только если к настройкам добавились сочетания по умолчанию
+        changed = bindings != self.hotkey_bindings
+        self.hotkey_bindings = bindings
+        if changed:
+            self.save_config()
+
+    def start_ipc(self):
+        """Открывает сокет локального API, если он не отключён в настройках"""
+        if not self.ipc_enabled or self.player is not None:
+            return
+        import wt_ipc
+        server = wt_ipc.IpcServer(self.ipc_socket or wt_ipc.default_socket_path(), self.ipc_state)
+        try:
+            server.start()
+        except OSError as error:
+            print(f"Локальный API недоступен: {error}", file=sys.stderr)
+            return
+        self.ipc = server
+        server.publish(self.ipc_state())
+
+    def load_ballistics(self):
+        """Читает таблицы стрельбы и показывает выбор снаряда, если они есть"""
+        import wt_ballistics
+        try:
+            self.ballistics = wt_ballistics.load_tables()
+        except RuntimeError as error:  # Нет NumPy
+            print(f"Таблицы стрельбы недоступны: {error}", file=sys.stderr)
+            return
+        if not self.ballistics:
+            return
+        self.shell_combo.append_text("Без снаряда")
+        for name in self.ballistics:
+            self.shell_combo.append_text(name)
+        names = list(self.ballistics)
+        self.shell_combo.set_active(names.index(self.shell_name) + 1 if self.shell_name in names else 0)
+        self.shell_combo.set_visible(True)
+
+    def on_shell_changed(self, combo):
+        """Выбор снаряда: возвышение добавляется к подписи и панели"""
+        self.shell = self.ballistics.get(combo.get_active_text())
+        self.shell_name = self.shell.name if self.shell is not None else ''
+        self.update_distance_display()
+        self.refresh()
+        self.save_config()
+
+    def elevation(self, meters):
+        """Возвышение прицела для дальности или None"""
+        return self.shell.lookup(meters) if self.shell is not None and meters is not None else None
+
+    def elevation_suffix(self, meters, panel=False):
+        """Возвышение для подписи и панели: ' · 7.1 тыс' или пустая строка"""
+        if self.shell is None:
+            return ""
+        value = self.shell.lookup(meters)
+        if value is None:
+            return " · вне таблицы" if panel else ""
+        return f" · {value:.1f} {self.shell.unit_label}"
+
+    def ipc_state(self):
+        """Состояние для локального API: только значения, пригодные для JSON"""
+        def point(p):
+            return [p.x, p.y] if p is not None else None
+        distance = self.current_distance()
+        return {
+            'distance_m': distance,
+            'scale_factor': self.scale_factor,
+            'selected_scale': self.selected_scale,
+            'calibrated': bool(self.use_calibrated_scale and self.calibrated_scale),
+            'mode': 'calibration' if self.calibration_mode else 'path' if self.path_mode else 'ruler',
+            'start_point': point(self.start_point),
+            'end_point': point(self.end_point),
+            'path_points': len(self.path),
+            'shell': self.shell_name or None,
+            'elevation': self.elevation(distance) if not self.path_mode else None,
+        }
+
+    def publish_state(self):
+        """Рассылает подписчикам API изменившиеся значения"""
+        if self.ipc is not None and self.ipc.subscribers:
+            self.ipc.publish(self.ipc_state())
+
+    def hotkeys_help(self):
+        """Строки инструкции о глобальных клавишах и их задержке"""
+        if self.hotkeys is None:
+            return "\n\n🌐 Глобальные горячие клавиши недоступны (нужен X11)"
+        grabbed = set(self.hotkeys.grabs.values())
+        lines = [f"• {text} - {action}" for action, text in self.hotkey_bindings.items()
+                 if action in grabbed]
+        text = "\n\n🌐 Глобальные горячие клавиши (работают, пока фокус у игры):\n" + "\n".join(lines)
+        stats = self.hotkeys.latency.summary()
+        if stats:
+            text += (f"\nЗадержка от нажатия до действия: p50 {stats['p50']:.2f} мс, "
+                     f"p95 {stats['p95']:.2f} мс ({stats['count']} нажатий)")
+        return text
+
+    def open_youtube(self, widget=None):
+        import webbrowser
+        webbrowser.open(YOUTUBE_URL)
+
     def on_realize(self, widget):
         screen = self.get_screen()
         monitor = screen.get_display().get_primary_monitor()
@@ -86,47 +841,223 @@ class MapRuler(Gtk.Window):
         self.move(x, y)
         self.set_keep_above(True)
         self.set_accept_focus(False)
+        self.select_profile()
+
+    def on_configure(self, widget, event):
+        # Окно могли перетащить на другой монитор
+        self.select_profile()
+        return False
+
+    def current_display_key(self):
+        """Ключ рабочего места для монитора, на котором находится окно"""
+        screen = self.get_screen()
+        display = screen.get_display()
+        window = self.get_window()
+        if window:
+            monitor = display.get_monitor_at_window(window)
+            number = screen.get_monitor_at_window(window)
+        else:
+            monitor = display.get_primary_monitor()
+            number = screen.get_primary_monitor()
+        if monitor is None:
+            return None
+        geometry = monitor.get_geometry()
+        connector = screen.get_monitor_plug_name(number) or monitor.get_model() or str(number)
+        return wt_core.DisplayKey(connector, geometry.width, geometry.height,
+                                  monitor.get_scale_factor(), self.game_ui_scale)
+
+    def select_profile(self, *args):
+        """Включает калибровку монитора, на котором находится окно"""
+        if not self.config_loaded:
+            return
+        key = self.current_display_key()
+        if key is None or key == self.display_key:
+            return
+
+        # Запоминаем калибровку прежнего места и берём сохранённую для нового
+        if self.display_key is not None and not self.profile_pending:
+            self.profiles.set(self.display_key, self.calibration())
+        profile = self.profiles.get(key)
+        first_migration = self.display_key is None and not len(self.profiles)
+        self.profile_pending = False
+        if profile is not None:
+            self.set_calibration(profile)
+            self.scale_factor = profile.scale_factor(self.selected_scale)
+        elif not (first_migration and self.calibrated_scale is not None):
+            # Калибровка другого монитора дала бы здесь неверные дальности. Исключение -
+            # первый запуск с профилями: калибровка из общей секции становится профилем места
+            profile = wt_core.Calibration()
+            self.set_calibration(profile)
+            self.scale_factor = profile.scale_factor(self.selected_scale)
+            self.profile_pending = True
+            print(f"Для монитора {key.connector} {key.width}x{key.height} нет калибровки, "
+                  f"откалибруйте сетку", file=sys.stderr)
+        self.display_key = key
+        self.scale_value.set_tooltip_text(
+            f"Профиль: {key.connector} {key.width}x{key.height}, "
+            f"HiDPI x{key.scale}, интерфейс игры {key.ui_scale}%"
+            + ("\nНет калибровки для этого монитора - нажмите «Калибровать»"
+               if self.profile_pending else ""))
+
+        self.recalculate_scale()
+        self.refresh(full=True)
+        self.save_config()
 
     def load_config(self):
-        config = configparser.ConfigParser()
-        if os.path.exists(self.config_file):
-            config.read(self.config_file)
-            try:
-                # Калиброванные значения
-                self.calibrated_scale = float(config.get('CALIBRATION', 'calibrated_scale', fallback="0"))
-                if self.calibrated_scale <= 0:
-                    self.calibrated_scale = None
-                self.use_calibrated_scale = config.getboolean('CALIBRATION', 'use_calibrated_scale', fallback=False)
-                self.calibration_base_scale = config.getint('CALIBRATION', 'calibration_base_scale', fallback=None)
-
-                # Загружаем сохраненные параметры сетки
-                self.grid_size = config.getfloat('GRID', 'grid_size', fallback=200)
-                self.grid_pos = (
-                    config.getfloat('GRID', 'grid_x', fallback=100),
-                    config.getfloat('GRID', 'grid_y', fallback=100)
-                )
-            except (ValueError, configparser.NoOptionError):
-                self.calibrated_scale = None
-                self.use_calibrated_scale = False
-                self.calibration_base_scale = None
+        # При повреждённом файле настройки берутся из последней исправной копии
+        config = wt_core.read_config(self.config_file)
+        # Общая секция хранит калибровку последнего активного рабочего места
+        self.set_calibration(wt_core.read_calibration(config))
+        self.profiles.read(config)
+
+        try:
+            self.game_ui_scale = config.getint('DISPLAY', 'game_ui_scale',
+                                               fallback=wt_core.DEFAULT_GAME_UI_SCALE)
+        except ValueError:
+            self.game_ui_scale = wt_core.DEFAULT_GAME_UI_SCALE
+
+        try:
+            self.max_fps = max(0, config.getint('RENDER', 'max_fps', fallback=0))
+        except ValueError:
+            self.max_fps = 0
+        try:
+            selected_scale = config.getint('MAP', 'selected_scale', fallback=self.selected_scale)
+        except ValueError:
+            selected_scale = self.selected_scale
+        if selected_scale in MAP_SCALES:
+            self.selected_scale = selected_scale
+
+        self.rings_enabled = config.getboolean('RINGS', 'enabled', fallback=False)
+        try:
+            self.ring_spacing = max(10, config.getint('RINGS', 'spacing', fallback=self.ring_spacing))
+            self.ring_max_range = max(100, config.getint('RINGS', 'max_range', fallback=RING_MAX_RANGE))
+        except ValueError:
+            pass
+        style = config.get('RINGS', 'style', fallback=self.ring_style)
+        if style in RING_STYLES:
+            self.ring_style = style
+
+        if config.has_section('HOTKEYS'):
+            self.hotkeys_enabled = config.getboolean('HOTKEYS', 'enabled', fallback=True)
+            self.hotkey_bindings = {action: text for action, text in config['HOTKEYS'].items()
+                                    if action != 'enabled'}
+
+        method = config.get('CAPTURE', 'method', fallback=self.capture_method)
+        if method in CAPTURE_METHODS:
+            self.capture_method = method
+        try:
+            self.capture_max_fps = max(1, config.getint('CAPTURE', 'max_fps', fallback=CAPTURE_MAX_FPS))
+            region = tuple(float(v) for v in config.get('CAPTURE', 'roi', fallback='').split(','))
+            if len(region) == 4:
+                self.capture_roi_region = region
+        except ValueError:
+            pass
+
+        self.shell_name = config.get('BALLISTICS', 'shell', fallback='')
+
+        self.ipc_enabled = config.getboolean('IPC', 'enabled', fallback=True)
+        self.ipc_socket = config.get('IPC', 'socket', fallback='')
+
+        self.snap_enabled = config.getboolean('SNAP', 'enabled', fallback=False)
+        try:
+            self.snap_radius = max(4, config.getint('SNAP', 'radius', fallback=SNAP_RADIUS))
+            hues = config.get('SNAP', 'hues', fallback='')
+            if hues:
+                self.snap_hues = tuple(tuple(float(v) for v in item.split('-'))
+                                       for item in hues.split(','))
+        except ValueError:
+            pass
+
+        self.scale_detect_enabled = config.getboolean('SCALE_DETECT', 'enabled', fallback=False)
+        try:
+            region = tuple(float(v) for v in config.get('SCALE_DETECT', 'region', fallback='').split(','))
+            if len(region) == 4:
+                self.scale_detect_region = region
+        except ValueError:
+            pass
+        try:
+            self.scale_detect_interval = max(100, config.getint(
+                'SCALE_DETECT', 'interval_ms', fallback=SCALE_DETECT_INTERVAL_MS))
+        except ValueError:
+            self.scale_detect_interval = SCALE_DETECT_INTERVAL_MS
+        self.config_loaded = True
 
     def save_config(self):
+        # Не перезаписываем файл значениями по умолчанию, если он ещё не прочитан
+        if not self.config_loaded:
+            return
+        import configparser
         config = configparser.ConfigParser()
-        config['CALIBRATION'] = {
-            'calibrated_scale': str(self.calibrated_scale) if self.calibrated_scale is not None else "0",
-            'use_calibrated_scale': str(self.use_calibrated_scale),
-            'calibration_base_scale': str(self.calibration_base_scale) if self.calibration_base_scale is not None else "0"
+        # Калибровка и параметры сетки, в том числе в профиле текущего монитора
+        wt_core.write_calibration(config, self.calibration())
+        # Профиль нового места появляется только после его калибровки
+        if self.display_key is not None and not self.profile_pending:
+            self.profiles.set(self.display_key, self.calibration())
+        self.profiles.write(config)
+
+        config['DISPLAY'] = {
+            'game_ui_scale': str(self.game_ui_scale)
         }
 
-        # Сохраняем параметры сетки
-        config['GRID'] = {
-            'grid_size': str(self.grid_size),
-            'grid_x': str(self.grid_pos[0]),
-            'grid_y': str(self.grid_pos[1])
+        config['MAP'] = {
+            'selected_scale': str(self.selected_scale)
         }
 
-        with open(self.config_file, 'w') as configfile:
-            config.write(configfile)
+        config['RENDER'] = {
+            'max_fps': str(self.max_fps)
+        }
+
+        config['RINGS'] = {
+            'enabled': str(self.rings_enabled),
+            'spacing': str(self.ring_spacing),
+            'style': self.ring_style,
+            'max_range': str(self.ring_max_range)
+        }
+
+        config['HOTKEYS'] = {'enabled': str(self.hotkeys_enabled)}
+        config['HOTKEYS'].update(self.hotkey_bindings)
+
+        config['CAPTURE'] = {
+            'method': self.capture_method,
+            'max_fps': str(self.capture_max_fps),
+            'roi': ', '.join(f"{v:g}" for v in self.capture_roi_region)
+        }
+
+        config['BALLISTICS'] = {
+            'shell': self.shell_name
+        }
+
+        config['IPC'] = {
+            'enabled': str(self.ipc_enabled),
+            'socket': self.ipc_socket
+        }
+
+        config['SNAP'] = {
+            'enabled': str(self.snap_enabled),
+            'radius': str(self.snap_radius),
+            'hues': ', '.join(f"{lo:g}-{hi:g}" for lo, hi in self.snap_hues)
+        }
+
+        config['SCALE_DETECT'] = {
+            'enabled': str(self.scale_detect_enabled),
+            'region': ', '.join(f"{v:g}" for v in self.scale_detect_region),
+            'interval_ms': str(self.scale_detect_interval)
+        }
+
+        # Запись на диск идёт в фоне и объединяет частые изменения
+        self.config_writer.schedule(wt_core.config_to_text(config))
+
+    def calibration(self):
+        """Текущая калибровка в виде wt_core.Calibration"""
+        return wt_core.Calibration(self.calibrated_scale, self.use_calibrated_scale,
+                                   self.calibration_base_scale, self.grid_size, self.grid_pos)
+
+    def set_calibration(self, calibration):
+        self.calibrated_scale = calibration.calibrated_scale
+        self.use_calibrated_scale = calibration.use_calibrated_scale
+        self.calibration_base_scale = calibration.calibration_base_scale
+        self.grid_size = calibration.grid_size
+        self.grid_pos = calibration.grid_pos
 
     def recalculate_scale(self):
         # Обновляем отображение
@@ -134,14 +1065,31 @@ class MapRuler(Gtk.Window):
             if self.use_calibrated_scale and self.calibrated_scale is not None:
                 base_text = f" (база: {self.calibration_base_scale} м)" if self.calibration_base_scale else ""
                 self.scale_value.set_text(f"{self.scale_factor:.6f} м/пикс{base_text}")
+            elif self.profile_pending:
+                self.scale_value.set_text("нет калибровки для монитора")
             else:
                 self.scale_value.set_text(f"{self.scale_factor:.6f} м/пикс")
 
-        if hasattr(self, 'distance_value') and self.start_point and self.end_point:
+        if hasattr(self, 'distance_value') and (self.path_mode or self.start_point and self.end_point):
             self.update_distance_display()
+        else:
+            self.publish_state()
 
     def on_destroy(self, widget):
+        if self.hotkeys is not None:
+            self.hotkeys.stop()
+        if self.ipc is not None:
+            self.ipc.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.capture:
+            self.capture.close()
+        if self.metrics_path is not None:
+            self.export_metrics()
         self.save_config()
+        self.config_writer.flush()
+        if self.tracer is not None:
+            self.tracer.close()
         Gtk.main_quit()
 
     def show_help(self, widget):
@@ -160,7 +1108,15 @@ class MapRuler(Gtk.Window):
             "⚙️ Основное использование:\n"
             "1. Правой кнопкой мыши установите начальную точку (точка А)\n"
             "2. Левой кнопкой мыши установите/переместите конечную точку (точка Б)\n"
-            "3. Расстояние автоматически отобразится в интерфейсе\n\n"
+            "   Точки А и Б можно перетаскивать левой кнопкой\n"
+            "3. Расстояние автоматически отобразится в интерфейсе\n"
+            "   С таблицами стрельбы рядом показывается возвышение прицела для выбранного снаряда\n\n"
+
+            "🧭 Маршрут (кнопка 'Маршрут' или P):\n"
+            "1. Левой кнопкой мыши добавляйте точки маршрута\n"
+            "2. Перетаскивайте любую точку левой кнопкой\n"
+            "3. Правая кнопка удаляет последнюю точку\n"
+            "   Длина каждого участка подписана на карте, общая - в панели\n\n"
 
             "🎯 Калибровка (для точных измерений):\n"
             "1. Нажмите кнопку 'Калибровать'\n"
@@ -169,19 +1125,33 @@ class MapRuler(Gtk.Window):
             "   - Зажмите левую кнопку мыши внутри сетки для перемещения\n"
             "3. Выберите масштаб карты из выпадающего списка\n"
             "4. Нажмите 'Применить калибровку'\n"
-            "5. Теперь все измерения будут точными!\n\n"
+            "5. Теперь все измерения будут точными!\n"
+            "   Кнопка 'Авто' (A) находит сетку карты под окном сама\n\n"
 
             "⌨️ Горячие клавиши:\n"
             "• R - Сбросить точки измерения\n"
             "• T - Переключить режим 'Поверх всех окон'\n"
             "• C - Переключить режим калибровка/измерение\n"
+            "• A - Автокалибровка (в режиме калибровки)\n"
+            "• D - Определять масштаб карты автоматически\n"
+            "• P - Режим маршрута из нескольких точек\n"
+            "• G - Кольца дальности вокруг точки А, Shift+G - шаг колец\n"
+            "• M - Минимальный режим: клики мимо панели и линии уходят в игру\n"
+            "• S - Притягивать точки к маркерам на карте\n"
+            "• K - Точка А следует за своим маркером, расстояние обновляется\n"
+            "• H - Показать время отрисовки и задержку ввода\n"
             "• Y - Открыть YouTube канал EXTRUD\n"
             "• ESC - Закрыть приложение\n\n"
 
             "💡 Советы:\n"
-            "• Калибровку нужно выполнять один раз для каждого разрешения экрана\n"
+            "• Калибровку нужно выполнять один раз для каждого разрешения экрана:\n"
+            "  она запоминается для каждого монитора и выбирается автоматически\n"
             "• Калиброванные значения сохраняются между запусками программы\n"
-            "• Для лучшей точности калибруйтесь на максимальном масштабе карты"
+            "• Для лучшей точности калибруйтесь на максимальном масштабе карты\n"
+            "• Автоопределение масштаба (D) читает надпись масштаба под сеткой\n"
+            "  калибровки: совместите сетку с картой, и список масштабов\n"
+            "  будет переключаться сам при смене карты"
+            + self.hotkeys_help()
         )
 
         # Создаем текстовое поле
@@ -245,12 +1215,34 @@ class MapRuler(Gtk.Window):
         self.distance_value.get_style_context().add_class("distance-value")
         self.control_box.pack_start(self.distance_value, False, False, 0)
 
+        # Выбор снаряда (виден, только если есть таблицы стрельбы)
+        self.shell_combo = Gtk.ComboBoxText()
+        self.shell_combo.set_tooltip_text("Снаряд для расчёта возвышения прицела")
+        self.shell_combo.set_visible(False)
+        self.shell_combo.set_no_show_all(True)
+        self.shell_combo.connect("changed", self.on_shell_changed)
+        self.control_box.pack_start(self.shell_combo, False, False, 0)
+
+        self.path_btn = Gtk.ToggleButton(label="Маршрут")
+        self.path_btn.set_tooltip_text("Измерение маршрута из нескольких точек (P)")
+        self.path_btn.connect("toggled", self.on_path_toggled)
+        self.control_box.pack_start(self.path_btn, False, False, 0)
+
         # Кнопка применения калибровки (видна только в режиме калибровки)
         self.apply_btn = Gtk.Button(label="Применить калибровку")
         self.apply_btn.set_visible(False)
+        self.apply_btn.set_no_show_all(True)
         self.apply_btn.connect("clicked", self.apply_calibration)
         self.control_box.pack_start(self.apply_btn, False, False, 0)
 
+        # Автоматический поиск сетки карты (виден только в режиме калибровки)
+        self.auto_btn = Gtk.Button(label="Авто")
+        self.auto_btn.set_visible(False)
+        self.auto_btn.set_no_show_all(True)
+        self.auto_btn.set_tooltip_text("Найти сетку карты под окном автоматически (A)")
+        self.auto_btn.connect("clicked", self.auto_calibrate)
+        self.control_box.pack_start(self.auto_btn, False, False, 0)
+
         self.reset_btn = Gtk.Button(label="↺")
         self.reset_btn.get_style_context().add_class("reset-btn")
         self.reset_btn.connect("clicked", self.reset_points)
@@ -259,7 +1251,7 @@ class MapRuler(Gtk.Window):
 
         self.youtube_btn = Gtk.Button(label="Y")
         self.youtube_btn.get_style_context().add_class("youtube-btn")
-        self.youtube_btn.connect("clicked", lambda w: webbrowser.open("https://www.youtube.com/@EXTRUD/shorts"))
+        self.youtube_btn.connect("clicked", self.open_youtube)
         self.youtube_btn.set_tooltip_text("YouTube канал EXTRUD")
         self.control_box.pack_end(self.youtube_btn, False, False, 0)
 
@@ -270,73 +1262,42 @@ class MapRuler(Gtk.Window):
         self.help_btn.set_tooltip_text("Показать инструкцию")
         self.control_box.pack_end(self.help_btn, False, False, 0)
 
+        self.detect_btn = Gtk.ToggleButton(label="🔍")
+        self.detect_btn.connect("toggled", self.on_detect_toggled)
+        self.detect_btn.set_tooltip_text("Определять масштаб карты автоматически (D)")
+        self.control_box.pack_end(self.detect_btn, False, False, 0)
+
+        self.minimal_btn = Gtk.ToggleButton(label="▭")
+        self.minimal_btn.connect("toggled", self.on_minimal_toggled)
+        self.minimal_btn.set_tooltip_text("Минимальный режим: окно не перекрывает игру (M)")
+        self.control_box.pack_end(self.minimal_btn, False, False, 0)
+        self.control_box.connect("size-allocate", lambda *args: self.update_shape(force=True))
+
+        self.track_btn = Gtk.ToggleButton(label="🎯")
+        self.track_btn.connect("toggled", self.on_track_toggled)
+        self.track_btn.set_tooltip_text("Точка А следует за своим маркером на карте (K)")
+        self.control_box.pack_end(self.track_btn, False, False, 0)
+
+        self.snap_btn = Gtk.ToggleButton(label="⌖")
+        self.snap_btn.connect("toggled", self.on_snap_toggled)
+        self.snap_btn.set_tooltip_text("Притягивать точки к маркерам на карте (S)")
+        self.control_box.pack_end(self.snap_btn, False, False, 0)
+
+        self.rings_btn = Gtk.ToggleButton(label="◎")
+        self.rings_btn.connect("toggled", self.on_rings_toggled)
+        self.rings_btn.set_tooltip_text("Кольца дальности вокруг точки А (G)")
+        self.control_box.pack_end(self.rings_btn, False, False, 0)
+
         self.top_btn = Gtk.ToggleButton(label="🔝")
         self.top_btn.set_active(True)
         self.top_btn.connect("toggled", self.on_top_toggled)
         self.top_btn.set_tooltip_text("Всегда поверх других окон")
         self.control_box.pack_end(self.top_btn, False, False, 0)
 
+        self.add_css(PANEL_CSS)
+
+    def add_css(self, css):
         css_provider = Gtk.CssProvider()
-        css = b"""
-        * {
-            font-family: 'Sans';
-            font-size: 10pt;
-        }
-        .close-btn {
-            font-weight: bold;
-            font-size: 14px;
-            min-width: 20px;
-            min-height: 20px;
-            border-radius: 10px;
-            background-color: #FF6B6B;
-            color: white;
-            border: none;
-        }
-        .reset-btn {
-            font-weight: bold;
-            font-size: 14px;
-            min-width: 20px;
-            min-height: 20px;
-            border-radius: 10px;
-            background-color: #3498DB;
-            color: white;
-            border: none;
-        }
-        .youtube-btn {
-            font-weight: bold;
-            font-size: 14px;
-            min-width: 20px;
-            min-height: 20px;
-            border-radius: 10px;
-            background-color: #FF0000;
-            color: white;
-            border: none;
-        }
-        .help-btn {
-            font-weight: bold;
-            font-size: 14px;
-            min-width: 20px;
-            min-height: 20px;
-            border-radius: 10px;
-            background-color: #9B59B6;
-            color: white;
-            border: none;
-        }
-        .distance-value {
-            font-weight: bold;
-            color: #27AE60;
-            min-width: 80px;
-        }
-        .scale-value {
-            font-weight: bold;
-            color: #3498DB;
-            min-width: 150px;
-        }
-        .calibration-active {
-            background-color: #FF9800;
-            color: white;
-        }
-        """
         css_provider.load_from_data(css)
         style_context = self.control_box.get_style_context()
         style_context.add_provider(
@@ -344,36 +1305,312 @@ class MapRuler(Gtk.Window):
             Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION
         )
 
+    def connect_recording(self):
+        """Пишет в журнал сессии нажатия кнопок панели, переключатели и выбор в списках"""
+        for index, name in enumerate(RECORDED_WIDGETS):
+            widget = getattr(self, name)
+            if isinstance(widget, Gtk.ComboBox):
+                widget.connect("changed", self.record_widget, index)
+            elif isinstance(widget, Gtk.ToggleButton):
+                widget.connect("toggled", self.record_widget, index)
+            else:
+                widget.connect("clicked", self.record_widget, index)
+
+    def record_widget(self, widget, index):
+        if self.recorder is None:
+            return
+        # Пишется новое значение, а не факт переключения: повтор того же значения ничего не меняет
+        if isinstance(widget, Gtk.ComboBox):
+            value = widget.get_active() + 1  # -1 (ничего не выбрано) -> 0
+        elif isinstance(widget, Gtk.ToggleButton):
+            value = int(widget.get_active())
+        else:
+            value = 0
+        self.recorder.widget(index, value)
+
+    def replay_widget(self, index, value):
+        widget = getattr(self, RECORDED_WIDGETS[index])
+        if isinstance(widget, Gtk.ComboBox):
+            widget.set_active(value - 1)
+        elif isinstance(widget, Gtk.ToggleButton):
+            widget.set_active(bool(value))
+        else:
+            widget.clicked()
+
     def toggle_mode(self, button):
         """Переключает режим калибровка/измерение"""
         self.calibration_mode = not self.calibration_mode
         self.mode_btn.set_label("Линейка" if self.calibration_mode else "Калибровать")
         self.apply_btn.set_visible(self.calibration_mode)
+        self.auto_btn.set_visible(self.calibration_mode)
 
         if not self.calibration_mode:
-            # При выходе из калибровки сбрасываем точки
+            # При выходе из калибровки сбрасываем точки и курсор
+            self.set_hover_cursor(None)
             self.reset_points()
 
-        self.queue_draw()
+        self.publish_state()
+        self.refresh(full=True)
+
+    def on_rings_toggled(self, button):
+        self.rings_enabled = button.get_active()
+        self.refresh()
+        self.save_config()
+
+    def on_snap_toggled(self, button):
+        """Включает и выключает притягивание точек к маркерам карты"""
+        if button.get_active() and self.snapper is None:
+            try:
+                import wt_vision
+            except ImportError:
+                button.set_active(False)
+                self.show_error("Притягивание к маркерам недоступно",
+                                "Для поиска маркеров нужен NumPy: pip3 install numpy")
+                return
+            self.snapper = wt_vision.MarkerSnapper(
+                lambda rect: self.capture_window_area(rect, 'snap'), self.snap_hues,
+                radius=self.snap_radius, max_age=1 / self.capture_max_fps)
+        self.snap_enabled = button.get_active()
+        self.set_snap_target(None)
+        self.save_config()
+
+    def snap_position(self, x, y):
+        """Точка (x, y), притянутая к ближайшему маркеру карты, если притягивание включено.
+        Найденный маркер обводится на экране."""
+        target = None
+        if self.snap_enabled and not self.calibration_mode:
+            started = time.perf_counter()
+            target = self.snapper.snap(x, y)
+            self.snap_ms.add((time.perf_counter() - started) * 1000)
+        self.set_snap_target(target)
+        return target or (x, y)
+
+    def set_snap_target(self, target):
+        rect = None
+        if target is not None:
+            r = SNAP_MARKER_RADIUS + DAMAGE_PAD
+            rect = (int(target[0]) - r, int(target[1]) - r, 2 * r + 1, 2 * r + 1)
+        self.damage.update('snap', rect, target)
+        self.damage.flush()
+        self.update_shape()
+
+    def on_track_toggled(self, button):
+        """Включает и выключает слежение точки А за своим маркером"""
+        if self.track_id is not None:
+            GLib.source_remove(self.track_id)
+            self.track_id = None
+        self.tracker = None
+        if button.get_active():
+            try:
+                import wt_vision  # noqa: F401 - нужен NumPy
+            except ImportError:
+                button.set_active(False)
+                self.show_error("Слежение за маркером недоступно",
+                                "Для слежения нужен NumPy: pip3 install numpy")
+                return
+            self.track_id = GLib.timeout_add(TRACK_INTERVAL_MS, self.track_marker)
+        else:
+            button.set_tooltip_text("Точка А следует за своим маркером на карте (K)")
+
+    def capture_tracker_window(self):
+        """Снимок области поиска маркера: (массив, левый верхний угол) или (None, None)"""
+        rect = self.clip_to_window(self.tracker.window())
+        if rect is None:
+            return None, None
+        image = self.capture_window_area(rect, 'track')
+        return (image, rect[:2]) if image is not None else (None, None)
+
+    def track_marker(self):
+        """Шаг слежения: переносит точку А за маркером под ней и обновляет расстояние"""
+        point = self.start_point
+        if point is None or self.calibration_mode or self.path_mode or self.point_drag == 'A':
+            # Пока точки нет или её тянут мышью, шаблон потом строится на новом месте
+            self.tracker = None
+            return True
+
+        import wt_vision
+        started = time.perf_counter()
+        if self.tracker is None:
+            self.tracker = wt_vision.TemplateTracker(TRACK_HALF, TRACK_SEARCH)
+            self.tracker.x, self.tracker.y = point.x, point.y
+            image, origin = self.capture_tracker_window()
+            if image is None or not self.tracker.start(image, origin, point.x, point.y):
+                self.tracker = None
+                self.track_btn.set_tooltip_text(
+                    "Точка А следует за своим маркером на карте (K)\n"
+                    "Под точкой А нет цветного маркера")
+                return True
+            position = (self.tracker.x, self.tracker.y)
+        else:
+            image, origin = self.capture_tracker_window()
+            position = self.tracker.update(image, origin) if image is not None else None
+
+        if position is not None and position != (point.x, point.y):
+            point.x, point.y = position
+            self.index_ruler_points()
+            self.update_distance_display()
+            self.refresh()
+        self.track_ms.add((time.perf_counter() - started) * 1000)
+
+        self.track_steps += 1
+        if self.track_steps % TRACK_STATUS_EVERY == 0:
+            stats = self.track_ms.summary()
+            state = (f"уверенность {self.tracker.confidence:.2f}" if position is not None
+                     else f"маркер потерян (уверенность {self.tracker.confidence:.2f})")
+            self.track_btn.set_tooltip_text(
+                f"Точка А следует за своим маркером на карте (K)\n"
+                f"{state}, шаг p50 {stats['p50']:.2f} мс, p95 {stats['p95']:.2f} мс")
+        return True
+
+    def next_ring_spacing(self):
+        """Переключает шаг колец дальности на следующий из RING_SPACINGS"""
+        larger = [s for s in RING_SPACINGS if s > self.ring_spacing]
+        self.ring_spacing = larger[0] if larger else RING_SPACINGS[0]
+        self.rings_btn.set_tooltip_text(f"Кольца дальности вокруг точки А (G), шаг {self.ring_spacing} м")
+        self.refresh()
+        self.save_config()
+
+    def on_minimal_toggled(self, button):
+        """Включает и выключает минимальный режим"""
+        self.minimal_mode = button.get_active()
+        if not self.minimal_mode:
+            self.shape_combine_region(None)
+            self.input_shape_combine_region(None)
+        self.refresh(full=True)
+        self.update_shape(force=True)
+
+    def update_shape(self, force=False):
+        """Обновляет видимую и принимающую клики области окна в минимальном режиме.
+
+        Видимая область - панель и области элементов из DamageTracker. Клики
+        принимают панель, маркеры точек (input_shape, обновляется вместе с
+        индексом точек) и, при калибровке, сетка. Обе области поддерживаются
+        при каждом изменении элемента и передаются в GTK, только если изменились.
+        """
+        if not self.minimal_mode or not self.get_realized():
+            return
+        bar = self.control_box.get_allocation()
+        bar_rect = (bar.x, bar.y, bar.width, bar.height)
+        self.damage.shape.set('bar', bar_rect)
+        self.input_shape.set('bar', bar_rect)
+        self.input_shape.set('grid', self.grid_rect() if self.calibration_mode else None)
+
+        for shape, combine in ((self.damage.shape, self.shape_combine_region),
+                               (self.input_shape, self.input_shape_combine_region)):
+            if force or shape.changed:
+                shape.changed = False
+                combine(shape.region)
+
+    def index_marker(self, key, x, y, radius):
+        """Точка или вершина маршрута в индексе поиска и в области, принимающей клики"""
+        self.hit_index.update(key, x, y, radius)
+        r = int(math.ceil(radius))
+        self.input_shape.set(key, (int(x) - r, int(y) - r, 2 * r, 2 * r))
+
+    def unindex_marker(self, key):
+        self.hit_index.remove(key)
+        self.input_shape.set(key, None)
+
+    def toggle_hud(self):
+        self.hud_enabled = not self.hud_enabled
+        if self.hud_enabled and self.hud_timer is None:
+            self.hud_timer = GLib.timeout_add(HUD_INTERVAL_MS, self.on_hud_timer)
+        self.update_hud()
+
+    def on_hud_timer(self):
+        self.update_hud()
+        if not self.hud_enabled:
+            self.hud_timer = None
+        return self.hud_enabled
+
+    def update_hud(self):
+        """Обновляет область и текст HUD"""
+        frame_clock = self.get_frame_clock()
+        if frame_clock is not None:
+            self.metrics.collect(frame_clock)
+        rect = text = None
+        if self.hud_enabled:
+            bar = self.control_box.get_allocation()
+            rect = (8, bar.y + bar.height + 6) + HUD_SIZE
+            text = self.metrics.hud_text()
+        self.damage.update('hud', rect, text)
+        self.damage.flush()
+        self.update_shape()
+
+    def render_hud(self, cr, rect, text):
+        from gi.repository import Pango, PangoCairo
+        if self.hud_layout is None:
+            self.hud_layout = PangoCairo.create_layout(cr)
+            self.hud_layout.set_font_description(Pango.FontDescription.from_string("Monospace 9"))
+        if text != self.hud_text:
+            self.hud_layout.set_text(text, -1)
+            self.hud_text = text
+        x, y, w, h = rect
+        cr.set_source_rgba(0, 0, 0, 0.6)
+        cr.rectangle(x, y, w, h)
+        cr.fill()
+        cr.set_source_rgba(0.6, 1, 0.6, 1)
+        cr.move_to(x + 6, y + 4)
+        PangoCairo.show_layout(cr, self.hud_layout)
+
+    def start_metrics_export(self, path):
+        """Периодически выгружает метрики в JSON-файл path, каждый раз целиком"""
+        import platform
+        self.metrics_path = path
+        self.metrics_info = {'host': platform.node(), 'platform': platform.platform()}
+        GLib.timeout_add(METRICS_EXPORT_INTERVAL_MS, self.export_metrics)
+
+    def export_metrics(self):
+        import json
+        frame_clock = self.get_frame_clock()
+        if frame_clock is not None:
+            self.metrics.collect(frame_clock)
+        data = dict(self.metrics_info)
+        data.update(self.metrics.to_dict())
+        data['snap_ms'] = self.snap_ms.summary()
+        data['track_ms'] = self.track_ms.summary()
+        if self.tracker is not None:
+            data['track_confidence'] = self.tracker.confidence
+        # Небольшой файл раз в несколько секунд: пишем сразу, без ожидания сброса на диск
+        try:
+            wt_core.atomic_write(self.metrics_path, json.dumps(data, ensure_ascii=False, indent=2),
+                                 backup_config=False, sync=False)
+        except OSError as e:
+            print(f"Не удалось выгрузить метрики в {self.metrics_path}: {e}", file=sys.stderr)
+        return True
+
+    def pointer_position(self):
+        """Положение мыши в координатах окна, даже если она над другим окном"""
+        pointer = self.get_display().get_default_seat().get_pointer()
+        _, x, y, _ = self.get_window().get_device_position(pointer)
+        return x, y
+
+    def on_path_toggled(self, button):
+        """Переключает линейку и режим маршрута"""
+        self.path_mode = button.get_active()
+        self.path_drag = None
+        self.temp_point = None
+        self.set_hover_cursor(None)
+        self.update_distance_display()
+        self.refresh()
 
     def apply_calibration(self, button):
         if self.grid_size > 0:
-            # Рассчитываем калиброванный масштаб
-            scale_value = self.selected_scale
             # Размер одного квадрата в пикселях
-            square_size_px = self.grid_size / 7.0
+            square_size_px = self.grid_size / wt_core.GRID_CELLS
             # Масштаб: метры на пиксель
-            self.calibrated_scale = scale_value / square_size_px
+            self.calibrated_scale = wt_core.calibrate(self.grid_size, self.selected_scale)
             self.calibration_base_scale = self.selected_scale
             self.use_calibrated_scale = True
             self.scale_factor = self.calibrated_scale
+            self.profile_pending = False
 
             # Сохраняем настройки
             self.save_config()
 
             # Обновляем интерфейс
             self.recalculate_scale()
-            self.queue_draw()
+            self.refresh()
 
             # Показываем результат
             dialog = Gtk.MessageDialog(
@@ -389,25 +1626,216 @@ class MapRuler(Gtk.Window):
                 f"Размер квадрата: {square_size_px:.1f} пикс\n"
                 f"Настройки сохранены и будут использоваться при следующих запусках."
             )
-            dialog.run()
+            # Модальное окно остановило бы воспроизведение журнала
+            if self.player is None:
+                dialog.run()
             dialog.destroy()
 
             # Выходим из режима калибровки
             self.calibration_mode = False
+            self.set_hover_cursor(None)
             self.mode_btn.set_label("Калибровать")
             self.apply_btn.set_visible(False)
+            self.auto_btn.set_visible(False)
         else:
             # Если сетка не установлена
-            dialog = Gtk.MessageDialog(
-                parent=self,
-                flags=0,
-                message_type=Gtk.MessageType.ERROR,
-                buttons=Gtk.ButtonsType.OK,
-                text="Ошибка калибровки"
-            )
-            dialog.format_secondary_text("Пожалуйста, разместите сетку на карте.")
+            self.show_error("Ошибка калибровки", "Пожалуйста, разместите сетку на карте.")
+
+    def show_error(self, text, secondary_text):
+        dialog = Gtk.MessageDialog(
+            parent=self,
+            flags=0,
+            message_type=Gtk.MessageType.ERROR,
+            buttons=Gtk.ButtonsType.OK,
+            text=text
+        )
+        dialog.format_secondary_text(secondary_text)
+        if self.player is None:
             dialog.run()
-            dialog.destroy()
+        else:
+            print(f"{text}: {secondary_text}", file=sys.stderr)
+        dialog.destroy()
+
+    def screen_capture(self):
+        """Захват экрана через X11 (MIT-SHM или XGetImage) или None, если доступен только GDK"""
+        if self.capture is None:
+            self.capture = False
+            if self.capture_method != 'gdk' and isinstance(self.get_display(), GdkX11.X11Display):
+                try:
+                    import wt_capture
+                    self.capture = wt_capture.ScreenCapture(
+                        self.capture_max_fps, use_shm=self.capture_method == 'auto')
+                except (ImportError, OSError) as error:
+                    print(f"Быстрый захват экрана недоступен: {error}", file=sys.stderr)
+        return self.capture or None
+
+    def clip_to_window(self, rect):
+        """Область rect = (x, y, w, h), обрезанная по границам окна, или None"""
+        x = max(0, int(rect[0]))
+        y = max(0, int(rect[1]))
+        width = min(self.get_allocated_width(), int(rect[0] + rect[2])) - x
+        height = min(self.get_allocated_height(), int(rect[1] + rect[3])) - y
+        if width <= 0 or height <= 0:
+            return None
+        return (x, y, width, height)
+
+    def capture_window_area(self, rect=None, key='window'):
+        """Снимок экрана под окном или его частью rect = (x, y, w, h):
+        массив (высота, ширина, каналы).
+
+        Снимки с одним ключом делят буфер: массив годен до следующего снимка
+        с тем же ключом.
+        """
+        import wt_vision
+        if rect is None:
+            rect = (0, 0, self.get_allocated_width(), self.get_allocated_height())
+        rect = self.clip_to_window(rect)
+        if rect is None:
+            return None
+        _, x, y = self.get_window().get_origin()
+        x += rect[0]
+        y += rect[1]
+        width, height = rect[2], rect[3]
+
+        # У края экрана снимок меньше запрошенного: дополняем его, чтобы пиксель (0, 0)
+        # всегда соответствовал углу rect, как ожидают вызывающие
+        capture = self.screen_capture()
+        if capture is not None:
+            try:
+                grabbed = capture.grab(key, x, y, width, height)
+            except OSError as error:
+                print(f"Захват через X11 не удался, дальше через GDK: {error}", file=sys.stderr)
+                capture.close()
+                self.capture = False
+            else:
+                if grabbed is None:
+                    return None
+                image, (left, top) = grabbed
+                return wt_vision.pad_image(image, left - x, top - y, width, height)
+        root = Gdk.get_default_root_window()
+        left, top = max(0, x), max(0, y)
+        right = min(root.get_width(), x + width)
+        bottom = min(root.get_height(), y + height)
+        if right <= left or bottom <= top:
+            return None
+        pixbuf = Gdk.pixbuf_get_from_window(root, left, top, right - left, bottom - top)
+        if pixbuf is None:
+            return None
+        image = wt_vision.array_from_pixels(pixbuf.get_pixels(), pixbuf.get_width(),
+                                            pixbuf.get_height(), pixbuf.get_rowstride(),
+                                            pixbuf.get_n_channels())
+        return wt_vision.pad_image(image, left - x, top - y, width, height)
+
+    def capture_roi(self):
+        """Снимок области интереса вокруг сетки (секция [CAPTURE], roi):
+        (массив, (x, y) его левого верхнего угла в координатах окна) или (None, None)"""
+        x, y = self.grid_pos
+        rx, ry, rw, rh = self.capture_roi_region
+        size = self.grid_size
+        rect = self.clip_to_window((x + rx * size, y + ry * size, rw * size, rh * size))
+        if rect is None:
+            return None, None
+        image = self.capture_window_area(rect, 'roi')
+        if image is None:
+            return None, None
+        return image, rect[:2]
+
+    def capture_roi_part(self, rect):
+        """Часть снимка области интереса, попадающая в rect = (x, y, w, h) окна, или None"""
+        image, (ox, oy) = self.capture_roi()
+        if image is None:
+            return None
+        x0 = max(int(rect[0]), ox)
+        y0 = max(int(rect[1]), oy)
+        x1 = min(int(rect[0] + rect[2]), ox + image.shape[1])
+        y1 = min(int(rect[1] + rect[3]), oy + image.shape[0])
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return image[y0 - oy:y1 - oy, x0 - ox:x1 - ox]
+
+    def auto_calibrate(self, button):
+        """Находит сетку карты под окном по снимку экрана и применяет калибровку"""
+        try:
+            import wt_vision  # noqa: F401 - нужен NumPy
+        except ImportError:
+            self.show_error("Автокалибровка недоступна",
+                            "Для автокалибровки нужен NumPy: pip3 install numpy")
+            return
+        # Прячем оверлей, чтобы он не попал на снимок
+        self.set_opacity(0)
+        GLib.timeout_add(100, self.finish_auto_calibration)
+
+    def finish_auto_calibration(self):
+        import wt_vision
+        # Сначала ищем сетку в области интереса вокруг текущей сетки, затем во всём окне
+        estimate = None
+        for capture in (self.capture_roi, lambda: (self.capture_window_area(), (0, 0))):
+            image, origin = capture()
+            estimate = wt_vision.detect_grid(image) if image is not None else None
+            if estimate is not None:
+                estimate = estimate._replace(offset_x=estimate.offset_x + origin[0],
+                                             offset_y=estimate.offset_y + origin[1])
+                break
+        self.set_opacity(0.85)
+
+        if estimate is None:
+            self.show_error("Сетка не найдена",
+                            "Убедитесь, что карта с сеткой видна под окном, и повторите попытку.")
+            return False
+
+        self.grid_size = estimate.step * wt_vision.GRID_CELLS
+        self.grid_pos = wt_vision.snap_grid(estimate, self.grid_pos)
+        self.apply_calibration(None)
+        return False
+
+    def on_detect_toggled(self, button):
+        """Включает и выключает периодическое определение масштаба карты"""
+        if self.scale_detect_id is not None:
+            GLib.source_remove(self.scale_detect_id)
+            self.scale_detect_id = None
+        if button.get_active():
+            if self.scale_detector is None:
+                try:
+                    import wt_vision
+                except ImportError:
+                    button.set_active(False)
+                    self.show_error("Автоопределение масштаба недоступно",
+                                    "Для распознавания масштаба нужен NumPy: pip3 install numpy")
+                    return
+                samples = load_glyph_samples() or render_glyph_samples()
+                self.scale_detector = wt_vision.ScaleDetector(wt_vision.GlyphBank(samples), MAP_SCALES)
+            self.scale_detect_id = GLib.timeout_add(self.scale_detect_interval, self.detect_scale)
+            self.detect_scale()
+        self.scale_detect_enabled = button.get_active()
+        self.save_config()
+
+    def scale_detect_rect(self):
+        """Область с надписью масштаба в координатах окна"""
+        x, y = self.grid_pos
+        rx, ry, rw, rh = self.scale_detect_region
+        size = self.grid_size
+        return (x + rx * size, y + ry * size, rw * size, rh * size)
+
+    def detect_scale(self):
+        """Читает масштаб карты с экрана и выбирает его в списке, если он изменился"""
+        started = time.perf_counter()
+        # Надпись масштаба вырезается из снимка области интереса, общего с автокалибровкой
+        image = self.capture_roi_part(self.scale_detect_rect())
+        scale = self.scale_detector.detect(image) if image is not None else None
+        elapsed = (time.perf_counter() - started) * 1000
+
+        if scale is None:
+            self.detect_btn.set_tooltip_text(
+                f"Определять масштаб карты автоматически (D)\n"
+                f"Надпись масштаба не распознана ({elapsed:.1f} мс)")
+        else:
+            self.detect_btn.set_tooltip_text(
+                f"Определять масштаб карты автоматически (D)\n"
+                f"Масштаб {scale} м ({elapsed:.1f} мс)")
+            if scale != self.selected_scale:
+                # on_scale_changed пересчитает коэффициент и сохранит выбор
+                self.scale_combo.set_active(MAP_SCALES.index(scale))
+        return True
 
     def on_top_toggled(self, button):
         self.set_keep_above(button.get_active())
@@ -420,20 +1848,13 @@ class MapRuler(Gtk.Window):
             try:
                 self.selected_scale = int(scale_str)
 
-                # Если есть калиброванное значение и базовый масштаб
+                # Если есть калиброванное значение и базовый масштаб - пересчитываем
                 if self.use_calibrated_scale and self.calibration_base_scale:
-                    # Рассчитываем коэффициент пересчета
-                    scale_ratio = self.selected_scale / self.calibration_base_scale
-
-                    # Применяем новый масштабный коэффициент
-                    self.scale_factor = self.calibrated_scale * scale_ratio
-
-                    # Обновляем отображение
-                    base_text = f" (база: {self.calibration_base_scale} м)" if self.calibration_base_scale else ""
-                    self.scale_value.set_text(f"{self.scale_factor:.6f} м/пикс{base_text}")
+                    self.scale_factor = self.calibration().scale_factor(self.selected_scale)
 
                 self.recalculate_scale()
-                self.queue_draw()
+                self.refresh()
+                self.save_config()
             except ValueError:
                 pass
 
@@ -515,16 +1936,157 @@ class MapRuler(Gtk.Window):
         cr.move_to(x - 120, y + size/2 + 10)
         cr.show_text(f"{size:.1f} пикс")
 
-    def on_draw(self, widget, cr):
-        width = widget.get_allocated_width()
-        height = widget.get_allocated_height()
+    def grid_rect(self):
+        """Область сетки вместе с уголками и подписью размера слева"""
+        x, y = self.grid_pos
+        size = self.grid_size
+        return rect_from_points(x - 120, y, x + size, y + size)
+
+    def line_target(self):
+        """Вторая точка линии: точка Б или текущее положение мыши"""
+        if self.end_point:
+            return (self.end_point.x, self.end_point.y)
+        if self.temp_point:
+            return self.temp_point
+        return None
 
-        # Рисуем фон
-        cr.set_source_rgba(0.2, 0.2, 0.2, 0.6)
-        cr.rectangle(0, 0, width, height)
-        cr.fill()
+    def label_layout(self, target):
+        """Текст подписи расстояния и позиция его базовой линии"""
+        meters = wt_core.distance_m(self.start_point.x, self.start_point.y,
+                                    target[0], target[1], self.scale_factor)
+        text_x = (self.start_point.x + target[0]) / 2
+        text_y = (self.start_point.y + target[1]) / 2 - 40
+        return f"{meters:.1f} м{self.elevation_suffix(meters)}", text_x, text_y
+
+    def refresh(self, full=False):
+        """Пересчитывает области линии, подписи и сетки и запрашивает их перерисовку"""
+        line = label = grid = None
+        label_text = None
+        if self.calibration_mode:
+            grid = self.grid_rect()
+        elif self.start_point and not self.path_mode:
+            target = self.line_target()
+            if target:
+                line = rect_from_points(self.start_point.x, self.start_point.y, *target)
+                label_text, text_x, text_y = self.label_layout(target)
+                label = self.label_renderer.extents(label_text, round(text_x), round(text_y))
+
+        self.damage.update('grid', grid)
+        self.damage.update('line', line, self.end_point is None)
+        self.damage.update('label', label, label_text)
+        self.damage.update('rings', *self.rings_layout())
+        self.refresh_path(full=full)
+
+    def rings_key(self):
+        """Ключ кэша колец: масштаб, шаг, стиль, радиус поверхности и радиус
+        самого дальнего кольца в пикселях"""
+        extent = self.ring_max_range / self.scale_factor if self.scale_factor > 0 else 0
+        # Поверхность не больше окна; радиус округлён, чтобы изменение размера окна
+        # не сбрасывало кэш
+        diagonal = math.hypot(self.get_allocated_width(), self.get_allocated_height())
+        radius = int(math.ceil(min(extent, diagonal) / 256)) * 256
+        return (self.scale_factor, self.ring_spacing, self.ring_style, radius, min(extent, radius))
+
+    def rings_layout(self):
+        """Область колец дальности вокруг точки А в пределах окна и что в ней рисуется:
+        ключ поверхности и её левый верхний угол"""
+        if not self.rings_enabled or self.calibration_mode or self.path_mode or not self.start_point:
+            return None, None
+        key = self.rings_key()
+        radius, extent = key[3:]
+        if radius <= 0:
+            return None, None
+        cx = math.floor(self.start_point.x)
+        cy = math.floor(self.start_point.y)
+        # Перерисовывается только то, что занято кольцами и видно в окне, а не вся поверхность
+        reach = int(math.ceil(extent)) + RING_LABEL_MARGIN
+        rect = clip_rect((cx - reach, cy - reach, 2 * reach, 2 * reach),
+                         self.get_allocated_width(), self.get_allocated_height())
+        if rect is None:
+            return None, None
+        return rect, (key, cx - radius, cy - radius)
+
+    def build_rings(self, cr, key):
+        """Рисует кольца в маску прозрачности: цвет задаётся при выводе"""
+        scale_factor, spacing, style, radius, extent = key
+        line_width, dash = RING_STYLES[style]
+        surface = cr.get_target().create_similar(cairo.CONTENT_ALPHA, 2 * radius, 2 * radius)
+        ring_cr = cairo.Context(surface)
+        ring_cr.set_source_rgba(0, 0, 0, 1)
+        ring_cr.set_line_width(line_width)
+        if dash:
+            ring_cr.set_dash(dash, 0)
+        ring_cr.set_font_size(12)
+
+        step = spacing / scale_factor
+        if step < 8:
+            # Кольца слились бы в сплошную заливку
+            return surface
+        meters = spacing
+        r = step
+        while r <= extent:
+            ring_cr.arc(radius, radius, r, 0, 2 * math.pi)
+            ring_cr.stroke()
+            ring_cr.move_to(radius + 3, radius - r - 3)
+            ring_cr.show_text(f"{meters} м")
+            meters += spacing
+            r += step
+        surface.flush()
+        return surface
+
+    def leg_label(self, index):
+        """Текст подписи участка маршрута и позиция её базовой линии"""
+        x1, y1, x2, y2 = self.path.segment(index)
+        meters = self.path.lengths[index] * self.scale_factor
+        return f"{meters:.0f} м", (x1 + x2) / 2 + 6, (y1 + y2) / 2 - 6
+
+    def leg_rect(self, index, text, text_x, text_y):
+        """Область участка маршрута вместе с маркерами точек и подписью"""
+        x1, y1, x2, y2 = self.path.segment(index)
+        lx, ly, lw, lh = self.leg_renderer.extents(text, round(text_x), round(text_y), 0)
+        return rect_from_points(min(x1, x2, lx), min(y1, y2, ly),
+                                max(x1, x2, lx + lw), max(y1, y2, ly + lh), PATH_PAD)
+
+    def refresh_path(self, legs=None, full=False):
+        """Обновляет области участков маршрута и запрашивает перерисовку.
+
+        legs - номера изменившихся участков; None - все участки, например после
+        смены масштаба. Перемещение одной точки затрагивает только два участка.
+        """
+        path = self.path
+        visible = self.path_mode and not self.calibration_mode
+        count = max(0, len(path) - 1) if visible else 0
+        if legs is None:
+            legs = range(max(count, self.path_legs_shown))
+        for index in legs:
+            if 0 <= index < count:
+                text, text_x, text_y = self.leg_label(index)
+                self.damage.update(('leg', index), self.leg_rect(index, text, text_x, text_y), text)
+            elif index >= 0:
+                self.damage.update(('leg', index), None)
+        self.path_legs_shown = count
+
+        # Первая точка видна и без участков, временный участок ведёт к мыши
+        start = temp = None
+        if visible and len(path):
+            x, y = path.point(0)
+            start = rect_from_points(x, y, x, y, PATH_PAD)
+            if self.temp_point and self.path_drag is None:
+                x, y = path.point(len(path) - 1)
+                temp = rect_from_points(x, y, *self.temp_point, PATH_PAD)
+        self.damage.update('path-start', start)
+        self.damage.update('path-temp', temp)
+        self.damage.flush(full)
+        self.update_shape()
+
+    def draw_static_layer(self, cr, width, height):
+        """Рисует фон и, в режиме калибровки, сетку с подсказкой"""
+        if not self.minimal_mode:
+            # В минимальном режиме фона нет: композитор смешивает только линии и маркеры
+            cr.set_source_rgba(0.2, 0.2, 0.2, 0.6)
+            cr.rectangle(0, 0, width, height)
+            cr.fill()
 
-        # В режиме калибровки рисуем сетку
         if self.calibration_mode:
             x, y = self.grid_pos
             self.draw_calibration_grid(cr, x, y, self.grid_size)
@@ -534,118 +2096,310 @@ class MapRuler(Gtk.Window):
             cr.set_source_rgba(1, 1, 1, 0.8)
             cr.move_to(10, height - 30)
             cr.show_text("Перетащите сетку на игровую карту и нажмите 'Применить калибровку'")
-        else:
+
+    def get_static_layer(self, cr, width, height):
+        """Возвращает поверхность статичного слоя, перестраивая её только при изменениях"""
+        key = (width, height, self.get_scale_factor(), self.minimal_mode, self.calibration_mode,
+               self.grid_pos if self.calibration_mode else None,
+               self.grid_size if self.calibration_mode else None)
+        if key == self.static_layer_key:
+            return self.static_layer
+
+        if self.static_layer_key is None or self.static_layer_key[:3] != key[:3]:
+            # Размер или масштаб изменились - создаём новую поверхность, совместимую с окном
+            self.static_layer = cr.get_target().create_similar(
+                cairo.CONTENT_COLOR_ALPHA, width, height)
+        layer_cr = cairo.Context(self.static_layer)
+        layer_cr.set_operator(cairo.OPERATOR_CLEAR)
+        layer_cr.paint()
+        layer_cr.set_operator(cairo.OPERATOR_OVER)
+        self.draw_static_layer(layer_cr, width, height)
+        self.static_layer_key = key
+        return self.static_layer
+
+    def on_draw(self, widget, cr):
+        started = time.perf_counter()
+        self.render(cr, widget.get_allocated_width(), widget.get_allocated_height())
+        self.metrics.draw_ms.add((time.perf_counter() - started) * 1000)
+        if not self.first_frame_done:
+            self.first_frame_done = True
+            startup_mark("первый кадр")
+            GLib.idle_add(self.deferred_init)
+
+    def render(self, cr, width, height):
+        """Рисует содержимое окна размером width x height в контекст cr"""
+        # Перерисовываем только область, которую GTK пометил грязной
+        clip = cr.clip_extents()
+
+        # Фон и сетка копируются из готового слоя одной операцией
+        cr.set_operator(cairo.OPERATOR_SOURCE)
+        cr.set_source_surface(self.get_static_layer(cr, width, height), 0, 0)
+        cr.paint()
+        cr.set_operator(cairo.OPERATOR_OVER)
+
+        hud = self.damage.items.get('hud')
+        if hud is not None and rects_intersect(hud[0], clip):
+            self.render_hud(cr, *hud)
+
+        snap = self.damage.items.get('snap')
+        if snap is not None and rects_intersect(snap[0], clip):
+            cr.set_source_rgba(1, 1, 1, 1)
+            cr.set_line_width(2)
+            cr.arc(*snap[1], SNAP_MARKER_RADIUS, 0, 2 * math.pi)
+            cr.stroke()
+
+        if not self.calibration_mode and self.path_mode:
+            self.render_path(cr, clip)
+        elif not self.calibration_mode:
+            # Кольца дальности: готовая маска выводится одной операцией
+            item = self.damage.items.get('rings')
+            if item is not None and rects_intersect(item[0], clip):
+                _, (key, x, y) = item
+                surface = self.ring_cache.get(key, lambda: self.build_rings(cr, key))
+                cr.set_source_rgba(1, 1, 1, 0.7)
+                cr.mask_surface(surface, x, y)
+
             # Рисуем линии и точки для линейки
             if self.start_point:
                 # Линия к текущему положению мыши или конечной точке
-                if self.end_point:
-                    target_point = self.end_point
-                elif self.temp_point:
-                    target_point = self.temp_point
-                else:
+                target_point = self.line_target()
+                if not target_point:
                     return
 
                 # Линия между точками
-                cr.set_source_rgba(1, 1, 1, 1)
-                cr.set_line_width(2)
-                cr.move_to(self.start_point.x, self.start_point.y)
-                cr.line_to(target_point.x, target_point.y)
-
-                # Для временной линии рисуем пунктир
-                if not self.end_point:
-                    cr.set_dash([5, 3], 0)
-                    cr.stroke()
-                    cr.set_dash([], 0)
-                else:
-                    cr.stroke()
-
-                # Выводим расстояние на линию
-                if self.start_point and target_point:
-                    dx = target_point.x - self.start_point.x
-                    dy = target_point.y - self.start_point.y
-                    pixels = math.sqrt(dx**2 + dy**2)
-                    meters = pixels * self.scale_factor
-
-                    cr.set_font_size(24)
+                if rects_intersect(rect_from_points(self.start_point.x, self.start_point.y,
+                                                    *target_point), clip):
                     cr.set_source_rgba(1, 1, 1, 1)
-                    text_x = (self.start_point.x + target_point.x) / 2
-                    text_y = (self.start_point.y + target_point.y) / 2 - 40
-                    cr.move_to(text_x, text_y)
-                    cr.show_text(f"{meters:.1f} м")
-
-    def get_corner_at(self, x, y):
-        """Определяет, в каком углу сетки находится точка"""
-        grid_x, grid_y = self.grid_pos
-        size = self.grid_size
-        threshold = 15  # Радиус чувствительности
-
-        corners = [
-            ('tl', grid_x, grid_y),  # top-left
-            ('tr', grid_x + size, grid_y),  # top-right
-            ('bl', grid_x, grid_y + size),  # bottom-left
-            ('br', grid_x + size, grid_y + size)  # bottom-right
-        ]
+                    cr.set_line_width(2)
+                    cr.move_to(self.start_point.x, self.start_point.y)
+                    cr.line_to(*target_point)
+
+                    # Для временной линии рисуем пунктир
+                    if not self.end_point:
+                        cr.set_dash([5, 3], 0)
+                        cr.stroke()
+                        cr.set_dash([], 0)
+                    else:
+                        cr.stroke()
 
-        for corner, cx, cy in corners:
-            if math.hypot(x - cx, y - cy) <= threshold:
-                return corner
-        return None
+                # Выводим расстояние на линию: готовая маска из кэша подписей
+                text, text_x, text_y = self.label_layout(target_point)
+                cr.set_source_rgba(1, 1, 1, 1)
+                self.label_renderer.draw(cr, text, text_x, text_y)
+
+    def render_path(self, cr, clip):
+        """Рисует участки маршрута, попадающие в грязную область"""
+        path = self.path
+        if not len(path):
+            return
+        cr.set_source_rgba(1, 1, 1, 1)
+        cr.set_line_width(2)
+        items = self.damage.items
+        for index in range(len(path) - 1):
+            item = items.get(('leg', index))
+            if item is None or not rects_intersect(item[0], clip):
+                continue
+            x1, y1, x2, y2 = path.segment(index)
+            cr.move_to(x1, y1)
+            cr.line_to(x2, y2)
+            cr.stroke()
+            cr.arc(x2, y2, PATH_MARKER_RADIUS, 0, 2 * math.pi)
+            cr.fill()
+            text, text_x, text_y = self.leg_label(index)
+            self.leg_renderer.draw(cr, text, text_x, text_y)
+
+        x, y = path.point(0)
+        cr.arc(x, y, PATH_MARKER_RADIUS, 0, 2 * math.pi)
+        cr.fill()
 
-    def is_inside_grid(self, x, y):
-        """Проверяет, находится ли точка внутри сетки"""
-        grid_x, grid_y = self.grid_pos
-        size = self.grid_size
-        return (grid_x <= x <= grid_x + size and
-                grid_y <= y <= grid_y + size)
+        # Пунктир от последней точки к мыши
+        if self.temp_point and self.path_drag is None:
+            cr.move_to(*path.point(len(path) - 1))
+            cr.line_to(*self.temp_point)
+            cr.set_dash([5, 3], 0)
+            cr.stroke()
+            cr.set_dash([], 0)
+
+    def get_hit_map(self):
+        """Зоны сетки для текущего положения; перестраиваются только при её движении"""
+        if self.hit_map is None or self.hit_map.key != (self.grid_pos, self.grid_size):
+            self.hit_map = GridHitMap(self.grid_pos, self.grid_size, self.hit_index)
+        return self.hit_map
+
+    def get_cursor(self, cursor_type):
+        """Курсор заданного типа из кэша текущего дисплея"""
+        display = self.get_display()
+        key = (display, cursor_type)
+        cursor = self.cursors.get(key)
+        if cursor is None:
+            cursor = Gdk.Cursor.new_for_display(display, cursor_type)
+            self.cursors[key] = cursor
+        return cursor
+
+    def set_hover_cursor(self, cursor_type):
+        """Меняет курсор окна, только если нужный тип отличается от текущего"""
+        if cursor_type == self.hover_cursor:
+            return
+        self.hover_cursor = cursor_type
+        window = self.get_window()
+        if window:
+            window.set_cursor(self.get_cursor(cursor_type) if cursor_type else None)
 
     def on_button_press(self, widget, event):
-        if event.button == 3:  # Правая кнопка мыши - точка А
+        if self.recorder is not None:
+            self.recorder.press(event)
+        if self.path_mode and not self.calibration_mode:
+            self.path_button_press(event)
+        elif event.button == 3:  # Правая кнопка мыши - точка А
             if not self.calibration_mode:
-                self.start_point = Gdk.EventButton()
-                self.start_point.x = event.x
-                self.start_point.y = event.y
-                self.end_point = None
-                self.queue_draw()
+                self.place_start(*self.snap_position(event.x, event.y))
         elif event.button == 1:  # Левая кнопка мыши
             if self.calibration_mode:
                 # Определяем, в каком углу сетки было нажатие
-                corner = self.get_corner_at(event.x, event.y)
-                if corner:
+                zone = self.get_hit_map().classify(event.x, event.y)
+                if zone and zone != 'move':
                     self.dragging = True
-                    self.drag_corner = corner
+                    self.drag_corner = zone
                     self.drag_start = (event.x, event.y, self.grid_pos[0], self.grid_pos[1], self.grid_size)
-                elif self.is_inside_grid(event.x, event.y):
+                elif zone == 'move':
                     # Перемещение всей сетки
                     self.dragging = True
                     self.drag_corner = 'move'
                     self.drag_start = (event.x, event.y, self.grid_pos[0], self.grid_pos[1])
             else:
+                # Точку А или Б можно перетащить
+                hit = self.hit_index.query(event.x, event.y, ('point',))
+                if hit is not None:
+                    self.dragging = True
+                    self.point_drag = hit[1]
+                    return
                 # Режим линейки - точка Б
                 if self.start_point:
-                    # Если точка Б уже есть - перемещаем ее
-                    if self.end_point:
-                        self.end_point.x = event.x
-                        self.end_point.y = event.y
-                    else:
-                        # Иначе создаем новую
-                        self.end_point = Gdk.EventButton()
-                        self.end_point.x = event.x
-                        self.end_point.y = event.y
+                    self.place_end(*self.snap_position(event.x, event.y))
+                    # Пока кнопка зажата, точку Б можно тянуть дальше
+                    self.dragging = True
+                    self.point_drag = 'B'
+
+    def place_start(self, x, y):
+        """Ставит точку А и сбрасывает точку Б"""
+        # Слежение начнётся заново с маркера под новой точкой
+        self.tracker = None
+        self.start_point = Gdk.EventButton()
+        self.start_point.x = x
+        self.start_point.y = y
+        self.end_point = None
+        self.index_ruler_points()
+        self.refresh()
+
+    def place_end(self, x, y):
+        """Ставит или переносит точку Б"""
+        # Если точка Б уже есть - перемещаем ее
+        if self.end_point:
+            self.end_point.x = x
+            self.end_point.y = y
+        else:
+            # Иначе создаем новую
+            self.end_point = Gdk.EventButton()
+            self.end_point.x = x
+            self.end_point.y = y
+        self.index_ruler_points()
+        self.update_distance_display()
+        self.refresh()
+
+    def index_ruler_points(self):
+        """Обновляет точки А и Б в пространственном индексе"""
+        for name, point in (('A', self.start_point), ('B', self.end_point)):
+            if point is None:
+                self.unindex_marker(('point', name))
+            else:
+                self.index_marker(('point', name), point.x, point.y, PATH_GRAB_RADIUS)
+
+    def index_path_vertex(self, index):
+        x, y = self.path.point(index)
+        self.index_marker(('vertex', index), x, y, PATH_GRAB_RADIUS)
+
+    def path_button_press(self, event):
+        """Клик в режиме маршрута: захват точки, новая точка или удаление последней"""
+        path = self.path
+        if event.button == 1:
+            hit = self.hit_index.query(event.x, event.y, ('vertex',))
+            if hit is not None:
+                self.dragging = True
+                self.path_drag = hit[1]
+                return
+            self.add_waypoint(*self.snap_position(event.x, event.y))
+        elif event.button == 3 and len(path):
+            path.pop()
+            self.unindex_marker(('vertex', len(path)))
+            self.update_distance_display()
+            self.refresh_path([len(path) - 1])
 
-                    self.update_distance_display()
-                    self.queue_draw()
+    def add_waypoint(self, x, y):
+        path = self.path
+        path.append(x, y)
+        self.index_path_vertex(len(path) - 1)
+        self.update_distance_display()
+        self.refresh_path([len(path) - 2])
 
     def on_button_release(self, widget, event):
+        if self.recorder is not None:
+            self.recorder.release(event)
         if event.button == 1 and self.dragging:
+            # Применяем последнее положение мыши, не дожидаясь кадра
+            if self.pending_events:
+                self.pending_events = 0
+                self.process_pointer(event.x, event.y)
             self.dragging = False
             self.drag_corner = None
             self.drag_start = None
+            self.point_drag = None
+            if self.path_drag is not None:
+                self.path_drag = None
+                self.update_distance_display()
+                self.refresh_path([])
 
     def on_mouse_move(self, widget, event):
+        if self.recorder is not None:
+            self.recorder.motion(event)
+        # Обрабатываем мышь не чаще одного раза за кадр
+        self.pointer = (event.x, event.y)
+        if not self.pending_events:
+            self.first_event_time = GLib.get_monotonic_time()
+        self.pending_events += 1
+        if self.tick_id is None:
+            self.tick_id = self.add_tick_callback(self.on_frame_tick)
+
+    def on_frame_tick(self, widget, frame_clock):
+        """Применяет накопленное за кадр положение мыши"""
+        if not self.pending_events:
+            self.tick_id = None
+            self.metrics.idle()
+            return GLib.SOURCE_REMOVE
+
+        frame_time = frame_clock.get_frame_time()
+        refresh_interval, _ = frame_clock.get_refresh_info(frame_time)
+        self.metrics.tick(frame_time, refresh_interval)
+        if self.max_fps and frame_time - self.last_frame_time < 1000000 / self.max_fps:
+            return GLib.SOURCE_CONTINUE
+
+        self.last_frame_time = frame_time
+        self.coalesced_events = self.pending_events
+        self.pending_events = 0
+        # Задержка считается от первого события, дождавшегося этого кадра
+        self.metrics.frame_input(frame_clock.get_frame_counter(), self.first_event_time,
+                                 self.coalesced_events)
+        self.process_pointer(*self.pointer)
+        self.metrics.collect(frame_clock)
+        return GLib.SOURCE_CONTINUE
+
+    def process_pointer(self, x, y):
+        """Перетаскивание сетки, курсор калибровки и временная линия для точки (x, y)"""
+        # Точки ставятся в притянутое положение, зоны под курсором - по самому курсору
+        sx, sy = self.snap_position(x, y)
         if self.calibration_mode and self.dragging and self.drag_corner and self.drag_start:
             # Уменьшаем чувствительность в 2 раза
-            dx = (event.x - self.drag_start[0]) * 0.5
-            dy = (event.y - self.drag_start[1]) * 0.5
+            dx = (x - self.drag_start[0]) * 0.5
+            dy = (y - self.drag_start[1]) * 0.5
 
             if self.drag_corner == 'move':
                 # Перемещение всей сетки
@@ -676,47 +2430,140 @@ class MapRuler(Gtk.Window):
                 # Ограничиваем минимальный размер
                 self.grid_size = max(50, new_size)
 
-            self.queue_draw()
+            self.refresh()
+            self.save_config()
+        elif self.path_drag is not None:
+            index = self.path_drag
+            self.path.move(index, sx, sy)
+            self.index_path_vertex(index)
+            self.update_distance_display()
+            self.refresh_path([index - 1, index])
+        elif self.point_drag is not None:
+            point = self.start_point if self.point_drag == 'A' else self.end_point
+            point.x = sx
+            point.y = sy
+            self.index_ruler_points()
+            self.update_distance_display()
+            self.refresh()
+        elif self.path_mode and not self.calibration_mode:
+            # Над точкой маршрута курсор показывает, что её можно перетащить
+            hit = self.hit_index.query(x, y, ('vertex',))
+            self.set_hover_cursor(Gdk.CursorType.FLEUR if hit else None)
+            if len(self.path):
+                self.temp_point = (sx, sy)
+                self.refresh_path([])
         elif self.calibration_mode:
-            # Обновляем курсор
-            corner = self.get_corner_at(event.x, event.y)
-            if corner:
-                self.get_window().set_cursor(Gdk.Cursor.new_for_display(
-                    self.get_display(), Gdk.CursorType.SIZING))
-            elif self.is_inside_grid(event.x, event.y):
-                self.get_window().set_cursor(Gdk.Cursor.new_for_display(
-                    self.get_display(), Gdk.CursorType.FLEUR))
+            # Обновляем курсор только при смене зоны под мышью
+            zone = self.get_hit_map().classify(x, y)
+            if zone == 'move':
+                self.set_hover_cursor(Gdk.CursorType.FLEUR)
+            elif zone:
+                self.set_hover_cursor(Gdk.CursorType.SIZING)
             else:
-                self.get_window().set_cursor(None)
-        elif not self.calibration_mode and self.start_point and not self.end_point:
-            self.temp_point = Gdk.EventButton()
-            self.temp_point.x = event.x
-            self.temp_point.y = event.y
-            self.queue_draw()
+                self.set_hover_cursor(None)
+        else:
+            hit = self.hit_index.query(x, y, ('point',))
+            self.set_hover_cursor(Gdk.CursorType.FLEUR if hit else None)
+            if self.start_point and not self.end_point:
+                self.temp_point = (sx, sy)
+                self.refresh()
+
+    def current_distance(self):
+        """Текущее расстояние в метрах: длина маршрута, А-Б или None"""
+        if self.path_mode:
+            return self.path.total * self.scale_factor if len(self.path) > 1 else None
+        if self.start_point and self.end_point:
+            return wt_core.distance_m(self.start_point.x, self.start_point.y,
+                                      self.end_point.x, self.end_point.y, self.scale_factor)
+        return None
 
     def update_distance_display(self):
-        if self.start_point and self.end_point:
-            dx = self.end_point.x - self.start_point.x
-            dy = self.end_point.y - self.start_point.y
-            pixels = math.sqrt(dx**2 + dy**2)
-            meters = pixels * self.scale_factor
-            self.distance_value.set_text(f"{meters:.1f} м")
+        self.publish_state()
+        if self.path_mode:
+            total = self.path.total * self.scale_factor
+            if self.path_drag is not None:
+                # Длина маршрута до перетаскиваемой точки
+                before = self.path.distance_to(self.path_drag) * self.scale_factor
+                self.set_distance_text(f"{total:.1f} м (до точки: {before:.1f} м)")
+            else:
+                self.set_distance_text(f"{total:.1f} м")
+        elif self.start_point and self.end_point:
+            meters = wt_core.distance_m(self.start_point.x, self.start_point.y,
+                                        self.end_point.x, self.end_point.y, self.scale_factor)
+            self.set_distance_text(f"{meters:.1f} м{self.elevation_suffix(meters, panel=True)}")
+
+    def set_distance_text(self, text):
+        """Меняет текст панели, только если округлённое значение изменилось"""
+        if text != self.distance_text:
+            self.distance_text = text
+            self.distance_value.set_text(text)
 
     def on_key_press(self, widget, event):
-        keyval = event.keyval
-        if keyval == Gdk.KEY_Escape:
+        if self.recorder is not None:
+            self.recorder.key(event)
+        action = KEY_ACTIONS.get(event.keyval)
+        if action:
+            self.run_action(action)
+        return False
+
+    def on_hotkey(self, action):
+        """Глобальное сочетание; в журнал сессии пишется с положением мыши"""
+        position = None
+        if action in ('point-a', 'point-b'):
+            position = self.pointer_position()
+        if self.recorder is not None:
+            self.recorder.action(ACTIONS.index(action), *(position or (0, 0)))
+        self.run_action(action, position)
+
+    def replay_action(self, index, x, y):
+        self.run_action(ACTIONS[index], (x, y))
+
+    def run_action(self, action, position=None):
+        """Выполняет действие клавиши окна или глобального сочетания.
+
+        position - положение мыши для точек А и Б; по умолчанию берётся текущее.
+        """
+        if self.player is not None and action in REPLAY_SKIPPED_ACTIONS:
+            return
+        if action == 'quit':
             self.destroy()
-        elif keyval == Gdk.KEY_r:
+        elif action == 'reset':
             self.reset_points()
-        elif keyval == Gdk.KEY_t:
+        elif action == 'top':
             self.top_btn.set_active(not self.top_btn.get_active())
-        elif keyval == Gdk.KEY_c:
+        elif action == 'mode':
             self.toggle_mode(None)
-        elif keyval == Gdk.KEY_y:
-            webbrowser.open("https://www.youtube.com/@EXTRUD/shorts")
-        elif keyval == Gdk.KEY_F1 or keyval == Gdk.KEY_question:
+        elif action == 'auto' and self.calibration_mode:
+            self.auto_calibrate(None)
+        elif action == 'rings':
+            self.rings_btn.set_active(not self.rings_btn.get_active())
+        elif action == 'ring-spacing':
+            self.next_ring_spacing()
+        elif action == 'path':
+            self.path_btn.set_active(not self.path_btn.get_active())
+        elif action == 'detect':
+            self.detect_btn.set_active(not self.detect_btn.get_active())
+        elif action == 'youtube':
+            self.open_youtube()
+        elif action == 'help':
             self.show_help(None)
-        return False
+        elif action == 'hud':
+            self.toggle_hud()
+        elif action == 'minimal':
+            self.minimal_btn.set_active(not self.minimal_btn.get_active())
+        elif action == 'snap':
+            self.snap_btn.set_active(not self.snap_btn.get_active())
+        elif action == 'track':
+            self.track_btn.set_active(not self.track_btn.get_active())
+        elif action in ('point-a', 'point-b') and not self.calibration_mode:
+            # Для глобальных клавиш: точка ставится под мышью, клик не нужен
+            x, y = self.snap_position(*(position or self.pointer_position()))
+            if self.path_mode:
+                self.add_waypoint(x, y)
+            elif action == 'point-a':
+                self.place_start(x, y)
+            elif self.start_point:
+                self.place_end(x, y)
 
     def on_key_release(self, widget, event):
         return False
@@ -725,9 +2572,77 @@ class MapRuler(Gtk.Window):
         self.start_point = None
         self.end_point = None
         self.temp_point = None
-        self.distance_value.set_text("0.00 м")
-        self.queue_draw()
-
-win = MapRuler()
-win.show_all()
-Gtk.main()
+        for index in range(len(self.path)):
+            self.unindex_marker(('vertex', index))
+        self.path.clear()
+        self.path_drag = None
+        self.point_drag = None
+        self.index_ruler_points()
+        self.set_distance_text("0.00 м")
+        self.publish_state()
+        self.refresh()
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['--headless']:
+        # Пакетный расчёт без окна: JSONL на stdin, расстояния на stdout
+        return wt_core.main(argv[1:])
+
+    record_path = option_value(argv, '--record')
+    replay_path = option_value(argv, '--replay')
+    if replay_path:
+        return replay(replay_path, fast='--fast' in argv)
+
+    trace_path = option_value(argv, '--trace') or os.environ.get(TRACE_ENV)
+    tracer = wt_metrics.Tracer(trace_path) if trace_path else None
+
+    win = MapRuler(startup_profile='--startup-profile' in argv, tracer=tracer)
+    win.show_all()
+    metrics_path = option_value(argv, '--metrics-json')
+    if metrics_path:
+        win.start_metrics_export(metrics_path)
+    if record_path:
+        import wt_replay
+        width, height = win.get_size()
+        config_text = wt_core.config_to_text(wt_core.read_config(win.config_file))
+        win.recorder = wt_replay.Recorder(record_path, width, height, config_text)
+    Gtk.main()
+    return 0
+
+
+def option_value(argv, name):
+    """Значение параметра командной строки вида '--name значение' или None"""
+    if name in argv:
+        index = argv.index(name) + 1
+        if index < len(argv):
+            return argv[index]
+    return None
+
+
+def replay(path, fast=False):
+    """Воспроизводит журнал сессии в окне с настройками на момент записи"""
+    import tempfile
+    import wt_replay
+    width, height, config_text, records = wt_replay.read_log(path)
+
+    # Копия настроек из журнала: воспроизведение не трогает калибровку пользователя
+    with tempfile.TemporaryDirectory(prefix="wt_replay_") as directory:
+        config_file = os.path.join(directory, "calibration.ini")
+        with open(config_file, 'w', encoding='utf-8') as f:
+            f.write(config_text)
+
+        def done(player):
+            print(player.summary(), file=sys.stderr)
+            win.destroy()
+
+        win = MapRuler(config_file=config_file)
+        win.resize(width, height)
+        # Плеер задаётся до показа окна: от него зависят глобальные клавиши и сокет API
+        win.player = wt_replay.Player(win, records, fast=fast, on_done=done)
+        win.show_all()
+        Gtk.main()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,515 @@
+"""Анализ снимков экрана для дальномера War Thunder.
+
+Модуль не зависит от GTK: на вход принимаются массивы NumPy (высота, ширина, каналы).
+"""
+from collections import namedtuple
+import math
+
+import numpy as np
+
+from wt_core import GRID_CELLS
+
+# Найденная сетка карты: шаг линий и смещение первой линии в пикселях
+GridEstimate = namedtuple('GridEstimate', 'step offset_x offset_y score')
+
+
+def pad_image(image, left, top, width, height):
+    """Снимок, угол которого смещён на (left, top) от запрошенного, в рамке
+    width x height; то, что не попало на снимок (за краем экрана), - чёрное"""
+    if (left, top) == (0, 0) and image.shape[:2] == (height, width):
+        return image
+    framed = np.zeros((height, width) + image.shape[2:], dtype=image.dtype)
+    framed[top:top + image.shape[0], left:left + image.shape[1]] = image[:height - top, :width - left]
+    return framed
+
+
+def array_from_pixels(pixels, width, height, rowstride, n_channels):
+    """Представление буфера пикселей (например, GdkPixbuf) массивом без копирования"""
+    buf = np.frombuffer(pixels, dtype=np.uint8)
+    return np.lib.stride_tricks.as_strided(
+        buf, shape=(height, width, n_channels), strides=(rowstride, n_channels, 1),
+        writeable=False)
+
+
+def to_gray(image):
+    """Яркость изображения RGB(A) в float32"""
+    rgb = image[..., :3].astype(np.float32)
+    return rgb[..., 0] * 0.299 + rgb[..., 1] * 0.587 + rgb[..., 2] * 0.114
+
+
+def line_profile(gray, axis):
+    """Профиль тонких линий вдоль оси: отклонение средней яркости от её сглаженного хода"""
+    mean = gray.mean(axis=axis)
+    kernel = np.ones(9, dtype=np.float32) / 9
+    smooth = np.convolve(np.pad(mean, 4, mode='edge'), kernel, mode='valid')
+    return np.abs(mean - smooth)
+
+
+def autocorrelation(profile):
+    """Нормированная автокорреляция профиля через FFT"""
+    p = profile - profile.mean()
+    n = len(p)
+    size = 1 << (2 * n - 1).bit_length()
+    spectrum = np.fft.rfft(p, size)
+    ac = np.fft.irfft(spectrum * np.conj(spectrum), size)[:n]
+    if ac[0] <= 0:
+        return np.zeros(n)
+    # Делим на число перекрывающихся отсчётов, чтобы не занижать большие сдвиги
+    return ac / ac[0] * n / (n - np.arange(n))
+
+
+def estimate_period(ac, min_period, max_period):
+    """Шаг сетки по пику автокорреляции с уточнением до долей пикселя"""
+    lo = max(2, int(min_period))
+    hi = min(int(max_period), len(ac) - 2)
+    if hi <= lo:
+        return None, 0.0
+    lag = lo + int(np.argmax(ac[lo:hi + 1]))
+    # Пики есть и на кратных шагах: берём наименьший, не сильно уступающий найденному
+    for divisor in range(lag // lo, 1, -1):
+        sub = int(round(lag / divisor))
+        sub = sub - 1 + int(np.argmax(ac[sub - 1:sub + 2]))
+        if sub >= lo and ac[sub] >= 0.6 * ac[lag]:
+            lag = sub
+            break
+    peak = float(ac[lag])
+
+    # Уточняем по самому дальнему кратному пику: ошибка делится на его номер
+    multiple = max(1, int(len(ac) * 0.6) // lag)
+    center = lag * multiple
+    radius = multiple
+    window = ac[max(1, center - radius):min(len(ac) - 1, center + radius + 1)]
+    top = max(1, center - radius) + int(np.argmax(window))
+    left, middle, right = ac[top - 1], ac[top], ac[top + 1]
+    denom = left - 2 * middle + right
+    shift = 0.5 * (left - right) / denom if denom < 0 else 0.0
+    return float((top + shift) / multiple), peak
+
+
+def estimate_offset(profile, period):
+    """Положение первой линии: фаза гармоники профиля с найденным периодом"""
+    p = profile - profile.mean()
+    k = np.arange(len(p))
+    c = np.sum(p * np.exp(-2j * math.pi * k / period))
+    return float((-math.atan2(c.imag, c.real) / (2 * math.pi) * period) % period)
+
+
+def detect_grid(image, min_step=20, max_step=None, min_score=0.2):
+    """Ищет периодическую сетку карты на снимке.
+
+    Возвращает GridEstimate или None, если уверенной периодичности нет.
+    """
+    gray = to_gray(image)
+    height, width = gray.shape
+    profile_x = line_profile(gray, axis=0)
+    profile_y = line_profile(gray, axis=1)
+
+    # Сетка квадратная: складываем автокорреляции по обеим осям
+    n = min(width, height)
+    ac = autocorrelation(profile_x)[:n] + autocorrelation(profile_y)[:n]
+    if max_step is None:
+        max_step = n // 3
+    step, peak = estimate_period(ac / 2, min_step, max_step)
+    if step is None or peak < min_score:
+        return None
+
+    return GridEstimate(step,
+                        estimate_offset(profile_x, step),
+                        estimate_offset(profile_y, step),
+                        peak)
+
+
+def snap_grid(estimate, near_pos):
+    """Позиция сетки на линиях карты, ближайшая к near_pos"""
+    step = estimate.step
+    x = estimate.offset_x + round((near_pos[0] - estimate.offset_x) / step) * step
+    y = estimate.offset_y + round((near_pos[1] - estimate.offset_y) / step) * step
+    return (x, y)
+
+
+# Размер, к которому приводится каждый символ перед сравнением с образцами
+GLYPH_SHAPE = (16, 10)
+
+
+def otsu_threshold(gray):
+    """Порог яркости по методу Оцу"""
+    hist = np.bincount(np.clip(gray, 0, 255).astype(np.uint8).ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight = np.cumsum(hist)
+    total = weight[-1]
+    mean = np.cumsum(hist * levels)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (mean[-1] * weight / total - mean) ** 2 / (weight * (total - weight))
+    return int(np.nanargmax(between))
+
+
+def text_layer(gray):
+    """Яркость, в которой символы светлые, и их маска.
+
+    Текстом считается меньшая по площади из двух групп яркости по порогу Оцу.
+    """
+    mask = gray > otsu_threshold(gray)
+    if mask.mean() > 0.5:
+        return 255 - gray, ~mask
+    return gray, mask
+
+
+def segment_glyphs(mask, min_pixels=4):
+    """Границы символов строки слева направо: список пар срезов (строки, столбцы)"""
+    columns = np.concatenate(([False], mask.any(axis=0), [False]))
+    edges = np.flatnonzero(columns[1:] != columns[:-1])
+    boxes = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        glyph = mask[:, start:end]
+        if glyph.sum() < min_pixels:
+            continue
+        rows = np.flatnonzero(glyph.any(axis=1))
+        boxes.append((slice(rows[0], rows[-1] + 1), slice(start, end)))
+    return boxes
+
+
+def resize_bilinear(patch, shape):
+    """Билинейное масштабирование двумерного массива"""
+    height, width = patch.shape
+    ys = np.linspace(0, height - 1, shape[0])
+    xs = np.linspace(0, width - 1, shape[1])
+    y0 = np.floor(ys).astype(int)
+    x0 = np.floor(xs).astype(int)
+    y1 = np.minimum(y0 + 1, height - 1)
+    x1 = np.minimum(x0 + 1, width - 1)
+    wy = (ys - y0)[:, None]
+    wx = (xs - x0)[None, :]
+    top = patch[y0[:, None], x0] * (1 - wx) + patch[y0[:, None], x1] * wx
+    bottom = patch[y1[:, None], x0] * (1 - wx) + patch[y1[:, None], x1] * wx
+    return top * (1 - wy) + bottom * wy
+
+
+def normalize_glyph(patch):
+    """Символ, приведённый к GLYPH_SHAPE: вектор с нулевым средним и единичной нормой"""
+    vector = resize_bilinear(patch.astype(np.float32), GLYPH_SHAPE).ravel()
+    vector -= vector.mean()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def glyph_from_image(image):
+    """Единственный (самый крупный) символ на изображении образца"""
+    gray, mask = text_layer(to_gray(image))
+    boxes = segment_glyphs(mask)
+    if not boxes:
+        return None
+    return gray[max(boxes, key=lambda box: mask[box].sum())]
+
+
+class GlyphBank:
+    """Образцы символов, сведённые в матрицу: сравнение со всеми - одно умножение.
+
+    samples - пары (символ, изображение символа в оттенках серого). Один символ
+    может встречаться несколько раз, например отрисованный разными размерами шрифта.
+    """
+
+    def __init__(self, samples):
+        samples = [(char, patch) for char, patch in samples if patch is not None]
+        self.chars = [char for char, patch in samples]
+        self.matrix = np.stack([normalize_glyph(patch) for char, patch in samples])
+
+    def classify(self, patch):
+        """Наиболее похожий символ и коэффициент корреляции с ним"""
+        scores = self.matrix @ normalize_glyph(patch)
+        index = int(np.argmax(scores))
+        return self.chars[index], float(scores[index])
+
+    def read_number(self, image, min_score=0.7):
+        """Первое число на изображении или None"""
+        gray, mask = text_layer(to_gray(image))
+        digits = ''
+        for box in segment_glyphs(mask):
+            char, score = self.classify(gray[box])
+            if score >= min_score and char.isdigit():
+                digits += char
+            elif digits:
+                break
+        return int(digits) if digits else None
+
+
+class ScaleDetector:
+    """Определяет масштаб карты по надписи на снимке.
+
+    Результат запоминается вместе с хешем снимка и пересчитывается, только
+    когда изображение изменилось.
+    """
+
+    def __init__(self, bank, scales):
+        self.bank = bank
+        self.scales = set(scales)
+        self.last_hash = None
+        self.last_scale = None
+
+    def detect(self, image):
+        import zlib
+        digest = zlib.crc32(np.ascontiguousarray(image).data)
+        if digest != self.last_hash:
+            value = self.bank.read_number(image)
+            self.last_scale = value if value in self.scales else None
+            self.last_hash = digest
+        return self.last_scale
+
+
+# Найденный маркер: центр масс в координатах снимка и площадь в пикселях
+MarkerBlob = namedtuple('MarkerBlob', 'x y area')
+
+
+def pixel_hue(rgb):
+    """Тон в градусах для массива пикселей (N, 3)"""
+    rgb = rgb.astype(np.float32)
+    r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+    top = rgb.max(axis=1)
+    chroma = top - rgb.min(axis=1)
+    chroma[chroma == 0] = 1
+    hue = np.where(top == r, (g - b) / chroma % 6,
+                   np.where(top == g, (b - r) / chroma + 2, (r - g) / chroma + 4))
+    return hue * 60
+
+
+def marker_mask(image, hue_ranges, min_saturation=0.55, min_chroma=60):
+    """Пиксели насыщенных цветов маркеров.
+
+    hue_ranges - пары (от, до) тона в градусах; диапазон через 0 (красный)
+    задаётся как (345, 15). Затемнение оверлея серым тон почти не меняет.
+    Тон считается только для пикселей, прошедших порог насыщенности.
+    """
+    r, g, b = image[..., 0], image[..., 1], image[..., 2]
+    top = np.maximum(np.maximum(r, g), b)
+    chroma = top - np.minimum(np.minimum(r, g), b)
+    # Насыщенность без деления: chroma / top >= min_saturation
+    mask = chroma >= min_chroma
+    mask &= chroma.astype(np.uint16) * 256 >= top.astype(np.uint16) * int(min_saturation * 256)
+    ys, xs = np.nonzero(mask)
+    if not len(ys):
+        return mask
+    hue = pixel_hue(image[ys, xs, :3])
+    matched = np.zeros(len(hue), dtype=bool)
+    for lo, hi in hue_ranges:
+        if lo <= hi:
+            matched |= (hue >= lo) & (hue <= hi)
+        else:
+            matched |= (hue >= lo) | (hue <= hi)
+    mask[ys[~matched], xs[~matched]] = False
+    return mask
+
+
+def label_components(mask):
+    """Метки 4-связных компонент маски.
+
+    Метка пикселя - наименьший плоский индекс пикселя его компоненты, у фона -
+    mask.size. Метки распространяются минимумом по соседям, а переход по
+    ссылке «метка метки» сокращает число шагов до логарифма размера компоненты.
+    """
+    height, width = mask.shape
+    background = mask.size
+    labels = np.where(mask, np.arange(mask.size).reshape(height, width), background)
+    while True:
+        spread = labels.copy()
+        np.minimum(spread[1:], labels[:-1], out=spread[1:])
+        np.minimum(spread[:-1], labels[1:], out=spread[:-1])
+        np.minimum(spread[:, 1:], labels[:, :-1], out=spread[:, 1:])
+        np.minimum(spread[:, :-1], labels[:, 1:], out=spread[:, :-1])
+        spread[~mask] = background
+        flat = spread.ravel()
+        inside = flat < background
+        flat[inside] = flat[flat[inside]]
+        if np.array_equal(spread, labels):
+            return labels
+        labels = spread
+
+
+def find_markers(image, hue_ranges, min_area=6, max_area=400):
+    """Маркеры заданных цветов на снимке: список MarkerBlob"""
+    mask = marker_mask(image, hue_ranges)
+    if not mask.any():
+        return []
+    labels = label_components(mask)
+    ys, xs = np.nonzero(mask)
+    ids, inverse, areas = np.unique(labels[ys, xs], return_inverse=True, return_counts=True)
+    cx = np.bincount(inverse, xs) / areas
+    cy = np.bincount(inverse, ys) / areas
+    keep = (areas >= min_area) & (areas <= max_area)
+    return [MarkerBlob(float(x), float(y), int(area))
+            for x, y, area in zip(cx[keep], cy[keep], areas[keep])]
+
+
+class MarkerSnapper:
+    """Притягивание точки к центру ближайшего маркера.
+
+    capture(rect) снимает область окна rect = (x, y, w, h). Снимается окно
+    вокруг курсора, выровненное по клеткам cell, с запасом margin на размер
+    маркера; найденные в нём маркеры кэшируются, пока кадр не старше max_age
+    секунд, поэтому движение мыши в пределах клетки ничего не пересчитывает.
+    """
+
+    def __init__(self, capture, hue_ranges, radius=20, cell=16, margin=12, max_age=1 / 30):
+        self.capture = capture
+        self.hue_ranges = hue_ranges
+        self.radius = radius
+        self.cell = cell
+        self.margin = margin
+        self.max_age = max_age
+        self.cache = {}  # угол окна -> маркеры в координатах окна
+        self.frame_time = 0.0
+
+    def invalidate(self):
+        self.cache.clear()
+
+    def markers_near(self, x, y):
+        import time
+        now = time.perf_counter()
+        if now - self.frame_time > self.max_age:
+            self.cache.clear()
+            self.frame_time = now
+        cell = self.cell
+        reach = self.radius + self.margin
+        x0 = int(math.floor((x - reach) / cell)) * cell
+        y0 = int(math.floor((y - reach) / cell)) * cell
+        markers = self.cache.get((x0, y0))
+        if markers is None:
+            size = int(math.ceil(2 * reach / cell)) * cell + cell
+            image = self.capture((x0, y0, size, size))
+            markers = []
+            if image is not None:
+                # Снимок мог обрезаться по левому и верхнему краю окна
+                ox, oy = max(0, x0), max(0, y0)
+                markers = [MarkerBlob(m.x + ox, m.y + oy, m.area)
+                           for m in find_markers(image, self.hue_ranges)]
+            self.cache[(x0, y0)] = markers
+        return markers
+
+    def snap(self, x, y):
+        """Центр ближайшего маркера в радиусе radius или None"""
+        best = None
+        best_d2 = self.radius * self.radius
+        for marker in self.markers_near(x, y):
+            d2 = (marker.x - x) ** 2 + (marker.y - y) ** 2
+            if d2 <= best_d2:
+                best, best_d2 = marker, d2
+        return (best.x, best.y) if best is not None else None
+
+
+def chroma_image(image):
+    """Разброс каналов max - min в float32: белые линии оверлея и серое затемнение
+    дают ноль, цветные маркеры - большие значения"""
+    r, g, b = image[..., 0], image[..., 1], image[..., 2]
+    top = np.maximum(np.maximum(r, g), b)
+    return (top - np.minimum(np.minimum(r, g), b)).astype(np.float32)
+
+
+def box_sums(values, shape):
+    """Суммы values по всем окнам размера shape через интегральное изображение"""
+    th, tw = shape
+    integral = np.zeros((values.shape[0] + 1, values.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(values, axis=0), axis=1, out=integral[1:, 1:])
+    return integral[th:, tw:] - integral[:-th, tw:] - integral[th:, :-tw] + integral[:-th, :-tw]
+
+
+def match_template(image, template):
+    """Нормированная взаимная корреляция шаблона со всеми его положениями на image"""
+    from numpy.lib.stride_tricks import sliding_window_view
+    t = template - template.mean()
+    t_norm = float(np.linalg.norm(t))
+    if t_norm == 0:
+        return None
+    # Шаблон с нулевым средним: среднее окна на числитель не влияет
+    numerator = np.einsum('ijkl,kl->ij', sliding_window_view(image, template.shape), t)
+    n = template.size
+    sums = box_sums(image, template.shape)
+    variance = box_sums(image * image, template.shape) - sums * sums / n
+    return numerator / (np.sqrt(np.maximum(variance, 1e-6)) * t_norm)
+
+
+def refine_peak(scores, row, col):
+    """Положение максимума с долями пикселя по параболе через соседей"""
+    def shift(left, middle, right):
+        denom = left - 2 * middle + right
+        return 0.5 * (left - right) / denom if denom < 0 else 0.0
+    dy = shift(scores[row - 1, col], scores[row, col], scores[row + 1, col]) \
+        if 0 < row < scores.shape[0] - 1 else 0.0
+    dx = shift(scores[row, col - 1], scores[row, col], scores[row, col + 1]) \
+        if 0 < col < scores.shape[1] - 1 else 0.0
+    return row + dy, col + dx
+
+
+class TemplateTracker:
+    """Слежение за маркером по шаблону в небольшой области поиска.
+
+    Шаблон - окрестность маркера размером 2 * half + 1 в изображении разброса
+    каналов (см. chroma_image), поиск - нормированной корреляцией в пределах
+    search пикселей от прошлого положения. При уверенном совпадении шаблон
+    понемногу обновляется, чтобы следовать за поворотом значка, а положение
+    уточняется по центру масс значка - он от поворота не зависит, поэтому
+    обновление шаблона не уводит точку с маркера.
+    """
+
+    def __init__(self, half=10, search=24, min_confidence=0.5, learn_above=0.8, learn_rate=0.1):
+        self.half = half
+        self.search = search
+        self.min_confidence = min_confidence
+        self.learn_above = learn_above
+        self.learn_rate = learn_rate
+        self.template = None
+        self.x = self.y = None
+        self.confidence = 0.0
+
+    def window(self):
+        """Область снимка для следующего шага: (x, y, w, h) в координатах окна"""
+        reach = self.half + self.search
+        return (int(round(self.x)) - reach, int(round(self.y)) - reach, 2 * reach + 1, 2 * reach + 1)
+
+    def patch(self, feature, origin, x, y):
+        col = int(round(x)) - origin[0] - self.half
+        row = int(round(y)) - origin[1] - self.half
+        size = 2 * self.half + 1
+        if row < 0 or col < 0 or row + size > feature.shape[0] or col + size > feature.shape[1]:
+            return None
+        return feature[row:row + size, col:col + size]
+
+    def recenter(self, feature, origin):
+        """Сдвигает положение в центр масс значка в окрестности шаблона"""
+        patch = self.patch(feature, origin, self.x, self.y)
+        if patch is None or not patch.any():
+            return
+        weights = np.where(patch > 0.5 * patch.max(), patch, 0)
+        total = weights.sum()
+        rows, cols = np.indices(patch.shape)
+        self.x = int(round(self.x)) + float((weights * cols).sum() / total) - self.half
+        self.y = int(round(self.y)) + float((weights * rows).sum() / total) - self.half
+
+    def start(self, image, origin, x, y):
+        """Запоминает шаблон вокруг (x, y); image снят с левым верхним углом origin"""
+        self.x, self.y = x, y
+        feature = chroma_image(image)
+        self.recenter(feature, origin)
+        patch = self.patch(feature, origin, self.x, self.y)
+        self.template = None if patch is None or not patch.any() else patch.copy()
+        self.confidence = 1.0 if self.template is not None else 0.0
+        return self.template is not None
+
+    def update(self, image, origin):
+        """Новое положение маркера (x, y) или None, если уверенного совпадения нет"""
+        feature = chroma_image(image)
+        if feature.shape[0] <= self.template.shape[0] or feature.shape[1] <= self.template.shape[1]:
+            return None
+        scores = match_template(feature, self.template)
+        if scores is None:
+            return None
+        row, col = np.unravel_index(int(np.argmax(scores)), scores.shape)
+        self.confidence = float(scores[row, col])
+        if self.confidence < self.min_confidence:
+            return None
+        row, col = refine_peak(scores, row, col)
+        self.x = origin[0] + col + self.half
+        self.y = origin[1] + row + self.half
+        self.recenter(feature, origin)
+        if self.confidence >= self.learn_above:
+            patch = self.patch(feature, origin, self.x, self.y)
+            if patch is not None:
+                self.template += self.learn_rate * (patch - self.template)
+        return self.x, self.y
@@ -0,0 +1,215 @@
+"""Минимальные привязки Xlib через ctypes.
+
+Нужны там, где GTK не даёт доступа к X-серверу: глобальные горячие клавиши и
+быстрый захват экрана. Библиотеки загружаются при импорте модуля; если их нет
+(Wayland без XWayland, другая ОС), импорт завершается ошибкой OSError.
+"""
+import ctypes
+import ctypes.util
+import threading
+
+
+def load_library(name):
+    path = ctypes.util.find_library(name)
+    if path is None:
+        raise OSError(f"не найдена библиотека lib{name}")
+    return ctypes.CDLL(path)
+
+
+xlib = load_library('X11')
+
+Display_p = ctypes.c_void_p
+Window = ctypes.c_ulong
+Drawable = ctypes.c_ulong
+KeySym = ctypes.c_ulong
+Time = ctypes.c_ulong
+
+# Типы событий
+KeyPress = 2
+KeyRelease = 3
+
+# Модификаторы
+ShiftMask = 1 << 0
+LockMask = 1 << 1
+ControlMask = 1 << 2
+Mod1Mask = 1 << 3  # Alt
+Mod2Mask = 1 << 4  # NumLock
+Mod4Mask = 1 << 6  # Super
+
+GrabModeAsync = 1
+
+# Формат изображений и порядок байтов
+ZPixmap = 2
+LSBFirst = 0
+AllPlanes = 0xffffffffffffffff if ctypes.sizeof(ctypes.c_ulong) == 8 else 0xffffffff
+
+# Коды ошибок, которые нужно отличать
+BadAccess = 10
+
+
+class XKeyEvent(ctypes.Structure):
+    _fields_ = [
+        ('type', ctypes.c_int),
+        ('serial', ctypes.c_ulong),
+        ('send_event', ctypes.c_int),
+        ('display', Display_p),
+        ('window', Window),
+        ('root', Window),
+        ('subwindow', Window),
+        ('time', Time),
+        ('x', ctypes.c_int),
+        ('y', ctypes.c_int),
+        ('x_root', ctypes.c_int),
+        ('y_root', ctypes.c_int),
+        ('state', ctypes.c_uint),
+        ('keycode', ctypes.c_uint),
+        ('same_screen', ctypes.c_int),
+    ]
+
+
+class XEvent(ctypes.Union):
+    _fields_ = [
+        ('type', ctypes.c_int),
+        ('xkey', XKeyEvent),
+        ('pad', ctypes.c_long * 24),
+    ]
+
+
+class XErrorEvent(ctypes.Structure):
+    _fields_ = [
+        ('type', ctypes.c_int),
+        ('display', Display_p),
+        ('resourceid', ctypes.c_ulong),
+        ('serial', ctypes.c_ulong),
+        ('error_code', ctypes.c_ubyte),
+        ('request_code', ctypes.c_ubyte),
+        ('minor_code', ctypes.c_ubyte),
+    ]
+
+
+class XImage(ctypes.Structure):
+    _fields_ = [
+        ('width', ctypes.c_int),
+        ('height', ctypes.c_int),
+        ('xoffset', ctypes.c_int),
+        ('format', ctypes.c_int),
+        ('data', ctypes.c_void_p),
+        ('byte_order', ctypes.c_int),
+        ('bitmap_unit', ctypes.c_int),
+        ('bitmap_bit_order', ctypes.c_int),
+        ('bitmap_pad', ctypes.c_int),
+        ('depth', ctypes.c_int),
+        ('bytes_per_line', ctypes.c_int),
+        ('bits_per_pixel', ctypes.c_int),
+        ('red_mask', ctypes.c_ulong),
+        ('green_mask', ctypes.c_ulong),
+        ('blue_mask', ctypes.c_ulong),
+        ('obdata', ctypes.c_void_p),
+        ('f', ctypes.c_void_p * 6),  # Функции изображения, вызываются только из Xlib
+    ]
+
+
+class XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ('shmseg', ctypes.c_ulong),
+        ('shmid', ctypes.c_int),
+        ('shmaddr', ctypes.c_void_p),
+        ('readOnly', ctypes.c_int),
+    ]
+
+
+XErrorHandler = ctypes.CFUNCTYPE(ctypes.c_int, Display_p, ctypes.POINTER(XErrorEvent))
+
+
+def declare(name, restype, *argtypes, library=xlib):
+    func = getattr(library, name)
+    func.restype = restype
+    func.argtypes = argtypes
+    return func
+
+
+XOpenDisplay = declare('XOpenDisplay', Display_p, ctypes.c_char_p)
+XCloseDisplay = declare('XCloseDisplay', ctypes.c_int, Display_p)
+XDefaultRootWindow = declare('XDefaultRootWindow', Window, Display_p)
+XConnectionNumber = declare('XConnectionNumber', ctypes.c_int, Display_p)
+XStringToKeysym = declare('XStringToKeysym', KeySym, ctypes.c_char_p)
+XKeysymToKeycode = declare('XKeysymToKeycode', ctypes.c_ubyte, Display_p, KeySym)
+XGrabKey = declare('XGrabKey', ctypes.c_int, Display_p, ctypes.c_int, ctypes.c_uint, Window,
+                   ctypes.c_int, ctypes.c_int, ctypes.c_int)
+XUngrabKey = declare('XUngrabKey', ctypes.c_int, Display_p, ctypes.c_int, ctypes.c_uint, Window)
+XPending = declare('XPending', ctypes.c_int, Display_p)
+XNextEvent = declare('XNextEvent', ctypes.c_int, Display_p, ctypes.POINTER(XEvent))
+XSync = declare('XSync', ctypes.c_int, Display_p, ctypes.c_int)
+XFlush = declare('XFlush', ctypes.c_int, Display_p)
+XSetErrorHandler = declare('XSetErrorHandler', ctypes.c_void_p, ctypes.c_void_p)
+XDefaultScreen = declare('XDefaultScreen', ctypes.c_int, Display_p)
+XDefaultVisual = declare('XDefaultVisual', ctypes.c_void_p, Display_p, ctypes.c_int)
+XDefaultDepth = declare('XDefaultDepth', ctypes.c_int, Display_p, ctypes.c_int)
+XDisplayWidth = declare('XDisplayWidth', ctypes.c_int, Display_p, ctypes.c_int)
+XDisplayHeight = declare('XDisplayHeight', ctypes.c_int, Display_p, ctypes.c_int)
+XGetImage = declare('XGetImage', ctypes.POINTER(XImage), Display_p, Drawable, ctypes.c_int,
+                    ctypes.c_int, ctypes.c_uint, ctypes.c_uint, ctypes.c_ulong, ctypes.c_int)
+XDestroyImage = declare('XDestroyImage', ctypes.c_int, ctypes.POINTER(XImage))
+
+# Расширение MIT-SHM: сервер пишет изображение прямо в общую память процесса.
+# libXext может не быть - тогда захват идёт только через XGetImage.
+try:
+    xext = load_library('Xext')
+except OSError:
+    xext = None
+else:
+    XShmQueryExtension = declare('XShmQueryExtension', ctypes.c_int, Display_p, library=xext)
+    XShmCreateImage = declare('XShmCreateImage', ctypes.POINTER(XImage), Display_p, ctypes.c_void_p,
+                              ctypes.c_uint, ctypes.c_int, ctypes.c_void_p,
+                              ctypes.POINTER(XShmSegmentInfo), ctypes.c_uint, ctypes.c_uint,
+                              library=xext)
+    XShmAttach = declare('XShmAttach', ctypes.c_int, Display_p, ctypes.POINTER(XShmSegmentInfo),
+                         library=xext)
+    XShmDetach = declare('XShmDetach', ctypes.c_int, Display_p, ctypes.POINTER(XShmSegmentInfo),
+                         library=xext)
+    XShmGetImage = declare('XShmGetImage', ctypes.c_int, Display_p, Drawable, ctypes.POINTER(XImage),
+                           ctypes.c_int, ctypes.c_int, ctypes.c_ulong, library=xext)
+
+
+# Обработчик ошибок Xlib общий для всего процесса: перехваты из разных потоков
+# (горячие клавиши, захват экрана) по очереди
+error_lock = threading.RLock()
+
+
+class ErrorTrap:
+    """Перехват ошибок X на время блока with вместо завершения процесса.
+
+    Обработчик ошибок Xlib общий для всего процесса, поэтому прежний
+    восстанавливается сразу после блока, а блоки разных потоков не
+    пересекаются. Ошибки других соединений не засчитываются.
+    """
+
+    def __init__(self, display):
+        self.display = display
+        self.errors = []
+        self.handler = XErrorHandler(self.on_error)
+        self.previous = None
+
+    def on_error(self, display, event):
+        if display == self.display:
+            self.errors.append(event.contents.error_code)
+        return 0
+
+    def __enter__(self):
+        error_lock.acquire()
+        try:
+            XSync(self.display, 0)
+            self.previous = XSetErrorHandler(ctypes.cast(self.handler, ctypes.c_void_p))
+        except BaseException:
+            error_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            # Ошибки приходят асинхронно: дожидаемся ответа на все запросы блока
+            XSync(self.display, 0)
+            XSetErrorHandler(self.previous)
+        finally:
+            error_lock.release()
+        return False